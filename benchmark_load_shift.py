@@ -0,0 +1,79 @@
+import argparse
+
+import pyomo.environ as pyo
+
+import main
+import profile_construction
+
+"""
+BENCHMARK: LOAD-SHIFTING CONSTRUCTION TIME
+"""
+#Tiles the sample horizon into longer ones (every block gets its own copy of the hours and of the
+#load-shifting intervals) and times create_instance. With the precomputed LoadShiftTimes/TimeOutsideLoadShift
+#index the seconds per hour should stay roughly flat as |Time| grows, for the load-shifting
+#constraints as well as for the whole build.
+#
+#   python benchmark_load_shift.py --hours 24 96 384 1536 --single-path
+
+LOAD_SHIFT_COMPONENTS = ("LoadShiftTimes", "TimeInLoadShift", "TimeOutsideLoadShift", "LoadShiftingWindow",
+                         "NoDischargeOutsideLoadShift", "NochargeOutsideLoadShift", "MaxTotalUpDwnLoadShift",
+                         "aFRRUpLimitLoadShift", "aFRRDownLimitLoadShift", "NoaFRRUpOutsideLoadShift",
+                         "NoaFRRDwnOutsideLoadShift")
+
+def _shift(key, positions, offset):
+    if not positions:
+        return key
+    if not isinstance(key, tuple):
+        return key + offset
+    return tuple(k + offset if j in positions else k for j, k in enumerate(key))
+
+# Repeat the sample horizon `blocks` times: hours of block k are offset by k*|Time|,
+# load-shifting intervals by k*|LoadShiftingIntervals|
+def tile_data(data, blocks):
+    data = data[None]
+    hours = len(data["Time"][None])
+    intervals = len(data["LoadShiftingIntervals"][None])
+    tiled = {}
+    for name, values in data.items():
+        component = getattr(main.model, name)
+        time_pos = main.key_positions(component, main.model.Time)
+        if name == "LoadShiftingIntervals":
+            tiled[name] = {None: [i + k*intervals for k in range(blocks) for i in values[None]]}
+        elif name == "TimeLoadShift":
+            tiled[name] = {None: [(i + k*intervals, t + k*hours) for k in range(blocks) for (i, t) in values[None]]}
+        elif not time_pos:
+            tiled[name] = values
+        elif isinstance(component, pyo.Set):
+            tiled[name] = {None: [_shift(key, time_pos, k*hours) for k in range(blocks) for key in values[None]]}
+        else:
+            tiled[name] = {_shift(key, time_pos, k*hours): v for k in range(blocks) for key, v in values.items()}
+    return {None: tiled}
+
+# Keep one day-ahead node and its first real-time child, so long horizons stay cheap to build
+def single_path(data):
+    da = data[None]["Nodes_DA"][None][0]
+    rt = next(child for (child, parent) in data[None]["Parent_Node"][None] if parent == da and child in data[None]["Nodes_RT"][None])
+    return main.restrict_data(data, nodes=[da, rt])
+
+def build_times(data):
+    instance, total, seconds = profile_construction.timed_build(data)
+    load_shift = sum(seconds.get(name, 0.0) for name in LOAD_SHIFT_COMPONENTS)
+    return instance, total, load_shift
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time model construction against horizon length")
+    parser.add_argument("--hours", type=int, nargs="+", default=[24, 96, 384, 1536])
+    parser.add_argument("--single-path", action="store_true", help="keep one day-ahead node and one real-time node")
+    args = parser.parse_args()
+
+    data = main.load_data(main.read_all_sheets(main.INPUT_EXCEL))
+    if args.single_path:
+        data = single_path(data)
+    block = len(data[None]["Time"][None])
+
+    print(f"{'hours':>8} {'constraints':>12} {'build [s]':>10} {'load shift [s]':>15} {'ms/hour':>8} {'load shift ms/hour':>19}")
+    for hours in args.hours:
+        blocks = max(1, hours // block)
+        instance, total, load_shift = build_times(tile_data(data, blocks))
+        n = len(instance.Time)
+        print(f"{n:>8} {instance.nconstraints():>12} {total:>10.2f} {load_shift:>15.3f} {1e3*total/n:>8.2f} {1e3*load_shift/n:>19.3f}")
@@ -0,0 +1,128 @@
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pyomo
+import pyomo.environ as pyo
+from pyomo.core.expr.visitor import identify_variables
+
+import generate_instance
+import main
+
+"""
+BENCHMARK: MODEL SCALING
+"""
+#Generates instances of growing size (generate_instance.py), writes each to a workbook and times every
+#phase of a run on it: convert (read_all_sheets), load (load_data), build (create_instance), write (the
+#LP file a file-based solver would get), solve, result load and export (save_results_to_parquet). Every
+#case runs in a fresh process, so the peak RSS of that process (and of the solver processes it started)
+#belongs to the case alone. One JSON line per case is appended to --out, with the git commit, the sizes,
+#the variable/constraint/nonzero counts and the objective, so runs of different versions can be compared.
+#
+#   python benchmark_scaling.py --hours 24 96 --da 4 --rt 4 8 --solver appsi_highs --out benchmark_results.jsonl
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _peak_rss_mb(children=False):
+    if resource is None:
+        # No getrusage on Windows: main's fallback measures this process only
+        return None if children else main._peak_memory_mb()
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if platform.system() == "Darwin" else peak / 1024
+
+def run_case(template_tables, sizes, solver, options):
+    phases = {}
+    with tempfile.TemporaryDirectory() as folder:
+        data = generate_instance.generate(main.load_data(template_tables), **sizes)
+        excel = os.path.join(folder, "input.xlsx")
+        generate_instance.write_workbook(generate_instance.to_tables(data, template_tables), excel)
+
+        def timed(phase, function, *args, **kwargs):
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            phases[phase] = time.perf_counter() - start
+            return result
+
+        tables = timed("convert", main.read_all_sheets, excel, manifest_file=os.path.join(folder, "manifest.json"), cache_file=os.path.join(folder, "cache.npz"))
+        data = timed("load", main.load_data, tables)
+        instance = timed("build", main.model.create_instance, data)
+        timed("write", instance.write, os.path.join(folder, "model.lp"), io_options={"symbolic_solver_labels": False})
+
+        opt = pyo.SolverFactory(solver)
+        for key, value in (options or {}).items():
+            opt.options[key] = value
+        results = timed("solve", opt.solve, instance, load_solutions=False)
+        condition = str(results.solver.termination_condition)
+        objective = None
+        if results.solver.termination_condition == pyo.TerminationCondition.optimal:
+            timed("result_load", instance.solutions.load_from, results)
+            objective = pyo.value(instance.Objective)
+            timed("export", main.save_results_to_parquet, instance, os.path.join(folder, "results"))
+
+    constraints = list(instance.component_data_objects(pyo.Constraint, active=True))
+    return {
+        **sizes,
+        "variables": instance.nvariables(),
+        "constraints": len(constraints),
+        "nonzeros": sum(sum(1 for _ in identify_variables(c.body, include_fixed=False)) for c in constraints),
+        "termination": condition,
+        "objective": objective,
+        "seconds": phases,
+        "peak_rss_mb": _peak_rss_mb(),
+        "solver_peak_rss_mb": _peak_rss_mb(children=True),
+    }
+
+def benchmark(template_tables, cases, solver="appsi_highs", options=None, out="benchmark_results.jsonl", log=print):
+    common = {
+        "commit": _commit(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "pyomo": pyomo.version.version,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "solver": solver,
+    }
+    rows = []
+    for sizes in cases:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            row = {**common, **pool.submit(run_case, template_tables, sizes, solver, options).result()}
+        with open(out, "a") as f:
+            f.write(json.dumps(row) + "\n")
+        log(f"{sizes}: {row['variables']} variables, {row['constraints']} constraints, {row['nonzeros']} nonzeros, "
+            + ", ".join(f"{phase} {seconds:.2f} s" for phase, seconds in row["seconds"].items())
+            + f", peak RSS {row['peak_rss_mb']:.0f} MB")
+        rows.append(row)
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time every phase of a run on generated instances of growing size")
+    parser.add_argument("--da", type=int, nargs="+", default=[4])
+    parser.add_argument("--rt", type=int, nargs="+", default=[4])
+    parser.add_argument("--hours", type=int, nargs="+", default=[24, 96])
+    parser.add_argument("--months", type=int, nargs="+", default=[1])
+    parser.add_argument("--technology-copies", type=int, nargs="+", default=[1])
+    parser.add_argument("--flexible-copies", type=int, nargs="+", default=[1])
+    parser.add_argument("--solver", default="appsi_highs")
+    parser.add_argument("--out", default="benchmark_results.jsonl")
+    args = parser.parse_args()
+
+    grid = {"da": args.da, "rt": args.rt, "hours": args.hours, "months": args.months,
+            "technology_copies": args.technology_copies, "flexible_copies": args.flexible_copies}
+    cases = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    benchmark(main.read_all_sheets(main.INPUT_EXCEL), cases, solver=args.solver, out=args.out)
+    print(f"Results appended to {args.out}")
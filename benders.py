@@ -0,0 +1,162 @@
+import argparse
+
+import pyomo.environ as pyo
+
+import decomposition
+import main
+
+"""
+BENDERS (L-SHAPED) DECOMPOSITION OVER THE INVESTMENTS
+"""
+#Master: v_new_tech, v_new_bat, the CAPEX limits and one cut variable Theta[r] per day-ahead subtree r,
+#built from an instance with no nodes (so exactly the investment part of the model).
+#Subproblems: one per day-ahead subtree (decomposition.split_data), with the investments pinned to the
+#master's proposal and only the operational cost as objective, solved in parallel in pinned workers.
+#Before the first iteration every Theta[r] gets the subtree's LP relaxation over all investments the
+#master allows as lower bound, so the master stays bounded while it has few cuts.
+#Cuts come from the duals of the pinning constraints of the LP relaxation (binary_RT relaxed), which
+#makes them valid for the MIP as well; the MIP subproblems are solved too for the upper bound. With
+#integer recourse the bounds may therefore stop short of each other, in which case the best
+#investment found is returned after max_iter.
+#
+#   python benders.py --tol 1e-4 --max-iter 30 --workers 4 --lift-bounds
+
+def _lift_bounds(instance):
+    for name in decomposition.INVESTMENTS:
+        for v in getattr(instance, name).values():
+            v.setlb(0)
+            v.setub(None)
+
+def _setup(instances, root, data, lift_bounds):
+    instance = main.model.create_instance(data)
+    if lift_bounds:
+        _lift_bounds(instance)
+    instance.CAPEXTechnologyLim.deactivate()
+    instance.CAPEXFlexibleLoadLim.deactivate()
+    instance.Objective.deactivate()
+    instance.Benders_Objective = pyo.Objective(expr = main.operational_cost(instance), sense = pyo.minimize)
+
+    # Investments are pinned with equalities so their duals give the cut slopes
+    keys = [(name, index) for name in decomposition.INVESTMENTS for index in getattr(instance, name)]
+    instance.Benders_Index = pyo.Set(initialize = range(len(keys)))
+    instance.Benders_Proposal = pyo.Param(instance.Benders_Index, mutable = True, initialize = 0.0)
+    instance.Benders_Pin = pyo.Constraint(instance.Benders_Index, rule = lambda m, k: getattr(m, keys[k][0])[keys[k][1]] == m.Benders_Proposal[k])
+    instances[root] = instance
+    return keys
+
+# Lower bound for Theta[root]: the LP relaxation of the subtree with the investments free within their
+# bounds and the CAPEX limits, i.e. over every investment the master can propose
+def _bound(instances, root, solver, options):
+    instance = instances[root]
+    binaries = [v for v in instance.component_data_objects(pyo.Var) if v.is_binary()]
+    for v in binaries:
+        v.domain = pyo.UnitInterval
+    instance.Benders_Pin.deactivate()
+    instance.CAPEXTechnologyLim.activate()
+    instance.CAPEXFlexibleLoadLim.activate()
+    try:
+        decomposition.solve(instance, solver, options)
+        return pyo.value(instance.Benders_Objective)
+    finally:
+        instance.CAPEXTechnologyLim.deactivate()
+        instance.CAPEXFlexibleLoadLim.deactivate()
+        instance.Benders_Pin.activate()
+        for v in binaries:
+            v.domain = pyo.Binary
+
+# Operational cost of the subtree at the proposal (MIP, for the upper bound) and a cut from the LP relaxation
+def _solve(instances, root, proposal, solver, options):
+    instance = instances[root]
+    for k in instance.Benders_Index:
+        instance.Benders_Proposal[k] = proposal[k]
+
+    decomposition.solve(instance, solver, options)
+    cost = pyo.value(instance.Benders_Objective)
+
+    binaries = [v for v in instance.component_data_objects(pyo.Var) if v.is_binary()]
+    for v in binaries:
+        v.domain = pyo.UnitInterval
+    instance.dual = pyo.Suffix(direction = pyo.Suffix.IMPORT)
+    try:
+        decomposition.solve(instance, solver, options)
+        relaxed = pyo.value(instance.Benders_Objective)
+        slopes = [instance.dual[instance.Benders_Pin[k]] for k in instance.Benders_Index]
+    finally:
+        instance.del_component(instance.dual)
+        for v in binaries:
+            v.domain = pyo.Binary
+    return cost, relaxed, slopes
+
+def benders(data, tol=1e-4, max_iter=30, workers=None, solver="appsi_highs", solver_options=None,
+            lift_bounds=False, log=print):
+    decomposition.check_solver(solver)
+    trees = decomposition.subtrees(data)
+    roots = list(trees)
+    split = decomposition.split_data(data, [trees[r] for r in roots])
+    probability = {r: weight for r, (weight, _) in zip(roots, split)}
+
+    master = main.model.create_instance(main.restrict_data(data, nodes=[]))
+    if lift_bounds:
+        _lift_bounds(master)
+    master.Theta = pyo.Var(roots)
+    master.Cuts = pyo.ConstraintList()
+    master.Objective.deactivate()
+    master.Benders_Objective = pyo.Objective(expr = main.investment_cost(master) + sum(probability[r] * master.Theta[r] for r in roots), sense = pyo.minimize)
+
+    with decomposition.PinnedPool(roots, workers) as pool:
+        keys = pool.map(_setup, {r: (part, lift_bounds) for r, (_, part) in zip(roots, split)})
+        investment = [getattr(master, name)[index] for name, index in keys[roots[0]]]
+        # Without a lower bound on Theta the master is unbounded as soon as a cut slope is negative
+        # along a direction the investment bounds leave open (e.g. with --lift-bounds)
+        bounds = pool.map(_bound, {r: (solver, solver_options) for r in roots})
+        for r in roots:
+            master.Theta[r].setlb(bounds[r])
+
+        # Start from the smallest investments the bounds allow
+        proposal = [v.lb or 0.0 for v in investment]
+        lower, upper, best = -float("inf"), float("inf"), proposal
+        for iteration in range(max_iter):
+            results = pool.map(_solve, {r: (proposal, solver, solver_options) for r in roots})
+
+            for v, value in zip(investment, proposal):
+                v.set_value(value)
+            total = pyo.value(main.investment_cost(master)) + sum(probability[r] * results[r][0] for r in roots)
+            if total < upper:
+                upper, best = total, proposal
+
+            for r in roots:
+                _, relaxed, slopes = results[r]
+                master.Cuts.add(master.Theta[r] >= relaxed + sum(s * (v - value) for s, v, value in zip(slopes, investment, proposal)))
+
+            decomposition.solve(master, solver, solver_options)
+            lower = pyo.value(master.Benders_Objective)
+            proposal = [pyo.value(v) for v in investment]
+            log(f"Benders iteration {iteration}: lower bound {lower:.4f}, upper bound {upper:.4f}")
+            if upper - lower <= tol * max(1.0, abs(upper)):
+                break
+
+    return {
+        "objective": upper,
+        "lower_bound": lower,
+        "iterations": iteration + 1,
+        "converged": upper - lower <= tol * max(1.0, abs(upper)),
+        "investment": {key: value for key, value in zip(keys[roots[0]], best)},
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve the investment problem with Benders decomposition")
+    parser.add_argument("--tol", type=float, default=1e-4)
+    parser.add_argument("--max-iter", type=int, default=30)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--solver", default="appsi_highs")
+    parser.add_argument("--lift-bounds", action="store_true", help="drop the (0, 0) bounds on v_new_tech/v_new_bat; the CAPEX limits still apply")
+    args = parser.parse_args()
+
+    data = main.load_data(main.read_all_sheets(main.INPUT_EXCEL))
+    result = benders(data, tol=args.tol, max_iter=args.max_iter, workers=args.workers, solver=args.solver, lift_bounds=args.lift_bounds)
+    print("-" * 70)
+    print(f"Converged: {result['converged']} after {result['iterations']} iterations")
+    print(f"Objective: {result['objective']:.4f} (lower bound {result['lower_bound']:.4f})")
+    for (name, index), value in result["investment"].items():
+        if value:
+            print(f"{name}[{index}] = {value:.4f}")
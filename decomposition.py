@@ -0,0 +1,154 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pyomo.environ as pyo
+
+import main
+import presolve
+
+"""
+SCENARIO TREE AND WORKER POOL SHARED BY THE DECOMPOSITION SOLVERS
+"""
+#The tree is read from the data dictionary: Parent_Node holds (child, parent) pairs, nodes without a
+#parent are roots and nodes without children are leaves (one scenario per leaf).
+
+def tree(data):
+    parent = {child: p for (child, p) in data[None]["Parent_Node"][None]}
+    children = {n: [] for n in data[None]["Nodes"][None]}
+    for child, p in parent.items():
+        children[p].append(child)
+    return parent, children
+
+# Leaf -> nodes from its root down to the leaf
+def scenario_paths(data):
+    parent, children = tree(data)
+    paths = {}
+    for leaf in (n for n, kids in children.items() if not kids):
+        path = [leaf]
+        while path[-1] in parent:
+            path.append(parent[path[-1]])
+        paths[leaf] = path[::-1]
+    return paths
+
+# Root -> every node below it (the root included), in tree order
+def subtrees(data):
+    parent, children = tree(data)
+    trees = {}
+    for root in (n for n in children if n not in parent):
+        nodes, stack = [], [root]
+        while stack:
+            n = stack.pop()
+            nodes.append(n)
+            stack.extend(reversed(children[n]))
+        trees[root] = nodes
+    return trees
+
+# Data for each part of the tree (scenario paths, subtrees, ...), with the part's probability. A part's
+# probability is that of its leaves, scaled so the parts sum to one. Node_Probability is divided by the
+# total probability of the parts that contain the node, so that sum(probability * part objective)
+# is the objective of the whole tree, with the investment cost counted once.
+def split_data(data, parts):
+    probability = data[None]["Node_Probability"]
+    _, children = tree(data)
+    parts = [set(part) for part in parts]
+    weights = [sum(probability[n] for n in part if not any(c in part for c in children[n])) for part in parts]
+    weights = [w / sum(weights) for w in weights]
+    coverage = {}
+    for part, weight in zip(parts, weights):
+        for n in part:
+            coverage[n] = coverage.get(n, 0.0) + weight
+    split = []
+    for part, weight in zip(parts, weights):
+        part_data = main.restrict_data(data, nodes=part)
+        part_data[None]["Node_Probability"] = {n: probability[n] / coverage[n] for n in part}
+        split.append((weight, part_data))
+    return split
+
+INVESTMENTS = ("v_new_tech", "v_new_bat")
+
+# True when every investment variable is fixed (or has equal bounds). The day-ahead subtrees then share no
+# variable, so the extensive form splits exactly into one problem per subtree.
+def investments_fixed(data):
+    empty = main.model.create_instance(main.restrict_data(data, nodes=[]))
+    return all(v.fixed or (v.lb is not None and v.lb == v.ub) for name in INVESTMENTS for v in getattr(empty, name).values())
+
+def _solve_part(data, solver, options, use_presolve=False):
+    instance = main.model.create_instance(data)
+    if use_presolve:
+        presolve.presolve(instance, log=None)
+    solve(instance, solver, options)
+    values = {var.name: {index: v.value for index, v in var.items() if v.value is not None}
+              for var in instance.component_objects(pyo.Var, active=True)}
+    return pyo.value(instance.Objective), values
+
+# Solve the day-ahead subtrees side by side and merge them: returns the objective of the whole tree and
+# {variable name: {index: value}}; the values are also loaded into `instance` when one is given. With use_presolve
+# every subtree is presolved (presolve.py) in its worker before the solve
+def solve_subtrees(data, instance=None, workers=None, solver="appsi_highs", options=None, use_presolve=False):
+    check_solver(solver)
+    trees = subtrees(data)
+    split = split_data(data, list(trees.values()))
+    with ProcessPoolExecutor(max_workers=min(len(split), workers or os.cpu_count() or 1)) as pool:
+        futures = [(weight, pool.submit(_solve_part, part, solver, options, use_presolve)) for weight, part in split]
+        parts = [(weight, future.result()) for weight, future in futures]
+
+    objective = sum(weight * part_objective for weight, (part_objective, _) in parts)
+    values = {}
+    for _, (_, part_values) in parts:
+        for name, entries in part_values.items():
+            values.setdefault(name, {}).update(entries)
+    if instance is not None:
+        for name, entries in values.items():
+            var = getattr(instance, name)
+            for index, value in entries.items():
+                var[index].set_value(value, skip_validation=True)
+    return objective, values
+
+def check_solver(solver):
+    if not pyo.SolverFactory(solver).available(exception_flag=False):
+        raise RuntimeError(f"Solver '{solver}' is not available")
+
+def solve(instance, solver, options=None):
+    opt = pyo.SolverFactory(solver)
+    for key, value in (options or {}).items():
+        opt.options[key] = value
+    results = opt.solve(instance, load_solutions=False)
+    condition = results.solver.termination_condition
+    if condition != pyo.TerminationCondition.optimal:
+        raise RuntimeError(f"Subproblem not solved to optimality ({condition})")
+    instance.solutions.load_from(results)
+    return results
+
+
+##############################################################
+################## PINNED SINGLE-WORKER POOLS ################
+##############################################################
+#Iterative methods solve the same subproblems over and over. Every part is pinned to one single-worker
+#process pool, which builds its instance once and keeps it in _INSTANCES between calls; only the
+#changing numbers (penalties, fixed values, cuts) are sent to the worker.
+
+_INSTANCES = {}
+
+def _worker_call(function, key, *args):
+    return function(_INSTANCES, key, *args)
+
+class PinnedPool:
+    def __init__(self, keys, workers=None):
+        workers = min(len(keys), workers or os.cpu_count() or 1)
+        self.pools = [ProcessPoolExecutor(max_workers=1) for _ in range(workers)]
+        self.slot = {key: k % workers for k, key in enumerate(keys)}
+
+    # Run function(instances, key, *args) in the worker owning each key; returns {key: result}
+    def map(self, function, args_by_key):
+        futures = {key: self.pools[self.slot[key]].submit(_worker_call, function, key, *args) for key, args in args_by_key.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+    def shutdown(self):
+        for pool in self.pools:
+            pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
@@ -0,0 +1,162 @@
+import argparse
+import itertools
+
+import numpy as np
+import pandas as pd
+
+import main
+
+"""
+SYNTHETIC INSTANCE GENERATOR
+"""
+#Grows the sample workbook into an input set of a chosen size, keeping it consistent with the model:
+#  da, rt            - day-ahead nodes, and real-time children per day-ahead node (Set_parent_coupling,
+#                      equal probabilities in Par_NodesProbability)
+#  hours, months     - hours are split into months of equal length (Subset_of_TimeStepsInMonth)
+#  intervals         - load-shifting windows as long as the sample's, spread evenly over the hours
+#  technology_copies - copies of every technology but Power_Grid (X, X_2, X_3, ...)
+#  flexible_copies   - copies of every flexible load
+#Every new node, hour, technology and flexible load takes its data from a node, hour, ... of the sample
+#(nodes by position in the tree, hours cyclically), optionally with multiplicative noise on the prices
+#and Demand so the scenarios differ. Energy carriers are kept as in the sample: several constraints are
+#written for the named carriers (Electricity, LT, MT), so extra carriers would not be used consistently.
+#
+#   python generate_instance.py --da 4 --rt 8 --hours 168 --months 1 --out Synthetic.xlsx
+
+NOISY = ("Spot_Price", "Intraday_Price", "aFRR_Up_Capacity_Price", "aFRR_Dwn_Capacity_Price", "aFRR_Up_Activation_Price",
+         "aFRR_Dwn_Activation_Price", "RK_Up_Price", "RK_Dwn_Price", "Demand")
+
+# Built explicitly below; everything else is expanded from the sample
+STRUCTURE = ("Time", "Month", "TimeInMonth", "LoadShiftingIntervals", "TimeLoadShift",
+             "Nodes", "Nodes_DA", "Nodes_RT", "Parent_Node", "Node_Probability")
+
+def _tree(template, da, rt):
+    parent = {child: p for (child, p) in template["Parent_Node"][None]}
+    sample_da = template["Nodes_DA"][None]
+    children = {p: [c for c in template["Nodes_RT"][None] if parent.get(c) == p] for p in sample_da}
+    source, parent_node = {}, []
+    for k in range(da):
+        source[k + 1] = sample_da[k % len(sample_da)]
+    for k in range(da):
+        kids = children[source[k + 1]]
+        for j in range(rt):
+            n = da + 1 + k * rt + j
+            source[n] = kids[j % len(kids)]
+            parent_node.append((n, k + 1))
+    return source, parent_node
+
+def _expand(keys, positions, inverse):
+    # All new keys whose elements map back to the sample key
+    options = []
+    for j, element in enumerate(keys):
+        if j in positions:
+            options.append(inverse[positions[j]].get(element, []))
+        else:
+            options.append(inverse["label"].get(element, [element]) if isinstance(element, str) else [element])
+    return itertools.product(*options)
+
+def generate(template, da=4, rt=4, hours=24, months=1, intervals=None, technology_copies=1, flexible_copies=1, noise=0.0, seed=0):
+    template = template[None]
+    sample_hours = template["Time"][None]
+    sample_windows = [[t for (i, t) in template["TimeLoadShift"][None] if i == interval] for interval in template["LoadShiftingIntervals"][None]]
+    window = max(len(w) for w in sample_windows) if sample_windows else 0
+    if intervals is None:
+        intervals = max(1, round(len(sample_windows) * hours / len(sample_hours))) if sample_windows else 0
+    if intervals * window > hours:
+        raise ValueError(f"{intervals} load-shifting windows of {window} hours do not fit in {hours} hours")
+
+    data = {}
+    time = list(range(1, hours + 1))
+    data["Time"] = {None: time}
+    data["Month"] = {None: list(range(1, months + 1))}
+    data["TimeInMonth"] = {None: [(1 + (t - 1) * months // hours, t) for t in time]}
+    data["LoadShiftingIntervals"] = {None: list(range(1, intervals + 1))}
+    # Windows start as far into their share of the hours as the sample's first window starts into the sample
+    offset = sample_hours.index(sample_windows[0][0]) if sample_windows else 0
+    starts = [k * hours // intervals + min(offset, hours // intervals - window) for k in range(intervals)]
+    data["TimeLoadShift"] = {None: [(k + 1, time[s + h]) for k, s in enumerate(starts) for h in range(window)]}
+
+    node_source, parent_node = _tree(template, da, rt)
+    data["Nodes"] = {None: list(node_source)}
+    data["Nodes_DA"] = {None: list(range(1, da + 1))}
+    data["Nodes_RT"] = {None: list(range(da + 1, da + da * rt + 1))}
+    data["Parent_Node"] = {None: parent_node}
+    data["Node_Probability"] = {n: 1.0 / da if n <= da else 1.0 / (da * rt) for n in node_source}
+
+    # Sample label -> new labels, per kind of index
+    inverse = {"Nodes": {}, "Time": {}, "label": {}}
+    for n, s in node_source.items():
+        inverse["Nodes"].setdefault(s, []).append(n)
+    for t in time:
+        inverse["Time"].setdefault(sample_hours[(t - 1) % len(sample_hours)], []).append(t)
+    for name, copies in (("Technology", technology_copies), ("FlexibleLoad", flexible_copies)):
+        for label in template[name][None]:
+            inverse["label"][label] = [label] if label == "Power_Grid" else [label] + [f"{label}_{k}" for k in range(2, copies + 1)]
+
+    rng = np.random.default_rng(seed)
+    for name, values in template.items():
+        if name in STRUCTURE:
+            continue
+        component = getattr(main.model, name)
+        positions = {j: index for index in ("Nodes", "Time") for j in main.key_positions(component, getattr(main.model, index))}
+        if None in values and not isinstance(values[None], list):
+            data[name] = values
+        elif None in values:
+            entries = [key if isinstance(key, tuple) else (key,) for key in values[None]]
+            expanded = [new for key in entries for new in _expand(key, positions, inverse)]
+            data[name] = {None: [key if len(key) > 1 else key[0] for key in expanded]}
+        else:
+            data[name] = {}
+            for key, value in values.items():
+                key = key if isinstance(key, tuple) else (key,)
+                for new in _expand(key, positions, inverse):
+                    data[name][new if len(new) > 1 else new[0]] = value
+            if noise and name in NOISY:
+                factors = 1 + noise * rng.standard_normal(len(data[name]))
+                data[name] = {key: value * f for (key, value), f in zip(data[name].items(), factors)}
+    return {None: data}
+
+# Sheets in the layout of the sample workbook (same sheet and column names), for write_workbook
+def to_tables(data, template_tables):
+    data = data[None]
+    tables = dict(template_tables)
+    for name, sheet in {**main.SET_SOURCES, **main.PARAM_SOURCES}.items():
+        columns = list(template_tables[sheet].columns)
+        if name == "TimeInMonth" and len(columns) == 1:
+            columns = ["Month"] + columns
+        values = data[name]
+        if None in values and isinstance(values[None], list):
+            rows = [key if isinstance(key, tuple) else (key,) for key in values[None]]
+        elif None in values:
+            rows = [(values[None],)]
+        else:
+            rows = [(key if isinstance(key, tuple) else (key,)) + (value,) for key, value in values.items()]
+        tables[sheet] = pd.DataFrame(rows, columns=columns)
+    return tables
+
+# Workbook readable by main.read_all_sheets: two empty rows above the header of every sheet
+def write_workbook(tables, filename):
+    with pd.ExcelWriter(filename, engine="xlsxwriter") as writer:
+        for sheet, table in tables.items():
+            table.to_excel(writer, sheet_name=sheet, startrow=2, index=False)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic input workbook of a chosen size")
+    parser.add_argument("--da", type=int, default=4, help="day-ahead nodes")
+    parser.add_argument("--rt", type=int, default=4, help="real-time nodes per day-ahead node")
+    parser.add_argument("--hours", type=int, default=24)
+    parser.add_argument("--months", type=int, default=1)
+    parser.add_argument("--intervals", type=int, default=None, help="load-shifting windows (default: as dense as in the sample)")
+    parser.add_argument("--technology-copies", type=int, default=1)
+    parser.add_argument("--flexible-copies", type=int, default=1)
+    parser.add_argument("--noise", type=float, default=0.0, help="relative standard deviation of the price and demand noise")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="Synthetic.xlsx")
+    args = parser.parse_args()
+
+    template_tables = main.read_all_sheets(main.INPUT_EXCEL)
+    data = generate(main.load_data(template_tables), da=args.da, rt=args.rt, hours=args.hours, months=args.months,
+                    intervals=args.intervals, technology_copies=args.technology_copies,
+                    flexible_copies=args.flexible_copies, noise=args.noise, seed=args.seed)
+    write_workbook(to_tables(data, template_tables), args.out)
+    print(f"Synthetic input written to {args.out}")
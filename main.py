@@ -3,53 +3,167 @@ import sys
 import pandas as pd
 import pyomo.environ as pyo
 from pyomo.opt import SolverFactory
+from pyomo.common.collections import ComponentMap
+from pyomo.core.expr.numeric_expr import LinearExpression
 import time
 import os 
+import json
+import itertools
+import csv
+import hashlib
 import matplotlib.pyplot as plt
 import platform
-#import psutil
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
 from pyomo.environ import *
 
 ##################################################################################
 ############################### READING EXCEL FILE ###############################
 ##################################################################################
 
-# Function to read all sheets in an Excel file and save each as a .tab file in the current directory
-def read_all_sheets(excel):
-    # Load the Excel file
-    input_excel = pd.ExcelFile(excel)
-    
-    # Loop over each sheet in the workbook
-    for sheet in input_excel.sheet_names:
-        # Read the current sheet, skipping the first two rows
-        input_sheet = pd.read_excel(excel, sheet_name=sheet, skiprows=2)
-
-        # Drop only fully empty rows (optional)
-        data_nonempty = input_sheet.dropna(how='all')
-
-        # Replace spaces in column names with underscores
-        data_nonempty.columns = data_nonempty.columns.astype(str).str.replace(' ', '_')
-
-        # Fill missing values with an empty string
-        data_nonempty = data_nonempty.fillna('')
-
-        # Convert all columns to strings before replacing whitespace characters in values
-        data_nonempty = data_nonempty.applymap(lambda x: str(x) if pd.notnull(x) else "")
-        
-        # Save as a .tab file using only the sheet name as the file namec
-        output_filename = f"{sheet}.tab"
-        data_nonempty.to_csv(output_filename, header=True, index=False, sep='\t')
-        print(f"Saved file: {output_filename}")
-
-# Call the function with your Excel file
-read_all_sheets('Ny_testkode_copy.xlsx')
+INPUT_EXCEL = 'Ny_testkode_copy.xlsx' # Workbook holding all sets and parameters, one sheet each
+WRITE_TAB_FILES = False # Also export every sheet as a .tab file (debugging only, the model is loaded from memory)
+TAB_MANIFEST = ".tab_manifest.json" # Content hashes of the workbook and of every .tab file written from it
+INPUT_CACHE = "input_tables.npz" # Cleaned copy of every sheet, reloaded directly while the workbook is unchanged
+COMPACT_NA = False # Let child nodes use their ancestor's market variables instead of non-anticipativity equalities
+PHYSICAL_RT_ONLY = False # Model physical operation on the real-time nodes only (smaller, but changes the model and its optimum; see Nodes_Physical)
+RT_FORMULATION = "binary" # "binary", "lp" or "sos1": how real-time up and down trades are kept apart (see binary_RT_up)
+SOLVER = "gurobi"
+DECOMPOSE_SUBTREES = False # Solve the day-ahead subtrees in parallel when the investments are fixed (same result, but no duals: MARGINAL_VALUES then re-solves the full model as an LP)
+WORKERS = None # Processes for the subtree solves, None for one per core
+MARGINAL_VALUES = True # Save the shadow prices of the run to Results/marginal_values.npz (see shadow_prices.py)
+RUN_REPORT = "run_report.json" # Wall time, CPU time and peak memory of every phase of the run, None to skip
+LOG_PHASES = True # Also print every phase as it finishes
+RESULTS_FORMAT = "parquet" # "parquet" (one file per variable in Variable_Results/) or "excel" (Variable_Results.xlsx, slow)
+PRESOLVE = True # Fix and drop the structurally trivial variables and rows before the solve (see presolve.py)
+REPRESENTATIVE_PERIODS = None # (hours per period, periods kept), e.g. (24, 12): solve on 12 representative days (see representative_periods.py)
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _file_entry(filename):
+    stat = os.stat(filename)
+    return {"file": filename, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def _file_current(entry):
+    # A file is only trusted if it still looks exactly like the one we wrote last time
+    if not entry:
+        return False
+    try:
+        stat = os.stat(entry["file"])
+    except OSError:
+        return False
+    return stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime_ns"]
+
+def _clean_sheet(input_sheet):
+    # Drop only fully empty rows (optional)
+    data_nonempty = input_sheet.dropna(how='all')
+
+    # Replace spaces in column names with underscores
+    data_nonempty.columns = data_nonempty.columns.astype(str).str.replace(' ', '_')
+    return data_nonempty
+
+def _tab_text(table):
+    # Fill missing values with an empty string and convert all columns to strings
+    return table.fillna('').astype(str).to_csv(header=True, index=False, sep='\t')
+
+# Store all cleaned sheets in one compressed .npz file, numeric columns keep their dtype
+def save_tables(tables, cache_file=INPUT_CACHE):
+    arrays = {"layout": np.array(json.dumps({sheet: list(table.columns) for sheet, table in tables.items()}))}
+    for k, table in enumerate(tables.values()):
+        for j, column in enumerate(table.columns):
+            values = table[column]
+            if pd.api.types.is_numeric_dtype(values):
+                arrays[f"t{k}_c{j}"] = values.to_numpy()
+            else:
+                arrays[f"t{k}_c{j}"] = values.fillna('').astype(str).to_numpy(dtype=str)
+    np.savez_compressed(cache_file, **arrays)
+
+def load_tables(cache_file=INPUT_CACHE):
+    with np.load(cache_file) as npz:
+        layout = json.loads(str(npz["layout"]))
+        return {
+            sheet: pd.DataFrame({column: npz[f"t{k}_c{j}"] for j, column in enumerate(columns)}, columns=columns)
+            for k, (sheet, columns) in enumerate(layout.items())
+        }
+
+# Function to read all sheets in an Excel file into memory, returning {sheet name: DataFrame}.
+# The workbook is parsed once per change: while it is byte-identical to the last run the sheets come
+# straight from the .npz cache. With write_tab=True every sheet is also saved as a .tab file in the
+# current directory, rewriting only the sheets whose content hash changed.
+def read_all_sheets(excel, write_tab=False, manifest_file=TAB_MANIFEST, cache_file=INPUT_CACHE):
+    manifest = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    previous = manifest.get("sheets", {})
+
+    # Warm re-run: same workbook, untouched cache and (if asked for) untouched .tab files
+    workbook_hash = _sha256_file(excel)
+    cache_ok = manifest.get("workbook") == workbook_hash and _file_current(manifest.get("cache"))
+    tab_ok = not write_tab or (manifest.get("tab_workbook") == workbook_hash and previous and all(_file_current(entry) for entry in previous.values()))
+    if cache_ok and tab_ok:
+        print(f"{excel} is unchanged, loading sheets from {cache_file}")
+        return load_tables(cache_file)
+
+    # Parse every sheet in one pass over the workbook, skipping the first two rows
+    input_sheets = pd.read_excel(excel, sheet_name=None, skiprows=2)
+    tables = {sheet: _clean_sheet(input_sheet) for sheet, input_sheet in input_sheets.items()}
+    save_tables(tables, cache_file)
+
+    sheets = dict(previous)
+    if write_tab:
+        written = 0
+        for sheet, table in tables.items():
+            # Hash the exact text that goes into the .tab file, so an unchanged sheet is never rewritten
+            text = _tab_text(table)
+            sheet_hash = hashlib.sha256(text.encode()).hexdigest()
+
+            # Save as a .tab file using only the sheet name as the file name
+            output_filename = f"{sheet}.tab"
+            entry = previous.get(sheet)
+            if entry is None or entry["sha256"] != sheet_hash or not _file_current(entry):
+                with open(output_filename, "w", newline="") as f:
+                    f.write(text)
+                written += 1
+                print(f"Saved file: {output_filename}")
+            sheets[sheet] = dict(_file_entry(output_filename), sha256=sheet_hash)
+        print(f"{written} of {len(tables)} .tab files rewritten")
+
+    with open(manifest_file, "w") as f:
+        json.dump({
+            "workbook": workbook_hash,
+            "cache": _file_entry(cache_file),
+            "tab_workbook": workbook_hash if write_tab else manifest.get("tab_workbook"),
+            "sheets": sheets,
+        }, f, indent=1)
+    print(f"Read {len(tables)} sheets from {excel}")
+    return tables
+
+# Read a directory of .tab files (e.g. written by read_all_sheets) into the same {sheet name: DataFrame} form
+def read_tab_files(directory="."):
+    tables = {}
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(".tab"):
+            tables[filename[:-4]] = pd.read_csv(os.path.join(directory, filename), sep='\t', keep_default_na=False, float_precision="round_trip")
+    return tables
 
 ####################################################################
 ######################### MODEL SPECIFICATIONS #####################
 ####################################################################
 
 model = pyo.AbstractModel()
-data = pyo.DataPortal() #Loading the data from a data soruce in a uniform manner (Excel)
 
 
 """
@@ -58,9 +172,9 @@ SETS
 #Declaring Sets
 model.Time = pyo.Set(ordered=True) #Set of time periods (hours)
 model.LoadShiftingIntervals = pyo.Set(ordered=True)
-model.TimeLoadShift = pyo.Set(dimen = 2, ordered = True) #Subset of time periods for load shifting
+model.TimeLoadShift = pyo.Set(dimen = 2, ordered = True, within = model.LoadShiftingIntervals * model.Time) #Subset of time periods for load shifting
 model.Month = pyo.Set(ordered = True) #Set of months
-model.TimeInMonth = pyo.Set(within = model.Time) #Subset of time periods in month m
+model.TimeInMonth = pyo.Set(dimen = 2, ordered = True, within = model.Month * model.Time) #(month, hour) pairs: hour t belongs to month m
 model.Technology = pyo.Set(ordered = True) #Set of technologies
 model.EnergyCarrier = pyo.Set(ordered = True)
 model.TechnologyToEnergyCarrier = pyo.Set(dimen=3, ordered = True)
@@ -72,28 +186,52 @@ model.Nodes = pyo.Set(ordered=True) #Set of Nodess
 model.Nodes_DA = pyo.Set(within = model.Nodes) #SubSet of Nodess
 #model.Nodes_ID = pyo.Set(within = model.Nodes) #SubSet of Nodess
 model.Nodes_RT = pyo.Set(within = model.Nodes) #SubSet of Nodess
-model.Parent_Node = pyo.Set(dimen = 2, ordered = True)
+model.Parent_Node = pyo.Set(dimen = 2, ordered = True, within = model.Nodes * model.Nodes)
 model.Mode_of_operation = pyo.Set(ordered = True)
-
-#Reading the Sets, and loading the data
-data.load(filename="Set_of_TimeSteps.tab", format="set", set=model.Time)
-data.load(filename="Subset_LoadShiftWindow.tab", format="set", set=model.TimeLoadShift)
-data.load(filename="Set_of_Month.tab", format = "set", set=model.Month)
-data.load(filename="Subset_of_TimeStepsInMonth.tab", format = "set", set=model.TimeInMonth)
-data.load(filename="Set_of_Technology.tab", format = "set", set=model.Technology)
-data.load(filename="Set_of_FlexibleLoad.tab", format="set", set=model.FlexibleLoad)
-data.load(filename="Set_of_Nodes.tab", format="set", set=model.Nodes)
-data.load(filename="Set_of_EnergyCarrier.tab", format="set", set=model.EnergyCarrier)
-data.load(filename="Subset_TechToEC.tab", format="set", set=model.TechnologyToEnergyCarrier)
-data.load(filename="Subset_ECToTech.tab", format="set", set=model.EnergyCarrierToTechnology)
-data.load(filename="Set_of_FlexibleLoadForEC.tab", format="set", set=model.FlexibleLoadForEnergyCarrier)
-data.load(filename="Subset_ShiftableLoadForEC.tab", format="set", set=model.ShiftableLoadForEnergyCarrier)
-data.load(filename="Set_of_LoadShiftingInterval.tab", format = "set", set = model.LoadShiftingIntervals)
-data.load(filename="Subset_Plan_Nodes.tab", format = "set", set = model.Nodes_DA)
-#data.load(filename="Subset_ID_Nodes.tab", format = "set", set = model.Nodes_ID)
-data.load(filename="Subset_RT_Nodes.tab", format = "set", set = model.Nodes_RT)
-data.load(filename="Set_parent_coupling.tab", format = "set", set = model.Parent_Node)
-data.load(filename="Set_Mode_of_Operation.tab", format = "set", set = model.Mode_of_operation)
+model.Strategic_Periods = pyo.Set(ordered = True) #Set of strategic (investment) periods, e.g. years
+
+#Derived index sets, built in one pass over the data so the load-shifting rules never have to scan TimeLoadShift
+def _load_shift_times(model):
+    # Interval -> hours of its load-shifting window, in the order they are listed
+    times = {i: [] for i in model.LoadShiftingIntervals}
+    for (i, t) in model.TimeLoadShift:
+        times[i].append(t)
+    return times
+model.LoadShiftTimes = pyo.Set(model.LoadShiftingIntervals, ordered = True, within = model.Time, initialize = _load_shift_times)
+model.TimeInLoadShift = pyo.Set(within = model.Time, ordered = True, initialize = lambda model: list(dict.fromkeys(t for (i, t) in model.TimeLoadShift))) #Hours inside some load-shifting window
+model.TimeOutsideLoadShift = pyo.Set(within = model.Time, ordered = True, initialize = lambda model: [t for t in model.Time if t not in model.TimeInLoadShift]) #Hours outside every window
+def _months_of_time(model):
+    # Hour -> month(s) it belongs to, for the grid tariff
+    months = {t: [] for t in model.Time}
+    for (m, t) in model.TimeInMonth:
+        months[t].append(m)
+    return months
+model.MonthsOfTime = pyo.Set(model.Time, ordered = True, within = model.Month, initialize = _months_of_time)
+model.GridImport = pyo.Set(dimen = 3, within = model.TechnologyToEnergyCarrier, initialize = lambda model: [(i, e, o) for (i, e, o) in model.TechnologyToEnergyCarrier if i == 'Power_Grid' and e == 'Electricity'])
+model.ShiftableElectricityLoad = pyo.Set(dimen = 2, within = model.ShiftableLoadForEnergyCarrier, initialize = lambda model: [(b, e) for (b, e) in model.ShiftableLoadForEnergyCarrier if e == 'Electricity'])
+
+#Sheets (or .tab files) holding each set
+SET_SOURCES = {
+    "Time": "Set_of_TimeSteps",
+    "TimeLoadShift": "Subset_LoadShiftWindow",
+    "Month": "Set_of_Month",
+    "TimeInMonth": "Subset_of_TimeStepsInMonth",
+    "Technology": "Set_of_Technology",
+    "FlexibleLoad": "Set_of_FlexibleLoad",
+    "Nodes": "Set_of_Nodes",
+    "EnergyCarrier": "Set_of_EnergyCarrier",
+    "TechnologyToEnergyCarrier": "Subset_TechToEC",
+    "EnergyCarrierToTechnology": "Subset_ECToTech",
+    "FlexibleLoadForEnergyCarrier": "Set_of_FlexibleLoadForEC",
+    "ShiftableLoadForEnergyCarrier": "Subset_ShiftableLoadForEC",
+    "LoadShiftingIntervals": "Set_of_LoadShiftingInterval",
+    "Nodes_DA": "Subset_Plan_Nodes",
+    #"Nodes_ID": "Subset_ID_Nodes",
+    "Nodes_RT": "Subset_RT_Nodes",
+    "Parent_Node": "Set_parent_coupling",
+    "Mode_of_operation": "Set_Mode_of_Operation",
+    "Strategic_Periods": "Set_Strategic_Periods",
+}
 
 
 """
@@ -108,15 +246,16 @@ model.Cost_Expansion_Bat = pyo.Param(model.FlexibleLoad) #Capacity expansion cos
 model.Cost_Emission = pyo.Param() #Carbon price
 model.Cost_Grid = pyo.Param() #Grid tariff
 model.Cost_Imbal = pyo.Param()
-model.aFRR_Up_Capacity_Price = pyo.Param(model.Nodes, model.Time, default=0.0)  # Capacity Price for aFRR up regulation 
-model.aFRR_Dwn_Capacity_Price = pyo.Param(model.Nodes, model.Time, default=0.0)  # Capcaity Price for aFRR down regulation
-model.aFRR_Up_Activation_Price = pyo.Param(model.Nodes, model.Time, default=0.0)  # Activation Price for aFRR up regulation 
-model.aFRR_Dwn_Activation_Price = pyo.Param(model.Nodes, model.Time, default=0.0)  # Activatioin Price for aFRR down regulation 
-model.Spot_Price = pyo.Param(model.Nodes, model.Time, default=0.0)
-model.Intraday_Price = pyo.Param(model.Nodes, model.Time, default=0.0)
-model.RK_Up_Price = pyo.Param(model.Nodes, model.Time, default=0.0)
-model.RK_Dwn_Price = pyo.Param(model.Nodes, model.Time, default=0.0)
-model.Demand = pyo.Param(model.Nodes, model.Time, model.EnergyCarrier, default = 0)  # Energy demand 
+# Prices, activation factors and Demand are mutable: session.py changes them on a built instance
+model.aFRR_Up_Capacity_Price = pyo.Param(model.Nodes, model.Time, default=0.0, mutable = True)  # Capacity Price for aFRR up regulation 
+model.aFRR_Dwn_Capacity_Price = pyo.Param(model.Nodes, model.Time, default=0.0, mutable = True)  # Capcaity Price for aFRR down regulation
+model.aFRR_Up_Activation_Price = pyo.Param(model.Nodes, model.Time, default=0.0, mutable = True)  # Activation Price for aFRR up regulation 
+model.aFRR_Dwn_Activation_Price = pyo.Param(model.Nodes, model.Time, default=0.0, mutable = True)  # Activatioin Price for aFRR down regulation 
+model.Spot_Price = pyo.Param(model.Nodes, model.Time, default=0.0, mutable = True)
+model.Intraday_Price = pyo.Param(model.Nodes, model.Time, default=0.0, mutable = True)
+model.RK_Up_Price = pyo.Param(model.Nodes, model.Time, default=0.0, mutable = True)
+model.RK_Dwn_Price = pyo.Param(model.Nodes, model.Time, default=0.0, mutable = True)
+model.Demand = pyo.Param(model.Nodes, model.Time, model.EnergyCarrier, default = 0, mutable = True)  # Energy demand 
 model.Max_charge_discharge_rate = pyo.Param(model.FlexibleLoad, default = 1) # Maximum symmetric charge and discharge rate
 model.Charge_Efficiency = pyo.Param(model.FlexibleLoad)  # Efficiency of charging flexible load b [-]
 model.Discharge_Efficiency = pyo.Param(model.FlexibleLoad)  # Efficiency of discharging flexible load b [-]
@@ -134,86 +273,253 @@ model.Ramping_Factor = pyo.Param(model.Technology)
 model.Availability_Factor = pyo.Param(model.Nodes, model.Time, model.Technology) #Availability factor for technology delivering to energy carrier 
 model.Carbon_Intensity = pyo.Param(model.Technology, model.Mode_of_operation) #Carbon intensity when using technology i in mode o
 model.Max_Export = pyo.Param() #Maximum allowable export per year, if no concession is given
-model.Activation_Factor_UP_Regulation = pyo.Param(model.Nodes, model.Time, default = 0) # Activation factor determining the duration of up regulation
-model.Activation_Factor_DWN_Regulation = pyo.Param(model.Nodes, model.Time, default = 0) # Activation factor determining the duration of dwn regulation
-model.Activation_Factor_ID_Up = pyo.Param(model.Nodes, model.Time, default = 0) # Activation factor determining the duration of up regulation
-model.Activation_Factor_ID_Dwn = pyo.Param(model.Nodes, model.Time, default = 0) # Activation factor determining the duration of dwn regulation
+model.Activation_Factor_UP_Regulation = pyo.Param(model.Nodes, model.Time, default = 0, mutable = True) # Activation factor determining the duration of up regulation
+model.Activation_Factor_DWN_Regulation = pyo.Param(model.Nodes, model.Time, default = 0, mutable = True) # Activation factor determining the duration of dwn regulation
+model.Activation_Factor_ID_Up = pyo.Param(model.Nodes, model.Time, default = 0, mutable = True) # Activation factor determining the duration of up regulation
+model.Activation_Factor_ID_Dwn = pyo.Param(model.Nodes, model.Time, default = 0, mutable = True) # Activation factor determining the duration of dwn regulation
 model.Available_Excess_Heat = pyo.Param() #Fraction of the total available excess heat at usable temperature level to \\& be used an energy source for the heat pump.
 model.Energy2Power_Ratio = pyo.Param(model.FlexibleLoad)
 model.Max_CAPEX_tech = pyo.Param(model.Technology)
 model.Max_CAPEX_flex = pyo.Param(model.FlexibleLoad)
 model.Max_Carbon_Emission = pyo.Param() #Maximum allowable carbon emissions per year
-
-#Reading the Parameters, and loading the data
-data.load(filename="Par_EnergyCost.tab", param=model.Cost_Energy, format = "table")
-data.load(filename="Par_BatteryCost.tab", param=model.Cost_Battery, format = "table")
-data.load(filename="Par_ExportCost.tab", param=model.Cost_Export, format = "table")
-data.load(filename="Par_CostExpansion_Tec.tab", param=model.Cost_Expansion_Tec, format = "table")
-data.load(filename="Par_CostExpansion_Bat.tab", param=model.Cost_Expansion_Bat, format = "table")
-data.load(filename="Par_CostEmission.tab", param=model.Cost_Emission, format = "table")
-data.load(filename="Par_CostGridTariff.tab", param=model.Cost_Grid, format = "table")
-data.load(filename="Par_CostImbalance.tab", param=model.Cost_Imbal, format = "table")
-data.load(filename="Par_aFRR_UP_CAP_price.tab", param=model.aFRR_Up_Capacity_Price, format = "table")
-data.load(filename="Par_aFRR_DWN_CAP_price.tab", param=model.aFRR_Dwn_Capacity_Price, format = "table")
-data.load(filename="Par_aFRR_UP_ACT_price.tab", param=model.aFRR_Up_Activation_Price, format = "table")
-data.load(filename="Par_aFRR_DWN_ACT_price.tab", param=model.aFRR_Dwn_Activation_Price, format = "table")
-data.load(filename="Par_SpotPrice.tab", param=model.Spot_Price, format = "table")
-data.load(filename="Par_IntradayPrice.tab", param=model.Intraday_Price, format = "table")
-data.load(filename="Par_RK_UpPrice.tab", param=model.RK_Up_Price, format = "table")
-data.load(filename="Par_RK_DwnPrice.tab", param=model.RK_Dwn_Price, format = "table")
-data.load(filename="Par_EnergyDemand.tab", param=model.Demand, format = "table")
-data.load(filename="Par_MaxChargeDischargeRate.tab", param=model.Max_charge_discharge_rate, format = "table")
-data.load(filename="Par_ChargeEfficiency.tab", param=model.Charge_Efficiency, format = "table")
-data.load(filename="Par_DischargeEfficiency.tab", param=model.Discharge_Efficiency, format = "table")
-data.load(filename="Par_TechToEC_Efficiency.tab", param=model.Technology_To_EnergyCarrier_Efficiency, format = "table")
-data.load(filename="Par_ECToTech_Efficiency.tab", param=model.EnergyCarrier_To_Technlogy_Efficiency, format = "table")
-data.load(filename="Par_MaxStorageCapacity.tab", param=model.Max_Storage_Capacity, format = "table")
-data.load(filename="Par_SelfDischarge.tab", param=model.Self_Discharge, format = "table")
-data.load(filename="Par_InitialSoC.tab", param=model.Initial_SOC, format = "table")
-data.load(filename="Par_NodesProbability.tab", param=model.Node_Probability, format = "table")
-data.load(filename="Par_MaxCableCapacity.tab", param=model.Max_Cable_Capacity, format = "table")
-data.load(filename="Par_MaxUpShift.tab", param=model.Up_Shift_Max, format = "table")
-data.load(filename="Par_MaxDwnShift.tab", param=model.Down_Shift_Max, format = "table")
-data.load(filename="Par_InitialCapacityInstalled.tab", param=model.Initial_Installed_Capacity, format = "table")
-data.load(filename="Par_AvailabilityFactor.tab", param=model.Availability_Factor, format = "table")
-data.load(filename="Par_CarbonIntensity.tab", param=model.Carbon_Intensity, format = "table")
-data.load(filename="Par_MaxExport.tab", param=model.Max_Export, format = "table")
-data.load(filename="Par_ActivationFactor_Up_Reg.tab", param=model.Activation_Factor_UP_Regulation, format = "table")
-data.load(filename="Par_ActivationFactor_Dwn_Reg.tab", param=model.Activation_Factor_DWN_Regulation, format = "table")
-data.load(filename="Par_ActivationFactor_ID_Up_Reg.tab", param=model.Activation_Factor_ID_Up, format = "table")
-data.load(filename="Par_ActivationFactor_ID_Dwn_Reg.tab", param=model.Activation_Factor_ID_Dwn, format = "table")
-data.load(filename="Par_AvailableExcessHeat.tab", param=model.Available_Excess_Heat, format = "table")
-data.load(filename="Par_Energy2Power_ratio.tab", param=model.Energy2Power_Ratio, format = "table")
-data.load(filename="Par_Ramping_factor.tab", param=model.Ramping_Factor, format = "table")
-data.load(filename="Par_Max_CAPEX_tec.tab", param=model.Max_CAPEX_tech, format = "table")
-data.load(filename="Par_Max_CAPEX_bat.tab", param=model.Max_CAPEX_flex, format = "table")
-data.load(filename="Par_Max_Carbon_Emission.tab", param=model.Max_Carbon_Emission, format = "table")
+model.Compact_NA = pyo.Param(within = pyo.Boolean, default = False) #Formulation switch, not read from the workbook
+model.Physical_RT_Only = pyo.Param(within = pyo.Boolean, default = False) #Formulation switch, not read from the workbook (see Nodes_Physical)
+RT_FORMULATIONS = ("binary", "lp", "sos1") #See binary_RT_up
+model.RT_Formulation = pyo.Param(within = RT_FORMULATIONS, default = "binary") #Formulation switch, not read from the workbook
+model.Max_RT_Volume = pyo.Param(default = 40) #Largest real-time up/down regulation trade per hour [MW], not read from the workbook
+model.Max_ID_Volume = pyo.Param(default = 10) #Largest intraday adjustment per hour [MW], not read from the workbook
+
+#State carried in from the hours before model.Time (rolling horizon), not read from the workbook. By default the
+#horizon starts from Initial_SOC, with no previous output and no peak yet, and ends back at Initial_SOC.
+model.Carry_Initial_State = pyo.Param(within = pyo.Boolean, default = False) #Start storage from Initial_SoC_Level instead of Initial_SOC
+model.Initial_SoC_Level = pyo.Param(model.Nodes, model.FlexibleLoad, default = 0.0) #Storage level at the end of the previous hour [MWh]
+model.Initial_Output = pyo.Param(model.Nodes, model.TechnologyToEnergyCarrier, default = 0.0) #Output in the previous hour, for ramping
+model.Carried_Peak = pyo.Param(model.Nodes, model.Month, default = 0.0) #Grid import peak already reached earlier in the month
+model.Enforce_End_SoC = pyo.Param(within = pyo.Boolean, default = True) #Return storage to Initial_SOC in the last hour
+
+#Representative periods (representative_periods.py), not read from the workbook. model.Time may hold several periods
+#(e.g. representative days) back to back: each one starts and ends the way the horizon does, and its hours are
+#weighted by the number of hours of the full horizon they stand for. By default model.Time is one period of
+#full-weight hours.
+model.Period_Start = pyo.Set(within = model.Time, ordered = True, initialize = []) #First hours of the periods after the first
+model.Time_Weight = pyo.Param(model.Time, default = 1.0) #Hours of the full horizon that hour t stands for
+model.Month_Weight = pyo.Param(model.Month, model.Time, default = 1.0) #Hours of month m that hour t stands for (grid tariff)
+
+#Strategic periods (strategic.py), not read from the workbook. Every node describes the operation in one strategic
+#period and the scenario tree of each period hangs under its own day-ahead roots. Investments are made per period
+#and stay installed in the later periods; the costs of period p are discounted with Discount_Factor[p], its
+#operation counted Period_Years[p] times. By default every node belongs to the first period.
+model.Node_Period = pyo.Param(model.Nodes, within = model.Strategic_Periods, initialize = lambda model, n: model.Strategic_Periods.first()) #Strategic period node n operates in
+model.Discount_Factor = pyo.Param(model.Strategic_Periods, default = 1.0) #Present value of one unit of cost in period p
+model.Period_Years = pyo.Param(model.Strategic_Periods, default = 1.0) #Years of operation period p stands for
+model.Periods_Up_To = pyo.Set(model.Strategic_Periods, ordered = True, within = model.Strategic_Periods, initialize = lambda model, p: list(model.Strategic_Periods)[:model.Strategic_Periods.ord(p)]) #Periods whose investments are installed in period p
+model.Operating_Weight = pyo.Param(model.Nodes, initialize = lambda model, n: model.Discount_Factor[model.Node_Period[n]] * model.Period_Years[model.Node_Period[n]]) #Weight of the operating cost of node n
+
+def starts_period(model, t):
+    return t == model.Time.first() or t in model.Period_Start
+
+def ends_period(model, t):
+    return t == model.Time.last() or model.Time.next(t) in model.Period_Start
+
+#Non-anticipativity: the market positions (x_DA, x_ID_Up, x_ID_Dwn, x_UP, x_DWN) of a node are tied to those of its parent.
+#With Compact_NA every node uses the variables of its root ancestor (Market_Node) and the equalities are not built;
+#otherwise every node owns its variables and the equalities are indexed over Parent_Node_NA = Parent_Node.
+def _market_nodes(model):
+    if not pyo.value(model.Compact_NA):
+        return {n: n for n in model.Nodes}
+    parent = {child: p for (child, p) in model.Parent_Node}
+    owner = {}
+    for n in model.Nodes:
+        root = n
+        while root in parent:
+            root = parent[root]
+        owner[n] = root
+    return owner
+model.Market_Node = pyo.Param(model.Nodes, within = model.Nodes, initialize = _market_nodes)
+model.Nodes_Market = pyo.Set(within = model.Nodes, ordered = True, initialize = lambda model: list(dict.fromkeys(model.Market_Node[n] for n in model.Nodes)))
+model.Parent_Node_NA = pyo.Set(dimen = 2, ordered = True, within = model.Parent_Node, initialize = lambda model: [] if pyo.value(model.Compact_NA) else list(model.Parent_Node))
+
+#Nodes with physical operation (storage, conversion, market balance, ...). Every node has it, so the reserve bids of a
+#day-ahead node must also be deliverable under its own activation factors, although only the real-time nodes are
+#costed. Physical_RT_Only drops the unpriced copy on the day-ahead nodes: a smaller model, but a different one. The
+#day-ahead reserve bids then only have to be deliverable in the real-time nodes, so the optimum can be lower
+#(5475.34 instead of 5483.46 on the sample).
+model.Nodes_Physical = pyo.Set(within = model.Nodes, ordered = True, initialize = lambda model: list(model.Nodes_RT) if pyo.value(model.Physical_RT_Only) else list(model.Nodes))
+#(node, hour) pairs whose real-time trades are costed. On the other physical nodes x_RT_Up and x_RT_Dwn carry no cost
+#and only enter MarketBalance as x_RT_Up - x_RT_Dwn, so trading both ways there can always be netted: binary_RT is
+#only needed here, and leaving it out elsewhere does not change the optimum.
+model.Real_Time_Pairs = pyo.Set(within = model.Nodes_Physical * model.Time, ordered = True, initialize = lambda model: [(n, t) for n in model.Nodes_Physical if n in model.Nodes_RT for t in model.Time])
+
+# Buying up and selling down regulation in the same hour costs RK_Up_Price - RK_Dwn_Price + 2 * Cost_Imbal per MW
+def rt_binary_needed(model, n, t):
+    return pyo.value(model.RK_Up_Price[n, t] - model.RK_Dwn_Price[n, t] + 2 * model.Cost_Imbal) <= 0
+
+#The Real_Time_Pairs that get binary_RT (see binary_RT_up): all of them with RT_Formulation "binary", the ones where
+#rt_binary_needed with "lp" and none with "sos1"
+def binary_RT_pairs(model):
+    formulation = pyo.value(model.RT_Formulation)
+    return [(n, t) for (n, t) in model.Real_Time_Pairs if formulation == "binary" or (formulation == "lp" and rt_binary_needed(model, n, t))]
+model.Binary_RT_Pairs = pyo.Set(within = model.Nodes_Physical * model.Time, ordered = True, initialize = binary_RT_pairs)
+
+#Sheets (or .tab files) holding each parameter
+PARAM_SOURCES = {
+    "Cost_Energy": "Par_EnergyCost",
+    "Cost_Battery": "Par_BatteryCost",
+    "Cost_Export": "Par_ExportCost",
+    "Cost_Expansion_Tec": "Par_CostExpansion_Tec",
+    "Cost_Expansion_Bat": "Par_CostExpansion_Bat",
+    "Cost_Emission": "Par_CostEmission",
+    "Cost_Grid": "Par_CostGridTariff",
+    "Cost_Imbal": "Par_CostImbalance",
+    "aFRR_Up_Capacity_Price": "Par_aFRR_UP_CAP_price",
+    "aFRR_Dwn_Capacity_Price": "Par_aFRR_DWN_CAP_price",
+    "aFRR_Up_Activation_Price": "Par_aFRR_UP_ACT_price",
+    "aFRR_Dwn_Activation_Price": "Par_aFRR_DWN_ACT_price",
+    "Spot_Price": "Par_SpotPrice",
+    "Intraday_Price": "Par_IntradayPrice",
+    "RK_Up_Price": "Par_RK_UpPrice",
+    "RK_Dwn_Price": "Par_RK_DwnPrice",
+    "Demand": "Par_EnergyDemand",
+    "Max_charge_discharge_rate": "Par_MaxChargeDischargeRate",
+    "Charge_Efficiency": "Par_ChargeEfficiency",
+    "Discharge_Efficiency": "Par_DischargeEfficiency",
+    "Technology_To_EnergyCarrier_Efficiency": "Par_TechToEC_Efficiency",
+    "EnergyCarrier_To_Technlogy_Efficiency": "Par_ECToTech_Efficiency",
+    "Max_Storage_Capacity": "Par_MaxStorageCapacity",
+    "Self_Discharge": "Par_SelfDischarge",
+    "Initial_SOC": "Par_InitialSoC",
+    "Node_Probability": "Par_NodesProbability",
+    "Max_Cable_Capacity": "Par_MaxCableCapacity",
+    "Up_Shift_Max": "Par_MaxUpShift",
+    "Down_Shift_Max": "Par_MaxDwnShift",
+    "Initial_Installed_Capacity": "Par_InitialCapacityInstalled",
+    "Availability_Factor": "Par_AvailabilityFactor",
+    "Carbon_Intensity": "Par_CarbonIntensity",
+    "Max_Export": "Par_MaxExport",
+    "Activation_Factor_UP_Regulation": "Par_ActivationFactor_Up_Reg",
+    "Activation_Factor_DWN_Regulation": "Par_ActivationFactor_Dwn_Reg",
+    "Activation_Factor_ID_Up": "Par_ActivationFactor_ID_Up_Reg",
+    "Activation_Factor_ID_Dwn": "Par_ActivationFactor_ID_Dwn_Reg",
+    "Available_Excess_Heat": "Par_AvailableExcessHeat",
+    "Energy2Power_Ratio": "Par_Energy2Power_ratio",
+    "Ramping_Factor": "Par_Ramping_factor",
+    "Max_CAPEX_tech": "Par_Max_Capex_tec",
+    "Max_CAPEX_flex": "Par_Max_Capex_bat",
+    "Max_Carbon_Emission": "Par_Max_Carbon_Emission",
+}
+
+def _native_value(token):
+    # Same conversion the .tab reader applies to every token: numbers where possible, otherwise the string
+    for convert in (int, float):
+        try:
+            return convert(token)
+        except ValueError:
+            pass
+    return token
+
+def _native_values(column):
+    if pd.api.types.is_numeric_dtype(column):
+        return column.tolist()
+    return [_native_value(token) for token in column.astype(str).tolist()]
+
+def _missing(column):
+    return column.isna() | (column.astype(str) == '')
+
+# Build the data dictionary for model.create_instance straight from the in-memory sheets,
+# replacing one data.load(...) per .tab file. Sets take every column of their sheet, parameters
+# are indexed by all columns but the last, which holds the value.
+def load_data(tables):
+    data = {}
+    for name, sheet in SET_SOURCES.items():
+        columns = [_native_values(tables[sheet][column]) for column in tables[sheet].columns]
+        data[name] = {None: columns[0] if len(columns) == 1 else list(zip(*columns))}
+
+    for name, sheet in PARAM_SOURCES.items():
+        table = tables[sheet]
+        table = table[~_missing(table[table.columns[-1]])]
+        values = _native_values(table[table.columns[-1]])
+        if len(table.columns) == 1:
+            data[name] = {None: values[0]}
+        else:
+            index = [_native_values(table[column]) for column in table.columns[:-1]]
+            keys = index[0] if len(index) == 1 else zip(*index)
+            data[name] = dict(zip(keys, values))
+
+    # Older workbooks list the hours of Subset_of_TimeStepsInMonth without a month column; link them to every month as before
+    if len(tables[SET_SOURCES["TimeInMonth"]].columns) == 1:
+        data["TimeInMonth"] = {None: [(m, t) for m in data["Month"][None] for t in data["TimeInMonth"][None]]}
+    return {None: data}
+
+# Positions in a set/parameter/variable key that are drawn from index_set (e.g. model.Nodes or model.Time) or from
+# a subset declared within it, read off the abstract declaration so callers can filter or reshape data and results.
+# A set of tuples declared within a product (e.g. Real_Time_Pairs) counts as the sets of that product.
+def key_positions(component, index_set):
+    if isinstance(component, pyo.Set):
+        if component is index_set:
+            return [0]
+        domain = component.domain
+    else:
+        domain = component.index_set()
+    positions, k = [], 0
+    for s in domain.subsets():
+        parts = list(s.domain.subsets()) if getattr(s, "domain", None) is not None else []
+        for part in (parts if len(parts) > 1 else [s]):
+            if part is index_set or getattr(part, "domain", None) is index_set:
+                positions.append(k)
+            k += part.dimen if isinstance(part.dimen, int) else 1
+    return positions
+
+# Copy of a data dictionary keeping only the given nodes and/or hours: every set member and parameter
+# entry with a Nodes (Time) position outside them is dropped
+def restrict_data(data, nodes=None, times=None):
+    allowed = [(index_set, set(members)) for index_set, members in ((model.Nodes, nodes), (model.Time, times)) if members is not None]
+    restricted = {}
+    for name, values in data[None].items():
+        component = getattr(model, name)
+        checks = [(k, members) for index_set, members in allowed for k in key_positions(component, index_set)]
+        if not checks:
+            restricted[name] = values
+            continue
+        keep = lambda key: all((key[k] if isinstance(key, tuple) else key) in members for k, members in checks)
+        if isinstance(component, pyo.Set):
+            restricted[name] = {None: [key for key in values[None] if keep(key)]}
+        else:
+            restricted[name] = {key: value for key, value in values.items() if keep(key)}
+    return {None: restricted}
 
 
 """
 VARIABLES
 """
 #Declaring Variables
-model.x_UP = pyo.Var(model.Nodes, model.Time, model.FlexibleLoad, domain= pyo.NonNegativeReals)
-model.x_DWN = pyo.Var(model.Nodes, model.Time, model.FlexibleLoad, domain= pyo.NonNegativeReals)
+#Every real-time trade goes through the cable, so it is at most Max_RT_Volume and Max_Cable_Capacity
+def rt_trade_limit(model):
+    return min(pyo.value(model.Max_RT_Volume), pyo.value(model.Max_Cable_Capacity))
+
+#Market positions (DA, ID and aFRR capacity) exist on the nodes that own them (Nodes_Market) and are looked up
+#through Market_Node[n]; without Compact_NA that is every node, tied to the day-ahead parent by the
+#non-anticipativity constraints. Physical operation and real-time recourse are created for Nodes_Physical (see
+#Physical_RT_Only); they are only costed on the real-time nodes.
+model.x_UP = pyo.Var(model.Nodes_Market, model.Time, model.FlexibleLoad, domain= pyo.NonNegativeReals)
+model.x_DWN = pyo.Var(model.Nodes_Market, model.Time, model.FlexibleLoad, domain= pyo.NonNegativeReals)
 model.x_UP_Tot = pyo.Var(model.Nodes, model.Time, domain=pyo.NonNegativeReals)
 model.x_DWN_Tot = pyo.Var(model.Nodes, model.Time, domain=pyo.NonNegativeReals)
-model.x_DA = pyo.Var(model.Nodes, model.Time, domain= pyo.NonNegativeReals)
-model.x_ID_Up = pyo.Var(model.Nodes, model.Time, domain= pyo.NonNegativeReals)
-model.x_ID_Dwn = pyo.Var(model.Nodes, model.Time, domain= pyo.NonNegativeReals)
-model.x_RT_Up = pyo.Var(model.Nodes, model.Time, domain= pyo.NonNegativeReals)
-model.x_RT_Dwn = pyo.Var(model.Nodes, model.Time, domain= pyo.NonNegativeReals)
-model.y_out = pyo.Var(model.Nodes, model.Time, model.TechnologyToEnergyCarrier, domain = pyo.NonNegativeReals)
-model.y_in = pyo.Var(model.Nodes, model.Time, model.EnergyCarrierToTechnology, domain = pyo.NonNegativeReals)
-model.y_activity = pyo.Var(model.Nodes, model.Time, model.Technology, model.Mode_of_operation, domain = pyo.NonNegativeReals)
-model.z_export = pyo.Var(model.Nodes, model.Time, model.EnergyCarrier, domain = pyo.NonNegativeReals, bounds = (0, 0))
-model.q_charge = pyo.Var(model.Nodes, model.Time, model.FlexibleLoad, domain= pyo.NonNegativeReals)
-model.q_discharge = pyo.Var(model.Nodes, model.Time, model.FlexibleLoad, domain= pyo.NonNegativeReals)
-model.q_SoC = pyo.Var(model.Nodes, model.Time, model.FlexibleLoad, domain= pyo.NonNegativeReals)
-model.v_new_tech = pyo.Var(model.Technology, domain = pyo.NonNegativeReals, bounds = (0, 0)) 
-model.v_new_bat = pyo.Var(model.FlexibleLoad, domain = pyo.NonNegativeReals, bounds = (0, 0))
-model.y_max = pyo.Var(model.Nodes, model.Month, domain = pyo.NonNegativeReals)
-model.binary_RT = pyo.Var(model.Nodes, model.Time, domain = pyo.Binary)
+model.x_DA = pyo.Var(model.Nodes_Market, model.Time, domain= pyo.NonNegativeReals)
+model.x_ID_Up = pyo.Var(model.Nodes_Market, model.Time, domain= pyo.NonNegativeReals)
+model.x_ID_Dwn = pyo.Var(model.Nodes_Market, model.Time, domain= pyo.NonNegativeReals)
+model.x_RT_Up = pyo.Var(model.Nodes_Physical, model.Time, domain= pyo.NonNegativeReals, bounds = lambda model, n, t: (0, rt_trade_limit(model)))
+model.x_RT_Dwn = pyo.Var(model.Nodes_Physical, model.Time, domain= pyo.NonNegativeReals, bounds = lambda model, n, t: (0, rt_trade_limit(model)))
+model.y_out = pyo.Var(model.Nodes_Physical, model.Time, model.TechnologyToEnergyCarrier, domain = pyo.NonNegativeReals)
+model.y_in = pyo.Var(model.Nodes_Physical, model.Time, model.EnergyCarrierToTechnology, domain = pyo.NonNegativeReals)
+model.y_activity = pyo.Var(model.Nodes_Physical, model.Time, model.Technology, model.Mode_of_operation, domain = pyo.NonNegativeReals)
+model.z_export = pyo.Var(model.Nodes_Physical, model.Time, model.EnergyCarrier, domain = pyo.NonNegativeReals, bounds = (0, 0))
+model.q_charge = pyo.Var(model.Nodes_Physical, model.Time, model.FlexibleLoad, domain= pyo.NonNegativeReals)
+model.q_discharge = pyo.Var(model.Nodes_Physical, model.Time, model.FlexibleLoad, domain= pyo.NonNegativeReals)
+model.q_SoC = pyo.Var(model.Nodes_Physical, model.Time, model.FlexibleLoad, domain= pyo.NonNegativeReals)
+model.v_new_tech = pyo.Var(model.Strategic_Periods, model.Technology, domain = pyo.NonNegativeReals, bounds = (0, 0)) 
+model.v_new_bat = pyo.Var(model.Strategic_Periods, model.FlexibleLoad, domain = pyo.NonNegativeReals, bounds = (0, 0))
+model.y_max = pyo.Var(model.Nodes_Physical, model.Month, domain = pyo.NonNegativeReals)
+model.binary_RT = pyo.Var(model.Binary_RT_Pairs, domain = pyo.Binary)
 #model.d_flex = pyo.Var(model.Nodes, model.Time, model.EnergyCarrier, domain = pyo.NonNegativeReals)
 
 
@@ -314,46 +620,85 @@ model.Objective = pyo.Objective(rule=objective, sense=pyo.minimize)
 
 """
 
-def objective(model):
-    obj_expr = sum(
-        model.Cost_Expansion_Tec[i] * model.v_new_tech[i] for i in model.Technology
+# Investment (first-stage) and operational parts are kept apart so decomposition schemes can reuse them
+def investment_cost(model):
+    return sum(
+        model.Discount_Factor[p] * model.Cost_Expansion_Tec[i] * model.v_new_tech[p, i] for p in model.Strategic_Periods for i in model.Technology
     ) + sum(
-        model.Cost_Expansion_Bat[b] * model.v_new_bat[b] for b in model.FlexibleLoad
-    ) + sum(
-        sum(model.Node_Probability[n] * (
-            - (model.aFRR_Up_Capacity_Price[n, t] * model.x_UP_Tot[n, t] +
-               model.aFRR_Dwn_Capacity_Price[n, t] * model.x_DWN_Tot[n, t])
-        ) for n in model.Nodes_DA)
-
-        + sum(model.Node_Probability[n] * (
-            - model.Activation_Factor_UP_Regulation[n, t] * model.aFRR_Up_Activation_Price[n, t] * model.x_UP_Tot[n, t]
-            + model.Activation_Factor_DWN_Regulation[n, t] * model.aFRR_Dwn_Activation_Price[n, t] * model.x_DWN_Tot[n, t]
-            
-            + model.Spot_Price[n, t] * model.x_DA[n, t] 
-            + model.Intraday_Price[n, t] * (
-                model.Activation_Factor_ID_Up[n, t] * model.x_ID_Up[n, t] 
-                - model.Activation_Factor_ID_Dwn[n, t] * model.x_ID_Dwn[n, t]
-            )
+        model.Discount_Factor[p] * model.Cost_Expansion_Bat[b] * model.v_new_bat[p, b] for p in model.Strategic_Periods for b in model.FlexibleLoad
+    )
 
-            + sum(
-                model.y_activity[n, t, i, o] * model.Cost_Energy[n, t, i] 
-                + model.Carbon_Intensity[i, o] * model.Cost_Emission * model.y_activity[n, t, i, o]
-                for (i, e, o) in model.TechnologyToEnergyCarrier
-            ) 
-            - sum(model.Cost_Export[n, t, e] * model.z_export[n, t, e] for e in model.EnergyCarrier)
+# Capacity added up to the strategic period of node n
+def new_technology(model, n, i):
+    return sum(model.v_new_tech[p, i] for p in model.Periods_Up_To[model.Node_Period[n]])
+
+def new_storage(model, n, b):
+    return sum(model.v_new_bat[p, b] for p in model.Periods_Up_To[model.Node_Period[n]])
+
+# Linear expression sum(coef * var) built in one pass over (coef, var) pairs. A variable that appears more than
+# once gets one term with the summed coefficient, and numeric zero coefficients are dropped (mutable Params
+# stay, they may change later).
+def linear_sum(terms, constant=0):
+    coefs = ComponentMap()
+    for coef, var in terms:
+        if coef.__class__ in (int, float) and coef == 0:
+            continue
+        coefs[var] = coefs[var] + coef if var in coefs else coef
+    return LinearExpression(constant=constant, linear_coefs=list(coefs.values()), linear_vars=list(coefs.keys()))
+
+# (technology, mode) -> number of carriers it supplies in that mode; y_activity is costed (and emits) once
+# per (i, e, o) in TechnologyToEnergyCarrier
+def activity_multiplicity(model):
+    count = {}
+    for (i, e, o) in model.TechnologyToEnergyCarrier:
+        count[i, o] = count.get((i, o), 0) + 1
+    return count
+
+def _operational_terms(model, times):
+    activity = activity_multiplicity(model)
+    for t in times:
+        for n in model.Nodes_DA:
+            p = model.Node_Probability[n] * model.Operating_Weight[n] * model.Time_Weight[t]
+            yield -p * model.aFRR_Up_Capacity_Price[n, t], model.x_UP_Tot[n, t]
+            yield -p * model.aFRR_Dwn_Capacity_Price[n, t], model.x_DWN_Tot[n, t]
+
+        for n in model.Nodes_RT:
+            p = model.Node_Probability[n] * model.Operating_Weight[n] * model.Time_Weight[t]
+            k = model.Market_Node[n]
+            yield -p * model.Activation_Factor_UP_Regulation[n, t] * model.aFRR_Up_Activation_Price[n, t], model.x_UP_Tot[n, t]
+            yield p * model.Activation_Factor_DWN_Regulation[n, t] * model.aFRR_Dwn_Activation_Price[n, t], model.x_DWN_Tot[n, t]
+
+            yield p * model.Spot_Price[n, t], model.x_DA[k, t]
+            yield p * model.Intraday_Price[n, t] * model.Activation_Factor_ID_Up[n, t], model.x_ID_Up[k, t]
+            yield -p * model.Intraday_Price[n, t] * model.Activation_Factor_ID_Dwn[n, t], model.x_ID_Dwn[k, t]
+
+            for (i, o), count in activity.items():
+                yield p * count * (model.Cost_Energy[n, t, i] + model.Carbon_Intensity[i, o] * model.Cost_Emission), model.y_activity[n, t, i, o]
+            for e in model.EnergyCarrier:
+                yield -p * model.Cost_Export[n, t, e], model.z_export[n, t, e]
 
-            + model.RK_Up_Price[n, t] * model.x_RT_Up[n, t] 
-            - model.RK_Dwn_Price[n, t] * model.x_RT_Dwn[n, t]
-            + model.Cost_Imbal * (model.x_RT_Up[n, t] + model.x_RT_Dwn[n, t])
+            yield p * (model.RK_Up_Price[n, t] + model.Cost_Imbal), model.x_RT_Up[n, t]
+            yield p * (model.Cost_Imbal - model.RK_Dwn_Price[n, t]), model.x_RT_Dwn[n, t]
 
-            + sum(model.Cost_Grid * model.y_max[n, m] for m in model.Month)
+            for b in model.FlexibleLoad:
+                yield p * model.Cost_Battery[b], model.q_discharge[n, t, b]
 
-            + sum(model.Cost_Battery[b] * model.q_discharge[n, t, b] for b in model.FlexibleLoad)
-        ) for n in model.Nodes_RT)
-    for t in model.Time
-    )
+def _grid_tariff_terms(model, times):
+    for t in times:
+        for n in model.Nodes_RT:
+            for m in model.MonthsOfTime[t]:
+                yield model.Node_Probability[n] * model.Operating_Weight[n] * model.Month_Weight[m, t] * model.Cost_Grid, model.y_max[n, m]
 
-    return obj_expr  # Return the fully evaluated expression
+def operational_cost(model, times=None):
+    times = model.Time if times is None else times
+    return linear_sum(itertools.chain(_operational_terms(model, times), _grid_tariff_terms(model, times)))
+
+# Grid tariff, charged in every hour (Month_Weight hours per representative hour) on the peak of the month(s) the hour belongs to
+def grid_tariff(model, times=None):
+    return linear_sum(_grid_tariff_terms(model, model.Time if times is None else times))
+
+def objective(model):
+    return investment_cost(model) + operational_cost(model)
 
 model.Objective = pyo.Objective(rule=objective, sense=pyo.minimize)
 
@@ -369,14 +714,14 @@ CONSTRAINTS
 
 def aFRR_up_total(model, n, t, e):
     if e == 'Electricity':
-        return model.x_UP_Tot[n, t] == sum(model.x_UP[n, t, b] for b in model.FlexibleLoad if (b,e) in model.FlexibleLoadForEnergyCarrier)
+        return model.x_UP_Tot[n, t] == sum(model.x_UP[model.Market_Node[n], t, b] for b in model.FlexibleLoad if (b,e) in model.FlexibleLoadForEnergyCarrier)
     else:
         return pyo.Constraint.Skip   
 model.aFRRUpTotal = pyo.Constraint(model.Nodes, model.Time, model.EnergyCarrier, rule=aFRR_up_total)
 
 def aFRR_dwn_total(model, n, t, e):
     if e == 'Electricity':
-        return model.x_DWN_Tot[n, t] == sum(model.x_DWN[n, t, b] for b in model.FlexibleLoad if (b,e) in model.FlexibleLoadForEnergyCarrier)
+        return model.x_DWN_Tot[n, t] == sum(model.x_DWN[model.Market_Node[n], t, b] for b in model.FlexibleLoad if (b,e) in model.FlexibleLoadForEnergyCarrier)
     else:
         return pyo.Constraint.Skip   
 model.aFRRDwnTotal = pyo.Constraint(model.Nodes, model.Time, model.EnergyCarrier, rule=aFRR_dwn_total)
@@ -390,8 +735,8 @@ def energy_balance(model, n, t, e):
     if e == 'Electricity':
         return (
             model.Demand[n, t, e]
-            + sum(model.Activation_Factor_UP_Regulation[n, t] * model.x_UP[n, t, b]
-            - model.Activation_Factor_DWN_Regulation[n, t] * model.x_DWN[n, t, b] for b in model.FlexibleLoad if (b,e) in model.FlexibleLoadForEnergyCarrier)
+            + sum(model.Activation_Factor_UP_Regulation[n, t] * model.x_UP[model.Market_Node[n], t, b]
+            - model.Activation_Factor_DWN_Regulation[n, t] * model.x_DWN[model.Market_Node[n], t, b] for b in model.FlexibleLoad if (b,e) in model.FlexibleLoadForEnergyCarrier)
             == sum(sum(model.y_out[n, t, i, e, o] for i in model.Technology if (i,e,o) in model.TechnologyToEnergyCarrier)
             - sum(model.y_in[n, t, i, e, o] for i in model.Technology if (i,e,o) in model.EnergyCarrierToTechnology) for o in model.Mode_of_operation)
             - model.z_export[n, t, e]
@@ -411,7 +756,7 @@ def energy_balance(model, n, t, e):
                 for b in model.FlexibleLoad if (b,e) in model.FlexibleLoadForEnergyCarrier
             )
         )
-model.EnergyBalance = pyo.Constraint(model.Nodes, model.Time, model.EnergyCarrier, rule=energy_balance)
+model.EnergyBalance = pyo.Constraint(model.Nodes_Physical, model.Time, model.EnergyCarrier, rule=energy_balance)
 
 #####################################################################################
 ########################### MARKET BALANCE DA/ID/RT #################################
@@ -419,10 +764,10 @@ model.EnergyBalance = pyo.Constraint(model.Nodes, model.Time, model.EnergyCarrie
  
 def market_balance(model, n, t, i, e, o):
     if (i, e) == ("Power_Grid", "Electricity"):
-        return (model.y_out[n, t, i, e, o] == model.x_DA[n, t] + model.Activation_Factor_ID_Up[n,t]*model.x_ID_Up[n, t] - model.Activation_Factor_ID_Dwn[n,t]*model.x_ID_Dwn[n, t] + model.x_RT_Up[n, t] - model.x_RT_Dwn[n, t])
+        return (model.y_out[n, t, i, e, o] == model.x_DA[model.Market_Node[n], t] + model.Activation_Factor_ID_Up[n,t]*model.x_ID_Up[model.Market_Node[n], t] - model.Activation_Factor_ID_Dwn[n,t]*model.x_ID_Dwn[model.Market_Node[n], t] + model.x_RT_Up[n, t] - model.x_RT_Dwn[n, t])
     else:
         return pyo.Constraint.Skip      
-model.MarketBalance = pyo.Constraint(model.Nodes, model.Time, model.TechnologyToEnergyCarrier, rule = market_balance)
+model.MarketBalance = pyo.Constraint(model.Nodes_Physical, model.Time, model.TechnologyToEnergyCarrier, rule = market_balance)
 """
 def market_balance_ID(model, n, p, t, i, e, o):
     if (i, e) == ("Power_Grid", "Electricity") and n in model.Nodes_RT:
@@ -438,16 +783,50 @@ def Max_ID_Adjustment(model, n, t):
 model.MaxIDAdjustment = pyo.Constraint(model.Nodes, model.Time, rule = Max_ID_Adjustment)
 """
 def Max_ID_Adjustment(model, n, t):
-        return model.x_ID_Up[n, t] + model.x_ID_Dwn[n, t] <= 10
-model.MaxIDAdjustment = pyo.Constraint(model.Nodes, model.Time, rule = Max_ID_Adjustment)
+        return model.x_ID_Up[n, t] + model.x_ID_Dwn[n, t] <= model.Max_ID_Volume
+model.MaxIDAdjustment = pyo.Constraint(model.Nodes_Market, model.Time, rule = Max_ID_Adjustment)
+
+#binary_RT keeps real-time up and down trades apart on Binary_RT_Pairs; both are at most rt_trade_limit (their bounds).
+#RT_Formulation:
+#  binary - x_RT_Up <= rt_up_limit * binary_RT and x_RT_Dwn <= rt_dwn_limit * (1 - binary_RT) on every Real_Time_Pair
+#  lp     - binary_RT and its rows only where trading both ways in the same hour could pay off (rt_binary_needed);
+#           elsewhere no optimal solution does, so the optimum is the same without them
+#  sos1   - an SOS1 set per (n, t) instead of binary_RT (the solver has to support SOS constraints)
+
+# With x_RT_Dwn at zero, MarketBalance leaves x_RT_Up <= y_out of the grid + Activation_Factor_ID_Dwn * x_ID_Dwn:
+# the grid's availability times its capacity (CAPEX limits the expansion, every period up to the node's) plus the
+# largest intraday down adjustment. Below rt_trade_limit that is the big-M of BinaryRTUp; it is kept as an
+# expression of the mutable activation factor, so it stays valid in a session.
+def rt_up_limit(model, n, t):
+    limit = None
+    for (i, e, o) in model.GridImport:
+        if model.Cost_Expansion_Tec[i] <= 0:
+            continue
+        capacity = model.Initial_Installed_Capacity[i] + len(model.Periods_Up_To[model.Node_Period[n]]) * model.Max_CAPEX_tech[i] / model.Cost_Expansion_Tec[i]
+        bound = model.Availability_Factor[n, t, i] * capacity + model.Max_ID_Volume * model.Activation_Factor_ID_Dwn[n, t]
+        if pyo.value(bound) < pyo.value(limit if limit is not None else rt_trade_limit(model)):
+            limit = bound
+    return rt_trade_limit(model) if limit is None else limit
+
+# With x_RT_Up at zero, MarketBalance leaves x_RT_Dwn <= x_DA + Activation_Factor_ID_Up * x_ID_Up - y_out of the grid.
+# Nothing bounds x_DA but the balance of a node that can itself sell back the whole trade limit, so unlike
+# rt_up_limit this gives no bound below rt_trade_limit: that is the big-M of BinaryRTDwn.
+def rt_dwn_limit(model, n, t):
+    return rt_trade_limit(model)
 
 def binary_RT_up(model, n, t):
-    return model.x_RT_Up[n, t] <= 40 * model.binary_RT[n, t]
-model.BinaryRTUp = pyo.Constraint(model.Nodes, model.Time, rule = binary_RT_up)
+    return model.x_RT_Up[n, t] <= rt_up_limit(model, n, t) * model.binary_RT[n, t]
+model.BinaryRTUp = pyo.Constraint(model.Binary_RT_Pairs, rule = binary_RT_up)
 
 def binary_RT_dwn(model, n, t):
-    return model.x_RT_Dwn[n, t] <= 40 * (1 - model.binary_RT[n, t])
-model.BinaryRTDwn = pyo.Constraint(model.Nodes, model.Time, rule = binary_RT_dwn)
+    return model.x_RT_Dwn[n, t] <= rt_dwn_limit(model, n, t) * (1 - model.binary_RT[n, t])
+model.BinaryRTDwn = pyo.Constraint(model.Binary_RT_Pairs, rule = binary_RT_dwn)
+
+def RT_direction(model, n, t):
+    if pyo.value(model.RT_Formulation) != "sos1":
+        return pyo.SOSConstraint.Skip
+    return [model.x_RT_Up[n, t], model.x_RT_Dwn[n, t]]
+model.RTDirection = pyo.SOSConstraint(model.Real_Time_Pairs, rule = RT_direction, sos = 1)
 
 #####################################################################################
 ########################### CONVERSION BALANCE ######################################
@@ -455,22 +834,22 @@ model.BinaryRTDwn = pyo.Constraint(model.Nodes, model.Time, rule = binary_RT_dwn
 
 def conversion_balance_out(model, n, t, i, e, o):
         return (model.y_out[n, t, i, e, o] == model.y_activity[n, t, i, o] * model.Technology_To_EnergyCarrier_Efficiency[i, e, o])     
-model.ConversionBalanceOut = pyo.Constraint(model.Nodes, model.Time, model.TechnologyToEnergyCarrier, rule = conversion_balance_out)
+model.ConversionBalanceOut = pyo.Constraint(model.Nodes_Physical, model.Time, model.TechnologyToEnergyCarrier, rule = conversion_balance_out)
 
 def conversion_balance_in(model, n, t, i, e, o):
         return (model.y_in[n, t, i, e, o] == model.y_activity[n, t, i, o] * model.EnergyCarrier_To_Technlogy_Efficiency[i, e, o])           
-model.ConversionBalanceIn = pyo.Constraint(model.Nodes, model.Time, model.EnergyCarrierToTechnology, rule = conversion_balance_in)
+model.ConversionBalanceIn = pyo.Constraint(model.Nodes_Physical, model.Time, model.EnergyCarrierToTechnology, rule = conversion_balance_in)
 
 #####################################################################################
 ########################### TECHNOLOGY RAMPING CONSTRAINTS ##########################
 #####################################################################################
 
 def Ramping_Technology(model, n, t, i, e, o):
-        if t > 1:
-            return (model.y_out[n, t, i, e, o] - model.y_out[n, t-1, i, e, o] <= model.Ramping_Factor[i] * (model.Initial_Installed_Capacity[i] + model.v_new_tech[i]))
+        if not starts_period(model, t):
+            return (model.y_out[n, t, i, e, o] - model.y_out[n, model.Time.prev(t), i, e, o] <= model.Ramping_Factor[i] * (model.Initial_Installed_Capacity[i] + new_technology(model, n, i)))
         else:
-            return (model.y_out[n, t, i, e, o] <= model.Ramping_Factor[i] * (model.Initial_Installed_Capacity[i] + model.v_new_tech[i]))        
-model.RampingTechnology = pyo.Constraint(model.Nodes, model.Time, model.TechnologyToEnergyCarrier, rule = Ramping_Technology)
+            return (model.y_out[n, t, i, e, o] - model.Initial_Output[n, i, e, o] <= model.Ramping_Factor[i] * (model.Initial_Installed_Capacity[i] + new_technology(model, n, i)))        
+model.RampingTechnology = pyo.Constraint(model.Nodes_Physical, model.Time, model.TechnologyToEnergyCarrier, rule = Ramping_Technology)
 
 #####################################################################################
 ############## HEAT PUMP LIMITATION - MÅ ENDRES I HENHOLD TIL INPUTDATA #############
@@ -481,36 +860,32 @@ def heat_pump_input_limitation_LT(model, n, t):
         model.y_out[n, t, 'HeatPump_LT', 'LT', 1] - model.y_in[n, t, 'HeatPump_LT', 'Electricity', 1]
         <= model.Available_Excess_Heat * (model.Demand[n, t, 'LT'])# + model.Demand[s, t, 'HT'])
     )
-model.HeatPumpInputLimitationLT = pyo.Constraint(model.Nodes, model.Time, rule=heat_pump_input_limitation_LT)
+model.HeatPumpInputLimitationLT = pyo.Constraint(model.Nodes_Physical, model.Time, rule=heat_pump_input_limitation_LT)
 
 def heat_pump_input_limitation_MT(model, n, t):
     return (
         model.y_out[n, t, 'HeatPump_MT', 'MT', 1] - model.y_in[n, t, 'HeatPump_MT', 'Electricity', 1]
         <= model.Available_Excess_Heat * (model.Demand[n, t, 'MT'])# + model.Demand[s, t, 'HT'])
     )
-model.HeatPumpInputLimitationMT = pyo.Constraint(model.Nodes, model.Time, rule=heat_pump_input_limitation_MT)
+model.HeatPumpInputLimitationMT = pyo.Constraint(model.Nodes_Physical, model.Time, rule=heat_pump_input_limitation_MT)
 
 ######################################################
 ############## LOAD SHIFTING CONSTRAINTS #############
 ######################################################
 
 def loads_shifting_time_window(model, n, i, b, e):
-        return sum(model.q_charge[n,t,b] - model.q_discharge[n,t,b]/model.Discharge_Efficiency[b] for (interval, t) in model.TimeLoadShift if interval == i) == 0
-model.LoadShiftingWindow = pyo.Constraint(model.Nodes, model.LoadShiftingIntervals, model.ShiftableLoadForEnergyCarrier, rule=loads_shifting_time_window)
+    if len(model.LoadShiftTimes[i]) == 0:
+        return pyo.Constraint.Skip
+    return sum(model.q_charge[n,t,b] - model.q_discharge[n,t,b]/model.Discharge_Efficiency[b] for t in model.LoadShiftTimes[i]) == 0
+model.LoadShiftingWindow = pyo.Constraint(model.Nodes_Physical, model.LoadShiftingIntervals, model.ShiftableLoadForEnergyCarrier, rule=loads_shifting_time_window)
 
 def no_discharge_outside_load_shift(model, n, t, b, e):
-    if not any(t == load_t[1] for load_t in model.TimeLoadShift):
-        return model.q_discharge[n, t, b]  == 0
-    else:
-        return pyo.Constraint.Skip
-model.NoDischargeOutsideLoadShift = pyo.Constraint(model.Nodes, model.Time, model.ShiftableLoadForEnergyCarrier, rule=no_discharge_outside_load_shift)
+    return model.q_discharge[n, t, b]  == 0
+model.NoDischargeOutsideLoadShift = pyo.Constraint(model.Nodes_Physical, model.TimeOutsideLoadShift, model.ShiftableLoadForEnergyCarrier, rule=no_discharge_outside_load_shift)
 
 def no_charge_outside_load_shift(model, n, t, b, e):
-    if not any(t == load_t[1] for load_t in model.TimeLoadShift):
-        return model.q_charge[n, t, b]  == 0
-    else:
-        return pyo.Constraint.Skip
-model.NochargeOutsideLoadShift = pyo.Constraint(model.Nodes, model.Time, model.ShiftableLoadForEnergyCarrier, rule=no_charge_outside_load_shift)
+    return model.q_charge[n, t, b]  == 0
+model.NochargeOutsideLoadShift = pyo.Constraint(model.Nodes_Physical, model.TimeOutsideLoadShift, model.ShiftableLoadForEnergyCarrier, rule=no_charge_outside_load_shift)
 
 ###########################################################
 ############## MAX ALLOWABLE UP/DOWN SHIFT ################
@@ -518,12 +893,9 @@ model.NochargeOutsideLoadShift = pyo.Constraint(model.Nodes, model.Time, model.S
 
 def Max_total_up_dwn_load_shift(model, n, i, t, b, e):
     #if e == 'Electricity':
-        # Extract all time steps `tt` for the given interval `i`
-    relevant_times = [tt for (j, tt) in model.TimeLoadShift if j == i]        
-    if t in relevant_times:
-        return model.q_charge[n,t,b] + model.q_discharge[n,t,b]/model.Discharge_Efficiency[b] <= model.Up_Shift_Max * model.Demand[n,t,e]        
-    return pyo.Constraint.Ski
-model.MaxTotalUpDwnLoadShift = pyo.Constraint(model.Nodes, model.TimeLoadShift, model.ShiftableLoadForEnergyCarrier, rule=Max_total_up_dwn_load_shift)
+    # Indexed by the (interval, hour) pairs themselves, so every index is a real window hour
+    return model.q_charge[n,t,b] + model.q_discharge[n,t,b]/model.Discharge_Efficiency[b] <= model.Up_Shift_Max * model.Demand[n,t,e]
+model.MaxTotalUpDwnLoadShift = pyo.Constraint(model.Nodes_Physical, model.TimeLoadShift, model.ShiftableLoadForEnergyCarrier, rule=Max_total_up_dwn_load_shift)
 
 ##########################################################################
 ############## aFRR PARTICIPATION CONSTRAINTS FOR LOAD SHIFT #############
@@ -531,67 +903,49 @@ model.MaxTotalUpDwnLoadShift = pyo.Constraint(model.Nodes, model.TimeLoadShift,
 
 def aFRR_up_dwn_limit_demand_constraint(model, n, t, b, e):
     if e == 'Electricity':
-        return model.x_DWN[n, t, b] + model.x_UP[n, t, b]/model.Discharge_Efficiency[b] <= model.Up_Shift_Max * model.Demand[n, t, e]
+        return model.x_DWN[model.Market_Node[n], t, b] + model.x_UP[model.Market_Node[n], t, b]/model.Discharge_Efficiency[b] <= model.Up_Shift_Max * model.Demand[n, t, e]
     else:
         return pyo.Constraint.Skip
 model.aFRRUpDwnDemandLimitLoadShift = pyo.Constraint(model.Nodes, model.Time, model.ShiftableLoadForEnergyCarrier, rule=aFRR_up_dwn_limit_demand_constraint)
 
 def no_aFRR_up_outside_load_shift(model, n, t, b, e):
-    if not any(t == load_t[1] for load_t in model.TimeLoadShift):
-        return model.x_UP[n, t, b]  == 0
-    else:
-        return pyo.Constraint.Skip
-model.NoaFRRUpOutsideLoadShift = pyo.Constraint(model.Nodes, model.Time, model.ShiftableLoadForEnergyCarrier, rule=no_aFRR_up_outside_load_shift)
+    return model.x_UP[n, t, b]  == 0
+model.NoaFRRUpOutsideLoadShift = pyo.Constraint(model.Nodes_Market, model.TimeOutsideLoadShift, model.ShiftableLoadForEnergyCarrier, rule=no_aFRR_up_outside_load_shift)
 
 def no_aFRR_dwn_outside_load_shift(model, n, t, b, e):
-    if not any(t == load_t[1] for load_t in model.TimeLoadShift):
-        return model.x_DWN[n, t, b]  == 0
-    else:
-        return pyo.Constraint.Skip
-model.NoaFRRDwnOutsideLoadShift = pyo.Constraint(model.Nodes, model.Time, model.ShiftableLoadForEnergyCarrier, rule=no_aFRR_dwn_outside_load_shift)
+    return model.x_DWN[n, t, b]  == 0
+model.NoaFRRDwnOutsideLoadShift = pyo.Constraint(model.Nodes_Market, model.TimeOutsideLoadShift, model.ShiftableLoadForEnergyCarrier, rule=no_aFRR_dwn_outside_load_shift)
 
 #################################################################################
 ############## CONNECTING SoC AND UP/DOWN-REGULATION FOR LOADSHIFT ##############
 #################################################################################
 
+# Storage level entering hour t: the previous hour's q_SoC, or in the first hour of a period the level carried in
+# from a previous horizon (Carry_Initial_State, first hour only) or else Initial_SOC of the installed capacity
+def soc_before(model, n, t, b):
+    if not starts_period(model, t):
+        return model.q_SoC[n, model.Time.prev(t), b]
+    if pyo.value(model.Carry_Initial_State) and t == model.Time.first():
+        return model.Initial_SoC_Level[n, b]
+    return model.Initial_SOC[b] * (model.Max_Storage_Capacity[b] + new_storage(model, n, b))
+
 def aFRR_up_limit_sum_constraint(model, n, i, t, b, e):
-    if e == 'Electricity':
-        # Extract all time steps `tt` for the given interval `i`
-        relevant_times = [tt for (j, tt) in model.TimeLoadShift if j == i]
-        if t in relevant_times and t == 1:
-            soc_difference = model.Initial_SOC[b]*model.Max_Storage_Capacity[b] - model.q_SoC[n, relevant_times[-1] , b]
-            charge_sum = sum(model.Up_Shift_Max * model.Demand[n, t, e] for k in relevant_times if k >= t)
-            # Compute the discharge summation for times within the interval and before `t`
-            return model.x_UP[n, t, b]/model.Discharge_Efficiency[b] <= soc_difference + charge_sum    
-        elif t in relevant_times and t > 1:
-            # Get the minimum time in the interval
-            soc_difference = model.q_SoC[n, t-1, b] - model.q_SoC[n, relevant_times[-1] , b]
-            charge_sum = sum(model.Up_Shift_Max * model.Demand[n, t, e] for k in relevant_times if k >= t)
-            # Compute the discharge summation for times within the interval and before `t`
-            return model.x_UP[n, t, b]/model.Discharge_Efficiency[b] <= soc_difference + charge_sum        
-        return pyo.Constraint.Skip
-    return pyo.Constraint.Skip
-model.aFRRUpLimitLoadShift = pyo.Constraint(model.Nodes, model.TimeLoadShift, model.ShiftableLoadForEnergyCarrier, rule=aFRR_up_limit_sum_constraint)
+    window = model.LoadShiftTimes[i]
+    # Number of window hours from t onwards (windows list their hours in increasing order)
+    remaining = len(window) - window.ord(t) + 1
+    soc_difference = soc_before(model, n, t, b) - model.q_SoC[n, window.last(), b]
+    charge_sum = remaining * model.Up_Shift_Max * model.Demand[n, t, e]
+    return model.x_UP[model.Market_Node[n], t, b]/model.Discharge_Efficiency[b] <= soc_difference + charge_sum
+model.aFRRUpLimitLoadShift = pyo.Constraint(model.Nodes_Physical, model.TimeLoadShift, model.ShiftableElectricityLoad, rule=aFRR_up_limit_sum_constraint)
 
 def aFRR_dwn_limit_sum_constraint(model, n, i, t, b, e):
-    if e == 'Electricity':
-        # Extract all time steps `tt` for the given interval `i`
-        relevant_times = [tt for (j, tt) in model.TimeLoadShift if j == i]
-        if t in relevant_times and t == 1:
-            # Get the minimum time in the interval
-            soc_difference =  model.q_SoC[n, relevant_times[-1] , b] - model.Initial_SOC[b]*model.Max_Storage_Capacity[b] 
-            charge_sum = sum(model.Up_Shift_Max * model.Demand[n, t, e] for k in relevant_times if k >= t)
-            # Compute the discharge summation for times within the interval and before `t`
-            return model.x_DWN[n, t, b] <= soc_difference + charge_sum
-        elif t in relevant_times and t > 1:
-            # Get the minimum time in the interval
-            soc_difference =  model.q_SoC[n, relevant_times[-1] , b] - model.q_SoC[n, t-1, b] 
-            charge_sum = sum(model.Up_Shift_Max * model.Demand[n, t, e] for k in relevant_times if k >= t)
-            # Compute the discharge summation for times within the interval and before `t`
-            return model.x_DWN[n, t, b] <= soc_difference + charge_sum   
-        return pyo.Constraint.Skip
-    return pyo.Constraint.Skip
-model.aFRRDownLimitLoadShift = pyo.Constraint(model.Nodes, model.TimeLoadShift, model.ShiftableLoadForEnergyCarrier, rule=aFRR_dwn_limit_sum_constraint)
+    window = model.LoadShiftTimes[i]
+    # Number of window hours from t onwards (windows list their hours in increasing order)
+    remaining = len(window) - window.ord(t) + 1
+    soc_difference =  model.q_SoC[n, window.last(), b] - soc_before(model, n, t, b)
+    charge_sum = remaining * model.Up_Shift_Max * model.Demand[n, t, e]
+    return model.x_DWN[model.Market_Node[n], t, b] <= soc_difference + charge_sum
+model.aFRRDownLimitLoadShift = pyo.Constraint(model.Nodes_Physical, model.TimeLoadShift, model.ShiftableElectricityLoad, rule=aFRR_dwn_limit_sum_constraint)
 
 ##############################################################################
 ############## aFRR PARTICIPATION CONSTRAINTS FOR FLEXIBLE LOADS #############
@@ -599,33 +953,29 @@ model.aFRRDownLimitLoadShift = pyo.Constraint(model.Nodes, model.TimeLoadShift,
 
 def aFRR_limit(model, n, t, b, e):
     if e == 'Electricity' and (b,e) not in model.ShiftableLoadForEnergyCarrier:
-        return model.x_DWN[n, t, b] + model.x_UP[n, t, b]/model.Discharge_Efficiency[b] <= model.Max_charge_discharge_rate[b] + model.Energy2Power_Ratio[b] * model.v_new_bat[b]
+        return model.x_DWN[n, t, b] + model.x_UP[n, t, b]/model.Discharge_Efficiency[b] <= model.Max_charge_discharge_rate[b] + model.Energy2Power_Ratio[b] * new_storage(model, n, b)
     else:
         return pyo.Constraint.Skip
-model.aFRRLimit = pyo.Constraint(model.Nodes, model.Time, model.FlexibleLoadForEnergyCarrier, rule=aFRR_limit)
+model.aFRRLimit = pyo.Constraint(model.Nodes_Market, model.Time, model.FlexibleLoadForEnergyCarrier, rule=aFRR_limit)
 
 #################################################################################
 ############## ENSURE STORAGE CAPACITY UP/-DOWN REGULATION ######################
 #################################################################################
 
 def ensure_storage_capacity_up_regulation(model, n, t, b, e):
-    if e == 'Electricity' and t > 1 and (b,e) not in model.ShiftableLoadForEnergyCarrier: 
-        return model.q_SoC[n, t-1, b] - model.x_UP[n, t, b] >= 0
-    elif e == 'Electricity' and t == 1 and (b,e) not in model.ShiftableLoadForEnergyCarrier:
-        return model.Initial_SOC[b]*(model.Max_Storage_Capacity[b] + model.v_new_bat[b]) >= model.x_UP[n, t, b]
+    if e == 'Electricity' and (b,e) not in model.ShiftableLoadForEnergyCarrier: 
+        return soc_before(model, n, t, b) - model.x_UP[model.Market_Node[n], t, b] >= 0
     else:
         return pyo.Constraint.Skip    
-model.EnsureStorageCapacityUpRegulation = pyo.Constraint(model.Nodes, model.Time, model.FlexibleLoadForEnergyCarrier, rule=ensure_storage_capacity_up_regulation)
+model.EnsureStorageCapacityUpRegulation = pyo.Constraint(model.Nodes_Physical, model.Time, model.FlexibleLoadForEnergyCarrier, rule=ensure_storage_capacity_up_regulation)
 
 
 def ensure_storage_capacity_down_regulation(model, n, t, b, e):
-    if e == 'Electricity' and t > 1 and (b,e) not in model.ShiftableLoadForEnergyCarrier:  
-        return model.q_SoC[n, t-1, b] - (model.Max_Storage_Capacity[b] + model.v_new_bat[b]) + model.x_DWN[n, t, b]  <= 0
-    elif e == 'Electricity' and t == 1 and (b,e) not in model.ShiftableLoadForEnergyCarrier:
-        return (model.Max_Storage_Capacity[b] + model.v_new_bat[b])-model.Initial_SOC[b]*(model.Max_Storage_Capacity[b] + model.v_new_bat[b]) >= model.x_DWN[n, t, b]
+    if e == 'Electricity' and (b,e) not in model.ShiftableLoadForEnergyCarrier:  
+        return soc_before(model, n, t, b) - (model.Max_Storage_Capacity[b] + new_storage(model, n, b)) + model.x_DWN[model.Market_Node[n], t, b]  <= 0
     else:
         return pyo.Constraint.Skip    
-model.EnsureStorageCapacityDownRegulation = pyo.Constraint(model.Nodes, model.Time, model.FlexibleLoadForEnergyCarrier, rule=ensure_storage_capacity_down_regulation)
+model.EnsureStorageCapacityDownRegulation = pyo.Constraint(model.Nodes_Physical, model.Time, model.FlexibleLoadForEnergyCarrier, rule=ensure_storage_capacity_down_regulation)
 
 
 ###########################################################
@@ -634,18 +984,18 @@ model.EnsureStorageCapacityDownRegulation = pyo.Constraint(model.Nodes, model.Ti
 
 def up_regulation_activation(model, n, t, b, e):
     if e == 'Electricity':
-        return model.Activation_Factor_UP_Regulation[n, t] * model.x_UP[n, t, b] <= model.q_discharge[n, t, b]
+        return model.Activation_Factor_UP_Regulation[n, t] * model.x_UP[model.Market_Node[n], t, b] <= model.q_discharge[n, t, b]
     else:
         return pyo.Constraint.Skip
-model.UpRegulationActivation = pyo.Constraint(model.Nodes, model.Time, model.FlexibleLoadForEnergyCarrier, rule=up_regulation_activation)
+model.UpRegulationActivation = pyo.Constraint(model.Nodes_Physical, model.Time, model.FlexibleLoadForEnergyCarrier, rule=up_regulation_activation)
 
 
 def down_regulation_activation(model, n, t, b, e):
     if e == 'Electricity':
-        return model.Activation_Factor_DWN_Regulation[n, t] * model.x_DWN[n, t, b] <= model.Charge_Efficiency[b] * model.q_charge[n, t, b]
+        return model.Activation_Factor_DWN_Regulation[n, t] * model.x_DWN[model.Market_Node[n], t, b] <= model.Charge_Efficiency[b] * model.q_charge[n, t, b]
     else:
         return pyo.Constraint.Skip
-model.DownRegulationActivation = pyo.Constraint(model.Nodes, model.Time, model.FlexibleLoadForEnergyCarrier, rule=down_regulation_activation)
+model.DownRegulationActivation = pyo.Constraint(model.Nodes_Physical, model.Time, model.FlexibleLoadForEnergyCarrier, rule=down_regulation_activation)
 
 ########################################################################
 ############## FLEXIBLE ASSET CONSTRAINTS/STORAGE DYNAMICS #############
@@ -656,40 +1006,33 @@ def flexible_asset_charge_discharge_limit(model, n, t, b, e):
         return (
             model.q_charge[n, t, b] 
             + model.q_discharge[n, t, b] / model.Discharge_Efficiency[b] 
-            <= model.Max_charge_discharge_rate[b] + model.Energy2Power_Ratio[b] * model.v_new_bat[b]
+            <= model.Max_charge_discharge_rate[b] + model.Energy2Power_Ratio[b] * new_storage(model, n, b)
         )
     else:
         return pyo.Constraint.Skip
-model.FlexibleAssetChargeDischargeLimit = pyo.Constraint(model.Nodes, model.Time, model.FlexibleLoadForEnergyCarrier, rule=flexible_asset_charge_discharge_limit)
+model.FlexibleAssetChargeDischargeLimit = pyo.Constraint(model.Nodes_Physical, model.Time, model.FlexibleLoadForEnergyCarrier, rule=flexible_asset_charge_discharge_limit)
 
 def state_of_charge(model, n, t, b, e):
-    if t == 1:  # Initialisation of flexible assets
-        return (
-            model.q_SoC[n, t, b]
-            == model.Initial_SOC[b] * (model.Max_Storage_Capacity[b] + model.v_new_bat[b]) * (1 - model.Self_Discharge[b])
-            + model.q_charge[n, t, b]
-            - model.q_discharge[n, t, b] / model.Discharge_Efficiency[b]
-        )
-    else:       # Storage Dynamics
-        return (
-            model.q_SoC[n, t, b]
-            == model.q_SoC[n, t-1, b] * (1 - model.Self_Discharge[b])
-            + model.q_charge[n, t, b]
-            - model.q_discharge[n, t, b] / model.Discharge_Efficiency[b]
-        )
-model.StateOfCharge = pyo.Constraint(model.Nodes, model.Time, model.FlexibleLoadForEnergyCarrier, rule=state_of_charge)
+    # Storage dynamics, starting from the initial level in the first hour of every period
+    return (
+        model.q_SoC[n, t, b]
+        == soc_before(model, n, t, b) * (1 - model.Self_Discharge[b])
+        + model.q_charge[n, t, b]
+        - model.q_discharge[n, t, b] / model.Discharge_Efficiency[b]
+    )
+model.StateOfCharge = pyo.Constraint(model.Nodes_Physical, model.Time, model.FlexibleLoadForEnergyCarrier, rule=state_of_charge)
 
 def end_of_horizon_SoC(model, n, t, b, e):
-    if t == model.Time.last():
-        return model.q_SoC[n, t, b] == model.Initial_SOC[b] * (model.Max_Storage_Capacity[b] + model.v_new_bat[b])
+    if ends_period(model, t) and pyo.value(model.Enforce_End_SoC):
+        return model.q_SoC[n, t, b] == model.Initial_SOC[b] * (model.Max_Storage_Capacity[b] + new_storage(model, n, b))
     else:
         return pyo.Constraint.Skip
-model.EndOfHorizonSoC = pyo.Constraint(model.Nodes, model.Time, model.FlexibleLoadForEnergyCarrier, rule = end_of_horizon_SoC)
+model.EndOfHorizonSoC = pyo.Constraint(model.Nodes_Physical, model.Time, model.FlexibleLoadForEnergyCarrier, rule = end_of_horizon_SoC)
 
 
 def flexible_asset_energy_limit(model, n, t, b, e):
-    return model.q_SoC[n, t, b] <= model.Max_Storage_Capacity[b] + model.v_new_bat[b]
-model.FlexibleAssetEnergyLimits = pyo.Constraint(model.Nodes, model.Time, model.FlexibleLoadForEnergyCarrier, rule=flexible_asset_energy_limit)
+    return model.q_SoC[n, t, b] <= model.Max_Storage_Capacity[b] + new_storage(model, n, b)
+model.FlexibleAssetEnergyLimits = pyo.Constraint(model.Nodes_Physical, model.Time, model.FlexibleLoadForEnergyCarrier, rule=flexible_asset_energy_limit)
 
 ####################################################
 ############## AVAILABILITY CONSTRAINT #############
@@ -697,8 +1040,8 @@ model.FlexibleAssetEnergyLimits = pyo.Constraint(model.Nodes, model.Time, model.
 
 def supply_limitation(model, n, t, i, e, o):
     return (sum(model.y_out[n, t, i, e, o] for e,o in model.EnergyCarrier * model.Mode_of_operation if (i,e,o) in model.TechnologyToEnergyCarrier)  
-            <= model.Availability_Factor[n, t, i] * (model.Initial_Installed_Capacity[i] + model.v_new_tech[i]))
-model.SupplyLimitation = pyo.Constraint(model.Nodes, model.Time, model.TechnologyToEnergyCarrier, rule=supply_limitation)
+            <= model.Availability_Factor[n, t, i] * (model.Initial_Installed_Capacity[i] + new_technology(model, n, i)))
+model.SupplyLimitation = pyo.Constraint(model.Nodes_Physical, model.Time, model.TechnologyToEnergyCarrier, rule=supply_limitation)
 
 ##############################################################
 ############## EXPORT LIMITATION AND GRID TARIFF #############
@@ -709,166 +1052,313 @@ def export_limitation(model, n, t, e):
         return model.z_export[n, t, e] <= model.Max_Export
     else:
         return pyo.Constraint.Skip
-model.ExportLimitation = pyo.Constraint(model.Nodes, model.Time, model.EnergyCarrier, rule=export_limitation)
+model.ExportLimitation = pyo.Constraint(model.Nodes_Physical, model.Time, model.EnergyCarrier, rule=export_limitation)
 
-def peak_load(model, n, t, i, e, o, m):
-    if i == 'Power_Grid' and e == 'Electricity':
-        return (model.y_out[n, t, i, e, o] <= model.y_max[n, m])
+def peak_load(model, n, m, t, i, e, o):
+    return (model.y_out[n, t, i, e, o] <= model.y_max[n, m])
+model.PeakLoad = pyo.Constraint(model.Nodes_Physical, model.TimeInMonth, model.GridImport, rule=peak_load)
+
+def peak_carry_over(model, n, m):
+    if pyo.value(model.Carried_Peak[n, m]) > 0:
+        return model.y_max[n, m] >= model.Carried_Peak[n, m]
     else:
         return pyo.Constraint.Skip
-model.PeakLoad = pyo.Constraint(model.Nodes, model.TimeInMonth, model.TechnologyToEnergyCarrier, model.Month, rule=peak_load)
+model.PeakCarryOver = pyo.Constraint(model.Nodes_Physical, model.Month, rule=peak_carry_over)
 
 ##############################################################
 ##################### INVESTMENT LIMITATIONS #################
 ##############################################################
 
-def CAPEX_technology_limitations(model, i):
-    return (model.Cost_Expansion_Tec[i] * model.v_new_tech[i] <= model.Max_CAPEX_tech[i])
-model.CAPEXTechnologyLim = pyo.Constraint(model.Technology, rule=CAPEX_technology_limitations)
+#Per strategic period
+def CAPEX_technology_limitations(model, p, i):
+    return (model.Cost_Expansion_Tec[i] * model.v_new_tech[p, i] <= model.Max_CAPEX_tech[i])
+model.CAPEXTechnologyLim = pyo.Constraint(model.Strategic_Periods, model.Technology, rule=CAPEX_technology_limitations)
 
-def CAPEX_flexibleLoad_limitations(model, b):
-    return (model.Cost_Expansion_Bat[b] * model.v_new_bat[b] <= model.Max_CAPEX_flex[b])
-model.CAPEXFlexibleLoadLim = pyo.Constraint(model.FlexibleLoad, rule=CAPEX_flexibleLoad_limitations)
+def CAPEX_flexibleLoad_limitations(model, p, b):
+    return (model.Cost_Expansion_Bat[b] * model.v_new_bat[p, b] <= model.Max_CAPEX_flex[b])
+model.CAPEXFlexibleLoadLim = pyo.Constraint(model.Strategic_Periods, model.FlexibleLoad, rule=CAPEX_flexibleLoad_limitations)
 
 ##############################################################
 ##################### CARBON EMISSION LIMIT ##################
 ##############################################################
 
 def Carbon_Emission_Limit(model, n):
-    total_emission = sum(
-        model.y_activity[n, t, i, o] * model.Carbon_Intensity[i, o]
+    total_emission = linear_sum(
+        (count * model.Carbon_Intensity[i, o] * model.Time_Weight[t], model.y_activity[n, t, i, o])
         for t in model.Time
-        for i,e,o in model.TechnologyToEnergyCarrier
+        for (i, o), count in activity_multiplicity(model).items()
     )
     return total_emission <= model.Max_Carbon_Emission
-model.CarbonEmissionLimit = pyo.Constraint(model.Nodes, rule=Carbon_Emission_Limit)
+model.CarbonEmissionLimit = pyo.Constraint(model.Nodes_Physical, rule=Carbon_Emission_Limit)
 
 ##############################################################
 ##################### NON-ANTICIPATIVITY #####################
 ##############################################################
+#Parent_Node_NA is empty with Compact_NA: the children then share their ancestor's variables
 
 def Day_ahead_NA(model, n, p, t):
     return (model.x_DA[n, t] == model.x_DA[p, t])
-model.DayAheadToIntraday = pyo.Constraint(model.Parent_Node, model.Time, rule=Day_ahead_NA)
+model.DayAheadToIntraday = pyo.Constraint(model.Parent_Node_NA, model.Time, rule=Day_ahead_NA)
 
 def Intraday_Up_NA(model, n, p, t):
     return (model.x_ID_Up[n, t] == model.x_ID_Up[p, t])
     
-model.IntradayToRealTimeUp = pyo.Constraint(model.Parent_Node, model.Time, rule=Intraday_Up_NA)
+model.IntradayToRealTimeUp = pyo.Constraint(model.Parent_Node_NA, model.Time, rule=Intraday_Up_NA)
 
 def Intraday_Dwn_NA(model, n, p, t):
     return (model.x_ID_Dwn[n, t] == model.x_ID_Dwn[p, t])
     
-model.IntradayToRealTimeDown = pyo.Constraint(model.Parent_Node, model.Time, rule=Intraday_Dwn_NA)
+model.IntradayToRealTimeDown = pyo.Constraint(model.Parent_Node_NA, model.Time, rule=Intraday_Dwn_NA)
 
 def Reserve_Capacity_Dwn_NA(model, n, p, t, b, e):
     if e == "Electricity" :
         return (model.x_DWN[n, t, b] == model.x_DWN[p, t, b])
     else:
         return pyo.Constraint.Skip
-model.ReserveCapacityDwn = pyo.Constraint(model.Parent_Node, model.Time, model.FlexibleLoadForEnergyCarrier, rule = Reserve_Capacity_Dwn_NA) 
+model.ReserveCapacityDwn = pyo.Constraint(model.Parent_Node_NA, model.Time, model.FlexibleLoadForEnergyCarrier, rule = Reserve_Capacity_Dwn_NA) 
 
 def Reserve_Capacity_Up_NA(model, n, p, t, b, e):
     if e == "Electricity":
         return (model.x_UP[n, t, b] == model.x_UP[p, t, b])
     else:
         return pyo.Constraint.Skip
-model.DayAheadToIntradayUp = pyo.Constraint(model.Parent_Node, model.Time, model.FlexibleLoadForEnergyCarrier, rule = Reserve_Capacity_Up_NA) 
-
+model.DayAheadToIntradayUp = pyo.Constraint(model.Parent_Node_NA, model.Time, model.FlexibleLoadForEnergyCarrier, rule = Reserve_Capacity_Up_NA) 
 
-"""
-MATCHING DATA FROM CASE WITH MATHEMATICAL MODEL AND PRINTING DATA
-"""
-our_model = model.create_instance(data)   
-our_model.dual = pyo.Suffix(direction=pyo.Suffix.IMPORT) #Import dual values into solver results
-import pdb; pdb.set_trace()
 
 """
-SOLVING PROBLEM
+EXTRACT VALUE OF VARIABLES AND WRITE THEM TO PARQUET (OR EXCEL)
 """
-opt = SolverFactory("gurobi", Verbose=True)
-#opt.options['LogFile'] = 'gurobi_log.txt'
-
-#start the timer
-start_time = time.time()
-
-results = opt.solve(our_model, tee=True)
-
-#stop the timer
-end_time = time.time()
-running_time = end_time - start_time
-
-"""
-DISPLAY RESULTS??
-"""
-
-our_model.display('results.csv')
-our_model.dual.display()
-print("-" * 70)
-print("Objective and running time:")
-print(f"Objective value for this mongo model is: {round(pyo.value(our_model.Objective),2)}")
-print(f"The instance was solved in {round(running_time, 4)} seconds🙂")
-print("-" * 70)
-print("Hardware details:")
-print(f"Processor: {platform.processor()}")
-print(f"Machine: {platform.machine()}")
-print(f"System: {platform.system()} {platform.release()}")
-#print(f"CPU Cores: {psutil.cpu_count(logical=True)} (Logical), {psutil.cpu_count(logical=False)} (Physical)")
-#print(f"Total Memory: {psutil.virtual_memory().total / 1e9:.2f} GB")
-print("-" * 70)
-#import pdb; pdb.set_trace()
 
-
-
-"""
-EXTRACT VALUE OF VARIABLES AND WRITE THEM INTO EXCEL FILE
-"""
+# Column names for the index of a variable: one per index set, numbered for multi-dimensional sets
+def _index_columns(var):
+    columns = []
+    for s in var.index_set().subsets():
+        names = [s.name] if s.dimen == 1 else [f"{s.name}_{k+1}" for k in range(s.dimen)]
+        columns += [name if name not in columns else f"{name}_{len(columns)+1}" for name in names]
+    return columns
+
+# One long table per variable: typed index columns plus a "value" column. Values are read in one pass over
+# the variable's data objects (the solution is already loaded there) instead of value() per index.
+def results_to_tables(model_instance, drop_zeros=True):
+    tables = {}
+    for var in model_instance.component_objects(pyo.Var, active=True):
+        values = np.array([v.value for v in var.values()], dtype=float)  # None -> NaN
+        keep = ~np.isnan(values)
+        if drop_zeros:
+            keep &= values != 0
+        if var.is_indexed():
+            keys = [k if isinstance(k, tuple) else (k,) for k, kept in zip(var.keys(), keep) if kept]
+            table = pd.DataFrame.from_records(keys, columns=_index_columns(var), nrows=len(keys))
+        else:
+            table = pd.DataFrame(index=range(int(keep.sum())))
+        table["value"] = values[keep]
+        tables[var.name] = table
+    return tables
+
+def save_results_to_parquet(model_instance, folder="Variable_Results", drop_zeros=True):
+    # One <variable>.parquet file per variable, no row limit
+    os.makedirs(folder, exist_ok=True)
+    for name, table in results_to_tables(model_instance, drop_zeros).items():
+        table.to_parquet(os.path.join(folder, f"{name}.parquet"), index=False)
+    print(f"Variable results saved to {folder}/")
+
+# Primal values, duals and reduced costs as rows (component, index, value). The rows are generated one at a
+# time and written straight to a csv.writer, so memory does not grow with the model size.
+def _index_text(index):
+    return ",".join(map(str, index)) if isinstance(index, tuple) else ("" if index is None else str(index))
+
+def _primal_rows(model_instance):
+    for var in model_instance.component_objects(pyo.Var, active=True):
+        for index, v in var.items():
+            if v.value is not None:
+                yield var.name, _index_text(index), v.value
+
+def _suffix_rows(model_instance, suffix_name, ctype):
+    suffix = getattr(model_instance, suffix_name, None)
+    if suffix is None or not len(suffix):
+        return
+    for component in model_instance.component_objects(ctype, active=True):
+        for index, data in component.items():
+            if data in suffix:
+                yield component.name, _index_text(index), suffix[data]
+
+def write_results_csv(model_instance, folder="Results"):
+    os.makedirs(folder, exist_ok=True)
+    files = {
+        "primal.csv": _primal_rows(model_instance),
+        "duals.csv": _suffix_rows(model_instance, "dual", pyo.Constraint),
+        "reduced_costs.csv": _suffix_rows(model_instance, "rc", pyo.Var),
+    }
+    for filename, rows in files.items():
+        with open(os.path.join(folder, filename), "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["component", "index", "value"])
+            writer.writerows(rows)
+    print(f"Primal values, duals and reduced costs saved to {folder}/")
 
 def save_results_to_excel(model_instance, filename="Variable_Results.xlsx"):
     
-    # Saves Pyomo variable results into an Excel file with filtered output.
-    # Only includes rows with non-zero or non-null values for variables.
+    # Saves Pyomo variable results into an Excel file with filtered output (slow, and at most ~1M rows
+    # per variable). Only includes rows with non-zero or non-null values for variables.
     
-    import pandas as pd
-    from pyomo.environ import value
-
-    # Create an Excel writer object
     with pd.ExcelWriter(filename, engine="xlsxwriter") as writer:
-        # Loop over all active variables in the model
-        for var in model_instance.component_objects(pyo.Var, active=True):
-            var_name = var.name  # Get the variable name
-            var_data = []
-            
-            # Collect variable data
-            for index in var:
-                try:
-                    var_value = value(var[index])  # Safely get the variable value
-                except ValueError:
-                    var_value = 0  # If uninitialized, set to None
-                if var_value:  # Include only non-zero and non-null values
-                    var_data.append((index, var_value))
-            
-            # Transform data into a DataFrame
-            if var_data:  # Only proceed if there is data
-                df = pd.DataFrame(var_data, columns=["Index", var_name])
-                
-                # Dynamically unpack the indices into separate columns
-                max_index_length = max(len(idx) if isinstance(idx, tuple) else 1 for idx, _ in var_data)
-                unpacked_indices = pd.DataFrame(
-                    [list(index) + [None] * (max_index_length - len(index)) if isinstance(index, tuple) else [index] for index, _ in var_data]
-                )
-                
-                # Add unpacked indices to the DataFrame
-                unpacked_indices.columns = [f"Index_{i+1}" for i in range(max_index_length)]
-                df = pd.concat([unpacked_indices, df[var_name]], axis=1)
-                
-                # Write the filtered DataFrame to an Excel sheet
-                df.to_excel(writer, sheet_name=var_name[:31], index=False)
+        for var_name, table in results_to_tables(model_instance).items():
+            if len(table):
+                # Same layout as before: Index_1, Index_2, ... and a column named after the variable
+                table.columns = [f"Index_{i+1}" for i in range(table.shape[1] - 1)] + [var_name]
+                table.to_excel(writer, sheet_name=var_name[:31], index=False)
     
     print(f"Variable results saved to {filename}")
 
-# Usage after solving the model
-save_results_to_excel(our_model, filename="Variable_Results.xlsx")
+##############################################################
+##################### RUN INSTRUMENTATION ####################
+##############################################################
+#Every phase of the script run is timed (wall and CPU time, CPU including the solver processes it started)
+#and tagged with the peak memory reached so far, then saved as one JSON report.
+
+def _cpu_seconds():
+    # User + system time of this process and of its finished children (the solver)
+    return sum(os.times()[:4])
+
+def _peak_memory_mb():
+    # High-water mark of this process and of its largest child so far
+    if resource is not None:
+        scale = 1 / (1 << 20) if platform.system() == "Darwin" else 1 / 1024  # ru_maxrss is bytes on macOS, kB elsewhere
+        return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+    if psutil is not None:
+        memory = psutil.Process().memory_info()
+        return getattr(memory, "peak_wset", memory.rss) / (1 << 20)
+    return None
+
+class RunReport:
+    def __init__(self, log=LOG_PHASES):
+        self.log = log
+        self.phases = []
+        self.info = {}
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        wall, cpu = time.perf_counter(), _cpu_seconds()
+        try:
+            yield
+        finally:
+            entry = {"phase": name, "wall_s": time.perf_counter() - wall, "cpu_s": _cpu_seconds() - cpu, "peak_memory_mb": _peak_memory_mb()}
+            self.phases.append(entry)
+            if self.log:
+                memory = "" if entry["peak_memory_mb"] is None else f", peak memory {entry['peak_memory_mb']:.0f} MB"
+                print(f"[{name}] {entry['wall_s']:.2f} s wall, {entry['cpu_s']:.2f} s CPU{memory}", flush=True)
+
+    def save(self, filename):
+        report = {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "machine": {"processor": platform.processor(), "machine": platform.machine(), "system": f"{platform.system()} {platform.release()}",
+                        "cpus": os.cpu_count(), "memory_gb": psutil.virtual_memory().total / 1e9 if psutil is not None else None},
+            "total_wall_s": time.perf_counter() - self.start,
+            "phases": self.phases,
+            **self.info,
+        }
+        with open(filename, "w") as f:
+            json.dump(report, f, indent=1)
+        print(f"Run report saved to {filename}")
+
+if __name__ == "__main__":
+    """
+    MATCHING DATA FROM CASE WITH MATHEMATICAL MODEL AND PRINTING DATA
+    """
+    report = RunReport()
+
+    # Read the workbook (only re-parsed when it changed) and build the instance straight from memory
+    with report.phase("read_all_sheets"):
+        tables = read_all_sheets(INPUT_EXCEL, write_tab=WRITE_TAB_FILES)
+    with report.phase("load_data"):
+        data = load_data(tables)
+    data[None]["Compact_NA"] = {None: COMPACT_NA}
+    data[None]["Physical_RT_Only"] = {None: PHYSICAL_RT_ONLY}
+    data[None]["RT_Formulation"] = {None: RT_FORMULATION}
+    hour_map = None
+    if REPRESENTATIVE_PERIODS:
+        import representative_periods
+        with report.phase("aggregate"):
+            data, hour_map = representative_periods.aggregate(data, *REPRESENTATIVE_PERIODS)
+    with report.phase("create_instance"):
+        our_model = model.create_instance(data)   
+    our_model.dual = pyo.Suffix(direction=pyo.Suffix.IMPORT) #Import dual values into solver results
+    our_model.rc = pyo.Suffix(direction=pyo.Suffix.IMPORT) #Import reduced costs (LPs only)
+    report.info.update(variables=our_model.nvariables(), constraints=our_model.nconstraints())
+
+    """
+    SOLVING PROBLEM
+    """
+    opt = SolverFactory(SOLVER, Verbose=True)
+    #opt.options['LogFile'] = 'gurobi_log.txt'
+
+    # With the investments fixed nothing couples the day-ahead subtrees: solve them side by side and merge.
+    # The solve phase includes writing the solver's input file and reading the solution back; the time the
+    # solver itself reports (where it does) is kept as solver_reported_s, the rest is file I/O.
+    import decomposition
+    solver_time = None
+    decompose = DECOMPOSE_SUBTREES and decomposition.investments_fixed(data)
+    presolved = None
+    if PRESOLVE and not decompose:
+        import presolve
+        with report.phase("presolve"):
+            presolved = presolve.presolve(our_model)
+        report.info["presolve"] = presolved.summary()
+    with report.phase("solve"):
+        if decompose:
+            objective, _ = decomposition.solve_subtrees(data, our_model, workers=WORKERS, solver=SOLVER, use_presolve=PRESOLVE)
+            print(f"Solved {len(decomposition.subtrees(data))} day-ahead subtrees in parallel")
+            if MARGINAL_VALUES:
+                print("No duals from the subtree solves: the marginal values re-solve the full model as an LP")
+        else:
+            results = opt.solve(our_model, tee=True)
+            solver_time = getattr(results.solver, "wallclock_time", None) or getattr(results.solver, "time", None)
+    if isinstance(solver_time, (int, float)):
+        report.phases[-1]["solver_reported_s"] = solver_time
+    running_time = report.phases[-1]["wall_s"]
+    # Back to the full model (the presolved variables keep their values) for the marginal values; undo also drops
+    # the reduced model's duals, so marginal_values solves the full one
+    if presolved is not None:
+        presolved.undo()
+
+    """
+    DISPLAY RESULTS??
+    """
+
+    with report.phase("write_results_csv"):
+        write_results_csv(our_model, folder="Results")
+    if MARGINAL_VALUES:
+        import shadow_prices
+        with report.phase("marginal_values"):
+            shadow_prices.save_marginal_values(shadow_prices.marginal_values(our_model, solver=SOLVER), "Results/marginal_values.npz")
+    print("-" * 70)
+    print("Objective and running time:")
+    print(f"Objective value for this mongo model is: {round(pyo.value(our_model.Objective),2)}")
+    print(f"The instance was solved in {round(running_time, 4)} seconds🙂")
+    print("-" * 70)
+    print("Hardware details:")
+    print(f"Processor: {platform.processor()}")
+    print(f"Machine: {platform.machine()}")
+    print(f"System: {platform.system()} {platform.release()}")
+    if psutil is not None:
+        print(f"CPU Cores: {psutil.cpu_count(logical=True)} (Logical), {psutil.cpu_count(logical=False)} (Physical)")
+        print(f"Total Memory: {psutil.virtual_memory().total / 1e9:.2f} GB")
+    print("-" * 70)
+
+    # Usage after solving the model
+    with report.phase("save_results"):
+        if hour_map is not None:
+            # Back at full resolution: every hour reports the values of the representative hour standing for it
+            representative_periods.save_results_to_parquet(our_model, hour_map, folder="Variable_Results")
+        elif RESULTS_FORMAT == "excel":
+            save_results_to_excel(our_model, filename="Variable_Results.xlsx")
+        else:
+            save_results_to_parquet(our_model, folder="Variable_Results")
+
+    report.info["objective"] = pyo.value(our_model.Objective)
+    if RUN_REPORT:
+        report.save(RUN_REPORT)
 
 
 """
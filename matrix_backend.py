@@ -0,0 +1,655 @@
+import argparse
+import os
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import pyomo.environ as pyo
+import scipy.sparse as sp
+from scipy.optimize import Bounds, LinearConstraint, milp
+
+import decomposition
+import main
+
+"""
+SPARSE-MATRIX BACKEND
+"""
+#Assembles the formulation of main.py directly as a sparse matrix, without building Pyomo components or
+#expressions: every parameter is read once into a dense NumPy array over its index sets, and every
+#constraint family is written as whole arrays of (row, column, coefficient) entries, one vectorised
+#statement per term of the rule. The result is a MatrixModel
+#  A                      SciPy CSR constraint matrix, row_lower <= A x <= row_upper
+#  c, offset              objective (minimised) c x + offset
+#  col_lower, col_upper   variable bounds
+#  integrality            1 for integer columns (binary_RT), 0 otherwise
+#  variables              variable name -> Block (column offset, index sets, labels)
+#  constraints            constraint name -> slice of its rows
+#which can be written as MPS (write_mps) or solved with the HiGHS solver bundled with SciPy (solve). The
+#solution is mapped back to the tables of main.results_to_tables (same names and columns).
+#The rules below follow main.py family by family and carry its constraint names; a change to the formulation
+#there has to be made here as well. check() (--check) confirms both give the same objective, and
+#tests/test_matrix_backend.py also compares the row and column counts on the sample workbook.
+#
+#   python matrix_backend.py --check
+#   python matrix_backend.py --mps model.mps --out Variable_Results
+
+ELECTRICITY = "Electricity"
+
+# Variables as main.py declares them: index sets, bounds (a name is a scalar parameter, a tuple of names the smallest
+# of them) and whether they are integer
+VARIABLES = {
+    "x_UP": (("Nodes_Market", "Time", "FlexibleLoad"), (0, np.inf), False),
+    "x_DWN": (("Nodes_Market", "Time", "FlexibleLoad"), (0, np.inf), False),
+    "x_UP_Tot": (("Nodes", "Time"), (0, np.inf), False),
+    "x_DWN_Tot": (("Nodes", "Time"), (0, np.inf), False),
+    "x_DA": (("Nodes_Market", "Time"), (0, np.inf), False),
+    "x_ID_Up": (("Nodes_Market", "Time"), (0, np.inf), False),
+    "x_ID_Dwn": (("Nodes_Market", "Time"), (0, np.inf), False),
+    "x_RT_Up": (("Nodes_Physical", "Time"), (0, ("Max_RT_Volume", "Max_Cable_Capacity")), False),
+    "x_RT_Dwn": (("Nodes_Physical", "Time"), (0, ("Max_RT_Volume", "Max_Cable_Capacity")), False),
+    "y_out": (("Nodes_Physical", "Time", "TechnologyToEnergyCarrier"), (0, np.inf), False),
+    "y_in": (("Nodes_Physical", "Time", "EnergyCarrierToTechnology"), (0, np.inf), False),
+    "y_activity": (("Nodes_Physical", "Time", "Technology", "Mode_of_operation"), (0, np.inf), False),
+    "z_export": (("Nodes_Physical", "Time", "EnergyCarrier"), (0, 0), False),
+    "q_charge": (("Nodes_Physical", "Time", "FlexibleLoad"), (0, np.inf), False),
+    "q_discharge": (("Nodes_Physical", "Time", "FlexibleLoad"), (0, np.inf), False),
+    "q_SoC": (("Nodes_Physical", "Time", "FlexibleLoad"), (0, np.inf), False),
+    "v_new_tech": (("Strategic_Periods", "Technology"), (0, 0), False),
+    "v_new_bat": (("Strategic_Periods", "FlexibleLoad"), (0, 0), False),
+    "y_max": (("Nodes_Physical", "Month"), (0, np.inf), False),
+    "binary_RT": (("Binary_RT_Pairs",), (0, 1), True),
+}
+
+MatrixModel = namedtuple("MatrixModel", ["A", "row_lower", "row_upper", "c", "offset", "col_lower", "col_upper",
+                                         "integrality", "variables", "constraints"])
+
+
+##############################################################
+######################## INPUT ARRAYS ########################
+##############################################################
+
+def _scalar(data, name):
+    values = data.get(name)
+    return values[None] if values else getattr(main.model, name).default()
+
+def _bound(data, x):
+    if isinstance(x, str):
+        return _scalar(data, x)
+    return min(_scalar(data, name) for name in x) if isinstance(x, tuple) else x
+
+# Dense array of a parameter over the given label lists (an axis of tuples takes as many key elements as
+# its tuples are long). Entries missing from the data get the Param's default, or NaN if it has none.
+def _array(data, name, *axes):
+    default = getattr(main.model, name).default()
+    array = np.full([len(labels) for labels in axes], np.nan if default is pyo.Param.NoValue else default, dtype=float)
+    if not array.size:
+        return array
+    positions = [{label: k for k, label in enumerate(labels)} for labels in axes]
+    widths = [len(labels[0]) if isinstance(labels[0], tuple) else 1 for labels in axes]
+    for key, value in data.get(name, {}).items():
+        key = key if isinstance(key, tuple) else (key,)
+        index, start = [], 0
+        for position, width in zip(positions, widths):
+            k = position.get(key[start] if width == 1 else key[start:start + width])
+            if k is None:
+                break
+            index.append(k)
+            start += width
+        else:
+            array[tuple(index)] = value
+    return array
+
+# The index sets of main.py, including the derived ones (Market_Node, Nodes_Market, Parent_Node_NA, ...)
+def index_sets(data):
+    sets = {name: list(data[name][None]) for name in main.SET_SOURCES}
+    if _scalar(data, "Compact_NA"):
+        parent = dict(sets["Parent_Node"])
+        market = {}
+        for n in sets["Nodes"]:
+            root = n
+            while root in parent:
+                root = parent[root]
+            market[n] = root
+    else:
+        market = {n: n for n in sets["Nodes"]}
+    sets["Market_Node"] = market
+    sets["Nodes_Market"] = list(dict.fromkeys(market[n] for n in sets["Nodes"]))
+    sets["Parent_Node_NA"] = [] if _scalar(data, "Compact_NA") else list(sets["Parent_Node"])
+    sets["Nodes_Physical"] = list(sets["Nodes_RT"]) if _scalar(data, "Physical_RT_Only") else list(sets["Nodes"])
+    rt = set(sets["Nodes_RT"])
+    sets["Real_Time_Pairs"] = [(n, t) for n in sets["Nodes_Physical"] if n in rt for t in sets["Time"]]
+    formulation, imbalance = _scalar(data, "RT_Formulation"), _scalar(data, "Cost_Imbal")
+    up, dwn = data.get("RK_Up_Price", {}), data.get("RK_Dwn_Price", {})
+    needed = lambda key: up.get(key, main.model.RK_Up_Price.default()) - dwn.get(key, main.model.RK_Dwn_Price.default()) + 2 * imbalance <= 0
+    sets["Binary_RT_Pairs"] = [key for key in sets["Real_Time_Pairs"] if formulation == "binary" or (formulation == "lp" and needed(key))]
+    sets["LoadShiftTimes"] = {i: [t for (j, t) in sets["TimeLoadShift"] if j == i] for i in sets["LoadShiftingIntervals"]}
+    inside = set(t for (i, t) in sets["TimeLoadShift"])
+    sets["TimeOutsideLoadShift"] = [t for t in sets["Time"] if t not in inside]
+    sets["GridImport"] = [(i, e, o) for (i, e, o) in sets["TechnologyToEnergyCarrier"] if i == "Power_Grid" and e == ELECTRICITY]
+    sets["ShiftableElectricityLoad"] = [(b, e) for (b, e) in sets["ShiftableLoadForEnergyCarrier"] if e == ELECTRICITY]
+    sets["Period_Start"] = list(data.get("Period_Start", {None: []})[None])
+    return sets
+
+
+##############################################################
+####################### MATRIX ASSEMBLY ######################
+##############################################################
+
+# Columns of one variable: col(*index) gives the column of the entries at the given label positions
+# (integer arrays, broadcast against each other)
+class Block:
+    def __init__(self, offset, sets, labels):
+        self.offset = offset
+        self.sets = sets
+        self.labels = labels
+        self.shape = tuple(len(l) for l in labels)
+        self.size = int(np.prod(self.shape))
+
+    def __call__(self, *index):
+        return self.offset + np.ravel_multi_index(np.broadcast_arrays(*index), self.shape)
+
+# Collects (row, column, coefficient) entries family by family. A family's rows form an array of the given
+# shape; every term is (columns, coefficients), broadcast against the rows, and any trailing axes beyond
+# the row shape are summed over. keep drops rows (Constraint.Skip); zero coefficients are left out.
+class _Rows:
+    def __init__(self):
+        self.entries, self.lower, self.upper = [], [], []
+        self.constraints = {}
+        self.count = 0
+
+    def add(self, name, shape, terms, lower=-np.inf, upper=np.inf, keep=True):
+        shape = tuple(shape)
+        keep = np.broadcast_to(keep, shape).ravel()
+        number = np.cumsum(keep) - 1 + self.count
+        rows = np.where(keep, number, -1).reshape(shape)
+        for cols, coefs in terms:
+            cols, coefs = np.asarray(cols), np.asarray(coefs, dtype=float)
+            extra = max(cols.ndim, coefs.ndim) - len(shape)
+            r, c, a = (x.ravel() for x in np.broadcast_arrays(rows.reshape(shape + (1,) * extra), cols, coefs))
+            used = (r >= 0) & (a != 0)
+            if np.isnan(a[used]).any():
+                raise ValueError(f"{name}: missing parameter values")
+            self.entries.append((r[used], c[used], a[used]))
+        lower = np.broadcast_to(np.asarray(lower, dtype=float), shape).ravel()[keep]
+        upper = np.broadcast_to(np.asarray(upper, dtype=float), shape).ravel()[keep]
+        if np.isnan(lower).any() or np.isnan(upper).any():
+            raise ValueError(f"{name}: missing parameter values")
+        self.lower.append(lower)
+        self.upper.append(upper)
+        start = self.constraints[name].start if name in self.constraints else self.count
+        self.count += int(keep.sum())
+        self.constraints[name] = slice(start, self.count)
+
+def build(data):
+    data = data[None]
+    if _scalar(data, "RT_Formulation") == "sos1":
+        raise ValueError("The matrix backend has no SOS constraints; use RT_Formulation 'binary' or 'lp'")
+    S = index_sets(data)
+    N, ND, NP, NM, T = S["Nodes"], S["Nodes_DA"], S["Nodes_Physical"], S["Nodes_Market"], S["Time"]
+    E, B, I, O, M = S["EnergyCarrier"], S["FlexibleLoad"], S["Technology"], S["Mode_of_operation"], S["Month"]
+    TE, ET = S["TechnologyToEnergyCarrier"], S["EnergyCarrierToTechnology"]
+    FLEC, SLEC = S["FlexibleLoadForEnergyCarrier"], S["ShiftableLoadForEnergyCarrier"]
+    pos = lambda labels: {label: k for k, label in enumerate(labels)}
+    pN, pT, pE, pB, pI, pO, pM = pos(N), pos(T), pos(E), pos(B), pos(I), pos(O), pos(M)
+    nP, nT = len(NP), len(T)
+
+    # Columns, in the order main.py declares the variables
+    variables, offset = {}, 0
+    for name, (sets, _, _) in VARIABLES.items():
+        variables[name] = Block(offset, sets, [S[s] for s in sets])
+        offset += variables[name].size
+    v = variables
+    col_lower, col_upper, integrality = np.empty(offset), np.empty(offset), np.zeros(offset)
+    for name, (_, (lower, upper), integer) in VARIABLES.items():
+        block = slice(v[name].offset, v[name].offset + v[name].size)
+        col_lower[block], col_upper[block], integrality[block] = (_bound(data, x) for x in (lower, upper, integer))
+
+    # Parameters over all nodes; ph / da / nm / mk_* pick the physical (Nodes_Physical), day-ahead, market and market-owner rows
+    ph = np.array([pN[n] for n in NP], dtype=int)
+    da = np.array([pN[n] for n in ND], dtype=int)
+    mk_N = np.array([NM.index(S["Market_Node"][n]) for n in N], dtype=int)
+    mk_P = mk_N[ph]
+    nm = np.array([pN[x] for x in NM], dtype=int)
+    P = lambda name, *axes: _array(data, name, *axes)
+    # Strategic periods: investments of every period up to a node's own are installed there (new_technology and
+    # new_storage in main.py), and its operating cost is weighted by Operating_Weight
+    SP = S["Strategic_Periods"]
+    pP = pos(SP)
+    node_period = np.array([pP[data.get("Node_Period", {}).get(x, SP[0] if SP else None)] for x in N], dtype=int)
+    installed = np.arange(len(SP)) <= node_period[:, None]
+    discount, years = P("Discount_Factor", SP), P("Period_Years", SP)
+    prob = P("Node_Probability", N) * (discount[node_period] * years[node_period])
+    demand = P("Demand", N, T, E)
+    af_up, af_dwn = P("Activation_Factor_UP_Regulation", N, T), P("Activation_Factor_DWN_Regulation", N, T)
+    af_id_up, af_id_dwn = P("Activation_Factor_ID_Up", N, T), P("Activation_Factor_ID_Dwn", N, T)
+    charge_eff, discharge_eff = P("Charge_Efficiency", B), P("Discharge_Efficiency", B)
+    storage, initial_soc, self_discharge = P("Max_Storage_Capacity", B), P("Initial_SOC", B), P("Self_Discharge", B)
+    rate, e2p = P("Max_charge_discharge_rate", B), P("Energy2Power_Ratio", B)
+    capacity, ramping = P("Initial_Installed_Capacity", I), P("Ramping_Factor", I)
+    up_shift = _scalar(data, "Up_Shift_Max")
+    carry = bool(_scalar(data, "Carry_Initial_State"))
+    soc_level = P("Initial_SoC_Level", N, B)
+    weight = P("Time_Weight", T)
+
+    # Hours that start / end a period (starts_period and ends_period in main.py)
+    period_start = np.zeros(nT, dtype=bool)
+    period_start[[pT[x] for x in S["Period_Start"]] + [0] * bool(nT)] = True
+    period_end = np.append(period_start[1:], True) if nT else period_start
+
+    te_i = np.array([pI[i] for (i, e, o) in TE], dtype=int)
+    te_o = np.array([pO[o] for (i, e, o) in TE], dtype=int)
+    et_i = np.array([pI[i] for (i, e, o) in ET], dtype=int)
+    et_o = np.array([pO[o] for (i, e, o) in ET], dtype=int)
+    n, t = np.ogrid[:nP, :nT]
+
+    # Term of the capacity added up to the period of `node` (rows of N): a trailing axis over the periods
+    kp = np.arange(len(SP))
+    def new_capacity(name, node, k, coefs):
+        node, k, coefs = (x[..., None] for x in np.broadcast_arrays(node, k, np.asarray(coefs, dtype=float)))
+        return v[name](kp, k), coefs * installed[node, kp]
+
+    # Storage level entering hour t (soc_before in main.py) as (terms, constant) for flexible loads b
+    def soc_before(n, t, b):
+        start = period_start[t]
+        carried = (t == 0) & carry
+        terms = [(v["q_SoC"](n, np.maximum(t - 1, 0), b), ~start),
+                 new_capacity("v_new_bat", ph[n], b, (start & ~carried) * initial_soc[b])]
+        constant = np.where(carried, soc_level[ph[n], b], start * initial_soc[b] * storage[b])
+        return terms, constant
+
+    rows = _Rows()
+    # Terms times a factor over the rows (the factor is not broadcast into a term's trailing period axis)
+    def scaled(terms, factor):
+        factor = np.asarray(factor)
+        return [(cols, coefs * factor.reshape(factor.shape + (1,) * max(0, np.ndim(coefs) - factor.ndim))) for cols, coefs in terms]
+
+    # aFRR totals
+    if ELECTRICITY in pE:
+        nn, tt = np.ogrid[:len(N), :nT]
+        bb = np.array([pB[b] for (b, e) in FLEC if e == ELECTRICITY], dtype=int)
+        for name, total, reserve in (("aFRRUpTotal", "x_UP_Tot", "x_UP"), ("aFRRDwnTotal", "x_DWN_Tot", "x_DWN")):
+            rows.add(name, (len(N), nT), [(v[total](nn, tt), 1), (v[reserve](mk_N[nn][..., None], tt[..., None], bb), -1)], 0, 0)
+
+    # Energy balance
+    for e in E:
+        k = pE[e]
+        terms = [(v["y_out"](n, t, j), 1) for j, (_, e2, _) in enumerate(TE) if e2 == e]
+        terms += [(v["y_in"](n, t, j), -1) for j, (_, e2, _) in enumerate(ET) if e2 == e]
+        terms.append((v["z_export"](n, t, k), -1))
+        for b in [pB[b] for (b, e2) in FLEC if e2 == e]:
+            terms += [(v["q_charge"](n, t, b), -charge_eff[b]), (v["q_discharge"](n, t, b), 1)]
+            if e == ELECTRICITY:
+                terms += [(v["x_UP"](mk_P[n], t, b), -af_up[ph[n], t]), (v["x_DWN"](mk_P[n], t, b), af_dwn[ph[n], t])]
+        rows.add("EnergyBalance", (nP, nT), terms, demand[ph[n], t, k], demand[ph[n], t, k])
+
+    # Market balance
+    for j, (i, e, o) in enumerate(TE):
+        if (i, e) == ("Power_Grid", ELECTRICITY):
+            rows.add("MarketBalance", (nP, nT), [
+                (v["y_out"](n, t, j), 1), (v["x_DA"](mk_P[n], t), -1),
+                (v["x_ID_Up"](mk_P[n], t), -af_id_up[ph[n], t]), (v["x_ID_Dwn"](mk_P[n], t), af_id_dwn[ph[n], t]),
+                (v["x_RT_Up"](n, t), -1), (v["x_RT_Dwn"](n, t), 1)], 0, 0)
+
+    m, tm = np.ogrid[:len(NM), :nT]
+    id_max, rt_max = _scalar(data, "Max_ID_Volume"), _bound(data, ("Max_RT_Volume", "Max_Cable_Capacity"))
+    rows.add("MaxIDAdjustment", (len(NM), nT), [(v["x_ID_Up"](m, tm), 1), (v["x_ID_Dwn"](m, tm), 1)], upper=id_max)
+
+    # Real-time direction on Binary_RT_Pairs: big-Ms of rt_up_limit and rt_dwn_limit (the trade limit)
+    rt_up_limit = np.full((nP, nT), float(rt_max))
+    expansion_cost, max_capex = P("Cost_Expansion_Tec", I), P("Max_CAPEX_tech", I)
+    for (i, e, o) in S["GridImport"]:
+        k = pI[i]
+        if expansion_cost[k] <= 0:
+            continue
+        grid_capacity = capacity[k] + installed.sum(axis=1) * max_capex[k] / expansion_cost[k]
+        bound = P("Availability_Factor", N, T, I)[ph[n], t, k] * grid_capacity[ph[n]] + id_max * af_id_dwn[ph[n], t]
+        rt_up_limit = np.minimum(rt_up_limit, bound)
+    pair = np.full((nP, nT), -1)
+    for k, (x, y) in enumerate(S["Binary_RT_Pairs"]):
+        pair[NP.index(x), pT[y]] = k
+    keep = pair >= 0
+    if keep.any():
+        binary = v["binary_RT"](np.maximum(pair, 0))
+        rows.add("BinaryRTUp", (nP, nT), [(v["x_RT_Up"](n, t), 1), (binary, -rt_up_limit)], upper=0, keep=keep)
+        rows.add("BinaryRTDwn", (nP, nT), [(v["x_RT_Dwn"](n, t), 1), (binary, rt_max)], upper=rt_max, keep=keep)
+
+    # Conversion balance
+    n3, t3, j3 = np.ogrid[:nP, :nT, :len(TE)]
+    te_eff = np.array([data["Technology_To_EnergyCarrier_Efficiency"][key] for key in TE], dtype=float)
+    rows.add("ConversionBalanceOut", (nP, nT, len(TE)), [(v["y_out"](n3, t3, j3), 1), (v["y_activity"](n3, t3, te_i[j3], te_o[j3]), -te_eff[j3])], 0, 0)
+    n3e, t3e, j3e = np.ogrid[:nP, :nT, :len(ET)]
+    et_eff = np.array([data["EnergyCarrier_To_Technlogy_Efficiency"][key] for key in ET], dtype=float)
+    rows.add("ConversionBalanceIn", (nP, nT, len(ET)), [(v["y_in"](n3e, t3e, j3e), 1), (v["y_activity"](n3e, t3e, et_i[j3e], et_o[j3e]), -et_eff[j3e])], 0, 0)
+
+    # Ramping, from Initial_Output in the first hour of every period
+    initial_output = P("Initial_Output", N, TE)
+    rows.add("RampingTechnology", (nP, nT, len(TE)), [
+        (v["y_out"](n3, t3, j3), 1), (v["y_out"](n3, np.maximum(t3 - 1, 0), j3), -1.0 * ~period_start[t3]),
+        new_capacity("v_new_tech", ph[n3], te_i[j3], -ramping[te_i[j3]])],
+        upper=ramping[te_i[j3]] * capacity[te_i[j3]] + period_start[t3] * initial_output[ph[n3], j3])
+
+    # Heat pump limitation
+    excess_heat = _scalar(data, "Available_Excess_Heat")
+    for name, e in (("HeatPumpInputLimitationLT", "LT"), ("HeatPumpInputLimitationMT", "MT")):
+        out = TE.index((f"HeatPump_{e}", e, 1))
+        inp = ET.index((f"HeatPump_{e}", ELECTRICITY, 1))
+        rows.add(name, (nP, nT), [(v["y_out"](n, t, out), 1), (v["y_in"](n, t, inp), -1)], upper=excess_heat * demand[ph[n], t, pE[e]])
+
+    # Load shifting
+    for i, window in S["LoadShiftTimes"].items():
+        if not window:
+            continue
+        nw = np.arange(nP).reshape(-1, 1)
+        tw = np.array([pT[x] for x in window]).reshape(1, -1)
+        for (b, e) in SLEC:
+            k = pB[b]
+            rows.add("LoadShiftingWindow", (nP,), [(v["q_charge"](nw, tw, k), 1), (v["q_discharge"](nw, tw, k), -1 / discharge_eff[k])], 0, 0)
+    outside = np.array([pT[x] for x in S["TimeOutsideLoadShift"]], dtype=int)
+    s_b = np.array([pB[b] for (b, e) in SLEC], dtype=int)
+    s_e = np.array([pE[e] for (b, e) in SLEC], dtype=int)
+    no, to, so = np.ogrid[:nP, :len(outside), :len(SLEC)]
+    rows.add("NoDischargeOutsideLoadShift", (nP, len(outside), len(SLEC)), [(v["q_discharge"](no, outside[to], s_b[so]), 1)], 0, 0)
+    rows.add("NochargeOutsideLoadShift", (nP, len(outside), len(SLEC)), [(v["q_charge"](no, outside[to], s_b[so]), 1)], 0, 0)
+
+    pairs = S["TimeLoadShift"]
+    tl = np.array([pT[x] for (_, x) in pairs], dtype=int)
+    nl, pl, sl = np.ogrid[:nP, :len(pairs), :len(SLEC)]
+    rows.add("MaxTotalUpDwnLoadShift", (nP, len(pairs), len(SLEC)), [
+        (v["q_charge"](nl, tl[pl], s_b[sl]), 1), (v["q_discharge"](nl, tl[pl], s_b[sl]), 1 / discharge_eff[s_b[sl]])],
+        upper=up_shift * demand[ph[nl], tl[pl], s_e[sl]])
+
+    s_elec = s_b[s_e == pE.get(ELECTRICITY, -1)]
+    na, ta, sa = np.ogrid[:len(N), :nT, :len(s_elec)]
+    rows.add("aFRRUpDwnDemandLimitLoadShift", (len(N), nT, len(s_elec)), [
+        (v["x_DWN"](mk_N[na], ta, s_elec[sa]), 1), (v["x_UP"](mk_N[na], ta, s_elec[sa]), 1 / discharge_eff[s_elec[sa]])],
+        upper=up_shift * demand[na, ta, pE.get(ELECTRICITY, 0)])
+    mo, to, so = np.ogrid[:len(NM), :len(outside), :len(SLEC)]
+    rows.add("NoaFRRUpOutsideLoadShift", (len(NM), len(outside), len(SLEC)), [(v["x_UP"](mo, outside[to], s_b[so]), 1)], 0, 0)
+    rows.add("NoaFRRDwnOutsideLoadShift", (len(NM), len(outside), len(SLEC)), [(v["x_DWN"](mo, outside[to], s_b[so]), 1)], 0, 0)
+
+    # aFRR limits over the rest of a load-shifting window
+    window_of = S["LoadShiftTimes"]
+    remaining = np.array([len(window_of[i]) - window_of[i].index(x) for (i, x) in pairs], dtype=float)
+    last = np.array([pT[window_of[i][-1]] for (i, _) in pairs], dtype=int)
+    se = np.array([pB[b] for (b, e) in S["ShiftableElectricityLoad"]], dtype=int)
+    nu, pu, su = np.ogrid[:nP, :len(pairs), :len(se)]
+    b_u, t_u = se[su], tl[pu]
+    soc_terms, soc_constant = soc_before(nu, t_u, b_u)
+    headroom = remaining[pu] * up_shift * demand[ph[nu], t_u, pE.get(ELECTRICITY, 0)]
+    rows.add("aFRRUpLimitLoadShift", (nP, len(pairs), len(se)), [
+        (v["x_UP"](mk_P[nu], t_u, b_u), 1 / discharge_eff[b_u]), (v["q_SoC"](nu, last[pu], b_u), 1)] + scaled(soc_terms, -1),
+        upper=headroom + soc_constant)
+    rows.add("aFRRDownLimitLoadShift", (nP, len(pairs), len(se)), [
+        (v["x_DWN"](mk_P[nu], t_u, b_u), 1), (v["q_SoC"](nu, last[pu], b_u), -1)] + soc_terms,
+        upper=headroom - soc_constant)
+
+    # aFRR participation and storage capacity of the other electricity storages
+    f_b = np.array([pB[b] for (b, e) in FLEC], dtype=int)
+    f_elec = np.array([e == ELECTRICITY for (b, e) in FLEC])
+    f_storage = np.array([(b, e) not in SLEC for (b, e) in FLEC])
+    nf, tf, ff = np.ogrid[:nP, :nT, :len(FLEC)]
+    mf, tmf, fmf = np.ogrid[:len(NM), :nT, :len(FLEC)]
+    b_m = f_b[fmf]
+    rows.add("aFRRLimit", (len(NM), nT, len(FLEC)), [
+        (v["x_DWN"](mf, tmf, b_m), 1), (v["x_UP"](mf, tmf, b_m), 1 / discharge_eff[b_m]), new_capacity("v_new_bat", nm[mf], b_m, -e2p[b_m])],
+        upper=rate[b_m], keep=f_elec[fmf] & f_storage[fmf])
+    b_f = f_b[ff]
+    soc_terms, soc_constant = soc_before(nf, tf, b_f)
+    rows.add("EnsureStorageCapacityUpRegulation", (nP, nT, len(FLEC)), [(v["x_UP"](mk_P[nf], tf, b_f), -1)] + soc_terms,
+             lower=-soc_constant, keep=f_elec[ff] & f_storage[ff])
+    rows.add("EnsureStorageCapacityDownRegulation", (nP, nT, len(FLEC)), [
+        (v["x_DWN"](mk_P[nf], tf, b_f), 1), new_capacity("v_new_bat", ph[nf], b_f, -1)] + soc_terms,
+        upper=storage[b_f] - soc_constant, keep=f_elec[ff] & f_storage[ff])
+
+    # Reserve market activation
+    rows.add("UpRegulationActivation", (nP, nT, len(FLEC)), [
+        (v["x_UP"](mk_P[nf], tf, b_f), af_up[ph[nf], tf]), (v["q_discharge"](nf, tf, b_f), -1)], upper=0, keep=f_elec[ff])
+    rows.add("DownRegulationActivation", (nP, nT, len(FLEC)), [
+        (v["x_DWN"](mk_P[nf], tf, b_f), af_dwn[ph[nf], tf]), (v["q_charge"](nf, tf, b_f), -charge_eff[b_f])], upper=0, keep=f_elec[ff])
+
+    # Storage dynamics
+    rows.add("FlexibleAssetChargeDischargeLimit", (nP, nT, len(FLEC)), [
+        (v["q_charge"](nf, tf, b_f), 1), (v["q_discharge"](nf, tf, b_f), 1 / discharge_eff[b_f]), new_capacity("v_new_bat", ph[nf], b_f, -e2p[b_f])],
+        upper=rate[b_f], keep=f_storage[ff])
+    retention = 1 - self_discharge[b_f]
+    rows.add("StateOfCharge", (nP, nT, len(FLEC)), [
+        (v["q_SoC"](nf, tf, b_f), 1), (v["q_charge"](nf, tf, b_f), -1), (v["q_discharge"](nf, tf, b_f), 1 / discharge_eff[b_f])]
+        + scaled(soc_terms, -retention), retention * soc_constant, retention * soc_constant)
+    if _scalar(data, "Enforce_End_SoC"):
+        ends = np.flatnonzero(period_end)
+        ne, te, fe = np.ogrid[:nP, :len(ends), :len(FLEC)]
+        rows.add("EndOfHorizonSoC", (nP, len(ends), len(FLEC)), [(v["q_SoC"](ne, ends[te], f_b[fe]), 1), new_capacity("v_new_bat", ph[ne], f_b[fe], -initial_soc[f_b[fe]])],
+                 initial_soc[f_b[fe]] * storage[f_b[fe]], initial_soc[f_b[fe]] * storage[f_b[fe]])
+    rows.add("FlexibleAssetEnergyLimits", (nP, nT, len(FLEC)), [(v["q_SoC"](nf, tf, b_f), 1), new_capacity("v_new_bat", ph[nf], b_f, -1)], upper=storage[b_f])
+
+    # Availability: every output of technology i, once per (i, e, o) as in main.py
+    availability = P("Availability_Factor", N, T, I)
+    group = [[j2 for j2, key in enumerate(TE) if key[0] == i] for (i, e, o) in TE]
+    width = max((len(g) for g in group), default=0)
+    members = np.array([g + [g[0]] * (width - len(g)) for g in group], dtype=int).reshape(len(TE), width)
+    present = np.array([[1.0] * len(g) + [0.0] * (width - len(g)) for g in group]).reshape(len(TE), width)
+    factor = availability[ph[n3], t3, te_i[j3]]
+    rows.add("SupplyLimitation", (nP, nT, len(TE)), [
+        (v["y_out"](n3[..., None], t3[..., None], members[j3]), present[j3]), new_capacity("v_new_tech", ph[n3], te_i[j3], -factor)],
+        upper=factor * capacity[te_i[j3]])
+
+    # Export limitation and peak load
+    if ELECTRICITY in pE:
+        rows.add("ExportLimitation", (nP, nT), [(v["z_export"](n, t, pE[ELECTRICITY]), 1)], upper=_scalar(data, "Max_Export"))
+    months = S["TimeInMonth"]
+    grid = np.array([TE.index(key) for key in S["GridImport"]], dtype=int)
+    m_m = np.array([pM[x] for (x, _) in months], dtype=int)
+    m_t = np.array([pT[x] for (_, x) in months], dtype=int)
+    npk, mpk, gpk = np.ogrid[:nP, :len(months), :len(grid)]
+    rows.add("PeakLoad", (nP, len(months), len(grid)), [(v["y_out"](npk, m_t[mpk], grid[gpk]), 1), (v["y_max"](npk, m_m[mpk]), -1)], upper=0)
+    carried = P("Carried_Peak", N, M)
+    nc, mc = np.ogrid[:nP, :len(M)]
+    rows.add("PeakCarryOver", (nP, len(M)), [(v["y_max"](nc, mc), 1)], lower=carried[ph[nc], mc], keep=carried[ph[nc], mc] > 0)
+
+    # Investment limits
+    pi, ki = np.ogrid[:len(SP), :len(I)]
+    pb, kb = np.ogrid[:len(SP), :len(B)]
+    rows.add("CAPEXTechnologyLim", (len(SP), len(I)), [(v["v_new_tech"](pi, ki), P("Cost_Expansion_Tec", I)[ki])], upper=P("Max_CAPEX_tech", I)[ki])
+    rows.add("CAPEXFlexibleLoadLim", (len(SP), len(B)), [(v["v_new_bat"](pb, kb), P("Cost_Expansion_Bat", B)[kb])], upper=P("Max_CAPEX_flex", B)[kb])
+
+    # Carbon emission limit: y_activity counted once per carrier it supplies (activity_multiplicity)
+    intensity = P("Carbon_Intensity", I, O)
+    count = np.zeros((len(I), len(O)))
+    np.add.at(count, (te_i, te_o), 1)
+    io_i, io_o = np.nonzero(count)
+    nk = np.arange(nP).reshape(-1, 1, 1)
+    tk = np.arange(nT).reshape(1, -1, 1)
+    rows.add("CarbonEmissionLimit", (nP,), [(v["y_activity"](nk, tk, io_i, io_o), count[io_i, io_o] * intensity[io_i, io_o] * weight[tk])],
+             upper=_scalar(data, "Max_Carbon_Emission"))
+
+    # Non-anticipativity
+    na_pairs = S["Parent_Node_NA"]
+    child = np.array([NM.index(c) for (c, p) in na_pairs], dtype=int)
+    parent = np.array([NM.index(p) for (c, p) in na_pairs], dtype=int)
+    kn, tn = np.ogrid[:len(na_pairs), :nT]
+    for name, var in (("DayAheadToIntraday", "x_DA"), ("IntradayToRealTimeUp", "x_ID_Up"), ("IntradayToRealTimeDown", "x_ID_Dwn")):
+        rows.add(name, (len(na_pairs), nT), [(v[var](child[kn], tn), 1), (v[var](parent[kn], tn), -1)], 0, 0)
+    kn3, tn3, fn3 = np.ogrid[:len(na_pairs), :nT, :len(FLEC)]
+    for name, var in (("ReserveCapacityDwn", "x_DWN"), ("DayAheadToIntradayUp", "x_UP")):
+        rows.add(name, (len(na_pairs), nT, len(FLEC)), [(v[var](child[kn3], tn3, f_b[fn3]), 1), (v[var](parent[kn3], tn3, f_b[fn3]), -1)], 0, 0,
+                 keep=f_elec[fn3])
+
+    # Objective: investment, then the operational terms of main._operational_terms and the grid tariff
+    c = np.zeros(offset)
+    def cost(cols, coefs):
+        cols, coefs = np.broadcast_arrays(cols, np.asarray(coefs, dtype=float))
+        if np.isnan(coefs).any():
+            raise ValueError("Objective: missing parameter values")
+        np.add.at(c, cols.ravel(), coefs.ravel())
+    cost(v["v_new_tech"](pi, ki), discount[pi] * P("Cost_Expansion_Tec", I)[ki])
+    cost(v["v_new_bat"](pb, kb), discount[pb] * P("Cost_Expansion_Bat", B)[kb])
+    nd, td = np.ogrid[:len(ND), :nT]
+    p_da = prob[da[nd]] * weight[td]
+    cost(v["x_UP_Tot"](da[nd], td), -p_da * P("aFRR_Up_Capacity_Price", N, T)[da[nd], td])
+    cost(v["x_DWN_Tot"](da[nd], td), -p_da * P("aFRR_Dwn_Capacity_Price", N, T)[da[nd], td])
+    # Operation is only costed on the real-time nodes: rows `op` of the physical ones
+    op = np.flatnonzero(np.isin(ph, [pN[x] for x in S["Nodes_RT"]]))
+    n, t = np.ix_(op, np.arange(nT))
+    p = prob[ph[n]] * weight[t]
+    cost(v["x_UP_Tot"](ph[n], t), -p * af_up[ph[n], t] * P("aFRR_Up_Activation_Price", N, T)[ph[n], t])
+    cost(v["x_DWN_Tot"](ph[n], t), p * af_dwn[ph[n], t] * P("aFRR_Dwn_Activation_Price", N, T)[ph[n], t])
+    cost(v["x_DA"](mk_P[n], t), p * P("Spot_Price", N, T)[ph[n], t])
+    intraday = P("Intraday_Price", N, T)[ph[n], t]
+    cost(v["x_ID_Up"](mk_P[n], t), p * intraday * af_id_up[ph[n], t])
+    cost(v["x_ID_Dwn"](mk_P[n], t), -p * intraday * af_id_dwn[ph[n], t])
+    energy = P("Cost_Energy", N, T, I)
+    emission = _scalar(data, "Cost_Emission")
+    cost(v["y_activity"](n[..., None], t[..., None], io_i, io_o),
+         p[..., None] * count[io_i, io_o] * (energy[ph[n][..., None], t[..., None], io_i] + intensity[io_i, io_o] * emission))
+    ne3, te3, ee3 = np.ix_(op, np.arange(nT), np.arange(len(E)))
+    cost(v["z_export"](ne3, te3, ee3), -prob[ph[ne3]] * weight[te3] * P("Cost_Export", N, T, E)[ph[ne3], te3, ee3])
+    imbalance = _scalar(data, "Cost_Imbal")
+    cost(v["x_RT_Up"](n, t), p * (P("RK_Up_Price", N, T)[ph[n], t] + imbalance))
+    cost(v["x_RT_Dwn"](n, t), p * (imbalance - P("RK_Dwn_Price", N, T)[ph[n], t]))
+    nb, tb, bb = np.ix_(op, np.arange(nT), np.arange(len(B)))
+    cost(v["q_discharge"](nb, tb, bb), prob[ph[nb]] * weight[tb] * P("Cost_Battery", B)[bb])
+    grid_cost = _scalar(data, "Cost_Grid")
+    ng, mg = np.ix_(op, np.arange(len(months)))
+    cost(v["y_max"](ng, m_m[mg]), prob[ph[ng]] * P("Month_Weight", M, T)[m_m[mg], m_t[mg]] * grid_cost)
+
+    r, cols, a = (np.concatenate(x) for x in zip(*rows.entries))
+    A = sp.csr_array((a, (r, cols)), shape=(rows.count, offset))
+    A.sum_duplicates()
+    A.eliminate_zeros()
+    return MatrixModel(A, np.concatenate(rows.lower), np.concatenate(rows.upper), c, 0.0,
+                       col_lower, col_upper, integrality, variables, rows.constraints)
+
+
+##############################################################
+###################### SOLVE AND OUTPUT ######################
+##############################################################
+
+# Solve with the HiGHS solver bundled with SciPy; options are passed to scipy.optimize.milp (e.g. time_limit,
+# mip_rel_gap). Returns the objective value and the solution vector.
+def solve(mm, options=None):
+    result = milp(mm.c, integrality=mm.integrality, bounds=Bounds(mm.col_lower, mm.col_upper),
+                  constraints=LinearConstraint(mm.A, mm.row_lower, mm.row_upper), options=options)
+    if result.status != 0:
+        raise RuntimeError(f"Matrix model not solved to optimality ({result.message})")
+    return result.fun + mm.offset, result.x
+
+# Free-format MPS with columns C<k> and rows R<k> in MatrixModel order
+def write_mps(mm, filename):
+    A = mm.A.tocsc()
+    equal = mm.row_lower == mm.row_upper
+    has_lower, has_upper = np.isfinite(mm.row_lower), np.isfinite(mm.row_upper)
+    kind = np.where(equal, "E", np.where(has_lower & ~has_upper, "G", np.where(has_upper & ~has_lower, "L", np.where(has_upper, "L", "N"))))
+    rhs = np.where(kind == "G", mm.row_lower, np.where(kind == "N", 0.0, mm.row_upper))
+    with open(filename, "w") as f:
+        f.write("NAME MATRIX_BACKEND\nROWS\n N  COST\n")
+        f.writelines(f" {k}  R{i}\n" for i, k in enumerate(kind))
+        f.write("COLUMNS\n")
+        integer = False
+        for j in range(A.shape[1]):
+            if bool(mm.integrality[j]) != integer:
+                integer = not integer
+                f.write(f"    MARKER  'MARKER'  '{'INTORG' if integer else 'INTEND'}'\n")
+            # The cost entry is written even when zero, so columns without coefficients are declared too
+            f.write(f"    C{j}  COST  {float(mm.c[j])!r}\n")
+            for i, a in zip(A.indices[A.indptr[j]:A.indptr[j + 1]], A.data[A.indptr[j]:A.indptr[j + 1]].tolist()):
+                f.write(f"    C{j}  R{i}  {a!r}\n")
+        if integer:
+            f.write("    MARKER  'MARKER'  'INTEND'\n")
+        f.write("RHS\n")
+        if mm.offset:
+            f.write(f"    RHS  COST  {-float(mm.offset)!r}\n")
+        f.writelines(f"    RHS  R{i}  {b!r}\n" for i, b in enumerate(rhs.tolist()) if b)
+        ranged = np.flatnonzero(has_lower & has_upper & ~equal)
+        if len(ranged):
+            f.write("RANGES\n")
+            f.writelines(f"    RNG  R{i}  {float(mm.row_upper[i] - mm.row_lower[i])!r}\n" for i in ranged)
+        f.write("BOUNDS\n")
+        for j, (lower, upper) in enumerate(zip(mm.col_lower.tolist(), mm.col_upper.tolist())):
+            if lower == upper:
+                f.write(f" FX BND  C{j}  {lower!r}\n")
+                continue
+            if lower != 0:
+                f.write(f" MI BND  C{j}\n" if lower == -np.inf else f" LO BND  C{j}  {lower!r}\n")
+            if upper != np.inf:
+                f.write(f" UP BND  C{j}  {upper!r}\n")
+        f.write("ENDATA\n")
+
+# Index column names as main._index_columns gives them for the Pyomo variable
+def _index_columns(block):
+    columns = []
+    for name, labels in zip(block.sets, block.labels):
+        dimen = len(labels[0]) if labels and isinstance(labels[0], tuple) else 1
+        names = [name] if dimen == 1 else [f"{name}_{k+1}" for k in range(dimen)]
+        columns += [c if c not in columns else f"{c}_{len(columns)+1}" for c in names]
+    return columns
+
+# The tables of main.results_to_tables, from a solution vector
+def results_to_tables(mm, x, drop_zeros=True):
+    tables = {}
+    for name, block in mm.variables.items():
+        values = x[block.offset:block.offset + block.size]
+        keep = ~np.isnan(values)
+        if drop_zeros:
+            keep &= values != 0
+        index = np.unravel_index(np.flatnonzero(keep), block.shape)
+        columns = []
+        for labels, k in zip(block.labels, index):
+            picked = [labels[j] for j in k]
+            if labels and isinstance(labels[0], tuple):
+                columns += [list(c) for c in zip(*picked)] if picked else [[] for _ in labels[0]]
+            else:
+                columns.append(picked)
+        table = pd.DataFrame.from_records(list(zip(*columns)), columns=_index_columns(block), nrows=len(values[keep]))
+        table["value"] = values[keep]
+        tables[name] = table
+    return tables
+
+def save_results_to_parquet(mm, x, folder="Variable_Results", drop_zeros=True):
+    os.makedirs(folder, exist_ok=True)
+    for name, table in results_to_tables(mm, x, drop_zeros).items():
+        table.to_parquet(os.path.join(folder, f"{name}.parquet"), index=False)
+    print(f"Variable results saved to {folder}/")
+
+# Solve the sample through Pyomo (create_instance + solver) and through the matrix backend and compare.
+# options go to both solvers (HiGHS option names, e.g. mip_rel_gap, time_limit); the MIP gap defaults to 0,
+# since two optima within HiGHS's default gap of 1e-4 need not agree to rtol
+def check(data, solver="appsi_highs", options=None, rtol=1e-6, log=print):
+    options = {"mip_rel_gap": 0, **(options or {})}
+    start = time.perf_counter()
+    instance = main.model.create_instance(data)
+    pyomo_build = time.perf_counter() - start
+    decomposition.solve(instance, solver, options)
+    pyomo_objective = main.pyo.value(instance.Objective)
+
+    start = time.perf_counter()
+    mm = build(data)
+    matrix_build = time.perf_counter() - start
+    matrix_objective, _ = solve(mm, options)
+
+    log(f"Pyomo:  {instance.nvariables()} variables, {instance.nconstraints()} constraints, built in {pyomo_build:.2f} s, objective {pyomo_objective}")
+    log(f"Matrix: {mm.A.shape[1]} variables, {mm.A.shape[0]} constraints, {mm.A.nnz} nonzeros, built in {matrix_build:.2f} s, objective {matrix_objective}")
+    return bool(np.isclose(pyomo_objective, matrix_objective, rtol=rtol, atol=0))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the model as a sparse matrix and solve it or write it as MPS")
+    parser.add_argument("--check", action="store_true", help="compare the objective with the Pyomo model")
+    parser.add_argument("--solver", default="appsi_highs", help="solver of the Pyomo model in --check")
+    parser.add_argument("--mps", default=None, help="write the model to this MPS file instead of solving it")
+    parser.add_argument("--out", default="Variable_Results", help="folder of the result tables")
+    args = parser.parse_args()
+
+    data = main.load_data(main.read_all_sheets(main.INPUT_EXCEL))
+    if args.check:
+        agree = check(data, args.solver)
+        print("Objectives agree" if agree else "Objectives DIFFER")
+        sys.exit(0 if agree else 1)
+    mm = build(data)
+    if args.mps:
+        write_mps(mm, args.mps)
+        print(f"Model written to {args.mps}")
+    else:
+        objective, x = solve(mm)
+        print(f"Objective: {objective}")
+        save_results_to_parquet(mm, x, args.out)
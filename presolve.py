@@ -0,0 +1,254 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import pyomo.environ as pyo
+import scipy.sparse as sp
+from pyomo.common.collections import ComponentSet
+from pyomo.repn.plugins.standard_form import LinearStandardFormCompiler
+
+import main
+
+"""
+PRESOLVE
+"""
+#Shrinks a built instance before it is handed to the solver. The active constraints are compiled to their sparse
+#standard form once, and the rules below are applied to the whole matrix at a time until nothing changes:
+#  fixed      - variables whose bounds meet (z_export, v_new_tech/v_new_bat at (0, 0)) are fixed
+#  empty      - rows left without free variables are checked and dropped
+#  singleton  - rows with one free variable become bounds on it and are dropped; equalities fix it
+#               (NoDischargeOutsideLoadShift, NoaFRRUpOutsideLoadShift, ...), which then empties or shortens
+#               ConversionBalanceOut/In, MarketBalance, ... in the next round
+#  forcing    - rows that can only hold with every variable at a bound fix them all there (e.g. a sum of
+#               non-negative variables equal to zero)
+#  redundant  - rows that hold for any values within the bounds are dropped (e.g. MaxIDAdjustment once its
+#               variables are fixed)
+#  dominated  - a variable whose cost never favours moving it off a finite bound, and which no row keeps there,
+#               is fixed at that bound (binary_RT where no real-time balancing is possible, unused x_ID_*)
+#The result is written back into the instance: variables are fixed or get tighter bounds and dropped constraints
+#are deactivated, so every writer and solver interface sees the smaller model and the result tables still list
+#every variable. Presolved.undo() restores the instance, e.g. before computing marginal values, and drops the
+#duals and reduced costs of the reduced model.
+#SOS constraints (RT_Formulation "sos1") are left to the solver: the rules only see the rows, and the dominated rule
+#does not move an SOS member off zero.
+#
+#   python presolve.py --out presolve_report.csv
+
+TOLERANCE = 1e-9
+
+class Presolved:
+    def __init__(self, instance, fixed, bounds, deactivated, table, rounds):
+        self.instance = instance
+        self.fixed = fixed
+        self.bounds = bounds
+        self.deactivated = deactivated
+        self.table = table
+        self.rounds = rounds
+
+    def undo(self):
+        for var in self.fixed:
+            var.unfix()
+        for var, (lb, ub) in self.bounds:
+            var.setlb(lb)
+            var.setub(ub)
+        for constraint in self.deactivated:
+            constraint.activate()
+        # Duals and reduced costs imported since presolve belong to the reduced model (rows and columns are missing)
+        for name in ("dual", "rc"):
+            suffix = getattr(self.instance, name, None)
+            if isinstance(suffix, pyo.Suffix):
+                suffix.clear()
+
+    def summary(self):
+        return (f"Presolve ({self.rounds} rounds): fixed {len(self.fixed)} variables, tightened {len(self.bounds) - len(self.fixed)}, "
+                f"dropped {len(self.deactivated)} constraints")
+
+# Rows (A x within [lower, upper]) and columns (bounds, cost) of the reduction: returns the rows kept, the new
+# column bounds, which columns are fixed, the number of rounds and the rule that removed each row / fixed each column
+def reduce(A, row_lower, row_upper, c, col_lower, col_upper, integer, max_rounds=100, tol=TOLERANCE, sos_member=None):
+    A = sp.csr_matrix(A)
+    A.eliminate_zeros()
+    m, n = A.shape
+    lb, ub = col_lower.astype(float).copy(), col_upper.astype(float).copy()
+    live = np.ones(m, dtype=bool)
+    row_rule = np.full(m, "", dtype=object)
+    col_rule = np.full(n, "", dtype=object)
+    entries = A.tocoo()
+    rows, cols, coefs = entries.row, entries.col, entries.data
+    scale = lambda x: tol * (1 + np.abs(np.where(np.isfinite(x), x, 0)))
+
+    def fix(mask, value, rule):
+        mask = mask & (col_rule == "")
+        lb[mask] = ub[mask] = value[mask]
+        col_rule[mask] = rule
+        return mask.any()
+
+    fix(ub - lb <= scale(lb), lb, "fixed")
+    rounds = 0
+    for rounds in range(1, max_rounds + 1):
+        changed = False
+        free = col_rule == ""
+        value = np.where(free, 0.0, lb)
+        entry = live[rows] & free[cols]
+        r, k, a = rows[entry], cols[entry], coefs[entry]
+
+        # Activity of every row: constant part from the fixed columns, and its range over the free ones
+        constant = A @ value
+        low_bound = np.where(a > 0, lb[k], ub[k])
+        high_bound = np.where(a > 0, ub[k], lb[k])
+        low_inf = np.bincount(r, ~np.isfinite(low_bound), m) > 0
+        high_inf = np.bincount(r, ~np.isfinite(high_bound), m) > 0
+        low = constant + np.bincount(r, np.where(np.isfinite(low_bound), a * low_bound, 0), m)
+        high = constant + np.bincount(r, np.where(np.isfinite(high_bound), a * high_bound, 0), m)
+        low[low_inf], high[high_inf] = -np.inf, np.inf
+        count = np.bincount(r, minlength=m)
+
+        if np.any(live & ((low > row_upper + scale(row_upper)) | (high < row_lower - scale(row_lower)))):
+            raise ValueError("Presolve: the model is infeasible")
+
+        # Empty and redundant rows
+        redundant = live & (low >= row_lower - scale(row_lower)) & (high <= row_upper + scale(row_upper))
+        row_rule[redundant] = np.where(count[redundant] == 0, "empty", "redundant")
+        live &= ~redundant
+        changed |= redundant.any()
+
+        # Forcing rows: every free variable at the bound giving the row's lowest (highest) activity
+        at_low = live & (count > 0) & np.isfinite(low) & (low >= row_upper - scale(row_upper))
+        at_high = live & (count > 0) & np.isfinite(high) & (high <= row_lower + scale(row_lower)) & ~at_low
+        target = np.full(n, np.nan)
+        target[k[at_low[r]]] = low_bound[at_low[r]]
+        target[k[at_high[r]]] = high_bound[at_high[r]]
+        changed |= fix(~np.isnan(target), target, "forcing")
+        row_rule[at_low | at_high] = "forcing"
+        live &= ~(at_low | at_high)
+
+        # Singleton rows become bounds
+        single = live[r] & (count[r] == 1) & (col_rule[k] == "")
+        sr, sk, sa = r[single], k[single], a[single]
+        lo = (row_lower[sr] - constant[sr]) / sa
+        up = (row_upper[sr] - constant[sr]) / sa
+        lo, up = np.where(sa > 0, lo, up), np.where(sa > 0, up, lo)
+        np.maximum.at(lb, sk, np.where(np.isnan(lo), -np.inf, lo))
+        np.minimum.at(ub, sk, np.where(np.isnan(up), np.inf, up))
+        lb[integer] = np.ceil(lb[integer] - tol)
+        ub[integer] = np.floor(ub[integer] + tol)
+        if np.any(lb > ub + scale(ub)):
+            raise ValueError("Presolve: the model is infeasible")
+        row_rule[sr] = "singleton"
+        live[sr] = False
+        changed |= len(sr) > 0
+        changed |= fix((col_rule == "") & (ub - lb <= scale(lb)), lb, "singleton")
+
+        # Dominated columns: no live row stops the variable from moving towards the bound its cost prefers
+        free = col_rule == ""
+        entry = live[rows] & free[cols]
+        r, k, a = rows[entry], cols[entry], coefs[entry]
+        down = np.bincount(k, np.where(a > 0, np.isfinite(row_lower[r]), np.isfinite(row_upper[r])), n) > 0
+        up = np.bincount(k, np.where(a > 0, np.isfinite(row_upper[r]), np.isfinite(row_lower[r])), n) > 0
+        to_lower = free & (c >= 0) & ~down & np.isfinite(lb)
+        to_upper = free & (c <= 0) & ~up & np.isfinite(ub) & ~to_lower
+        if sos_member is not None:
+            to_upper &= ~sos_member
+        changed |= fix(to_lower, lb, "dominated")
+        changed |= fix(to_upper, ub, "dominated")
+
+        if not changed:
+            break
+    return live, lb, ub, col_rule != "", rounds, row_rule, col_rule
+
+# Presolve the active constraints of a built instance in place; see Presolved.undo
+def presolve(instance, max_rounds=100, log=print):
+    start = time.perf_counter()
+    sos = list(instance.component_data_objects(pyo.SOSConstraint, active=True))
+    for constraint in sos:
+        constraint.deactivate()
+    try:
+        repn = LinearStandardFormCompiler().write(instance, mixed_form=True)
+    finally:
+        for constraint in sos:
+            constraint.activate()
+    A = repn.A.tocsr()
+    rhs = np.asarray(repn.rhs, dtype=float)
+    kind = np.array([entry.bound_type for entry in repn.rows], dtype=int)
+    row_lower = np.where(kind <= 0, rhs, -np.inf)
+    row_upper = np.where(kind >= 0, rhs, np.inf)
+    sense = 1 if repn.objectives[0].sense == pyo.minimize else -1
+    c = sense * repn.c.toarray()[0]
+    columns = repn.columns
+    col_lower = np.array([-np.inf if v.lb is None else v.lb for v in columns], dtype=float)
+    col_upper = np.array([np.inf if v.ub is None else v.ub for v in columns], dtype=float)
+    integer = np.array([v.is_integer() for v in columns], dtype=bool)
+    members = ComponentSet(v for constraint in sos for v in constraint.get_variables())
+    sos_member = np.array([v in members for v in columns], dtype=bool)
+
+    live, lb, ub, fixed, rounds, row_rule, col_rule = reduce(A, row_lower, row_upper, c, col_lower, col_upper, integer, max_rounds,
+                                                             sos_member=sos_member)
+
+    # Back into the instance
+    fixed_vars, bounds = [], []
+    for j in np.flatnonzero(fixed | (lb > col_lower) | (ub < col_upper)):
+        var = columns[j]
+        bounds.append((var, (var.lb, var.ub)))
+        if fixed[j]:
+            var.fix(float(lb[j]))
+            fixed_vars.append(var)
+        else:
+            var.setlb(None if np.isneginf(lb[j]) else float(lb[j]))
+            var.setub(None if np.isposinf(ub[j]) else float(ub[j]))
+    constraints = {}
+    for entry, kept in zip(repn.rows, live):
+        constraints[entry.constraint] = constraints.get(entry.constraint, False) or kept
+    deactivated = [constraint for constraint, kept in constraints.items() if not kept]
+    for constraint in deactivated:
+        constraint.deactivate()
+
+    # Report per component
+    records = {}
+    def count(component, kind, rule):
+        row = records.get(component)
+        if row is None:
+            row = records[component] = {"component": component.name, "type": kind, "entries": 0}
+        row["entries"] += 1
+        if rule:
+            row[rule] = row.get(rule, 0) + 1
+    for var, rule in zip(columns, col_rule):
+        count(var.parent_component(), "Var", rule)
+    rule_of = {}
+    for entry, rule in zip(repn.rows, row_rule):
+        rule_of[entry.constraint] = rule_of.get(entry.constraint) or rule
+    for constraint, kept in constraints.items():
+        count(constraint.parent_component(), "Constraint", "" if kept else rule_of[constraint])
+    table = pd.DataFrame(list(records.values())).fillna(0)
+    rules = [rule for rule in ("fixed", "empty", "singleton", "forcing", "redundant", "dominated") if rule in table.columns]
+    table[rules] = table[rules].astype(int)
+    table["removed"] = table[rules].sum(axis=1)
+    table = table[["component", "type", "entries", *rules, "removed"]].sort_values("removed", ascending=False, ignore_index=True)
+
+    presolved = Presolved(instance, fixed_vars, bounds, deactivated, table, rounds)
+    if log:
+        log(f"{presolved.summary()} in {time.perf_counter() - start:.2f} s: "
+            f"{int(live.sum())} of {A.shape[0]} rows and {A.shape[1] - int(fixed.sum())} of {A.shape[1]} columns left")
+    return presolved
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Presolve the model and report what it removes")
+    parser.add_argument("--solver", default=None, help="also solve before and after presolve and compare the objectives")
+    parser.add_argument("--out", default=None, help="save the per-component report as CSV")
+    args = parser.parse_args()
+
+    data = main.load_data(main.read_all_sheets(main.INPUT_EXCEL))
+    instance = main.model.create_instance(data)
+    presolved = presolve(instance)
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(presolved.table[presolved.table["removed"] > 0].to_string(index=False))
+    if args.solver:
+        import decomposition
+        decomposition.solve(instance, args.solver)
+        reduced = pyo.value(instance.Objective)
+        presolved.undo()
+        decomposition.solve(instance, args.solver)
+        print(f"Objective with presolve {reduced:.6f}, without {pyo.value(instance.Objective):.6f}")
+    if args.out:
+        presolved.table.to_csv(args.out, index=False)
+        print(f"Report saved to {args.out}")
@@ -0,0 +1,86 @@
+import argparse
+import logging
+import time
+
+import pandas as pd
+import pyomo.environ as pyo
+from pyomo.core.expr.visitor import identify_variables
+
+import main
+
+"""
+CONSTRUCTION PROFILER
+"""
+#Builds the instance with Pyomo's construction timer switched on and reports, per component:
+#  seconds   - time spent constructing it (rules included)
+#  visited   - size of its index set, i.e. how often the rule was called
+#  created   - entries actually built; for constraints visited - created rows were Constraint.Skip
+#  skipped   - share of the rule calls that built nothing
+#  nonzeros  - variables appearing in the rows (constraints only)
+#The table is ranked by seconds, so the rules worth reformulating come first.
+#
+#   python profile_construction.py --top 25 --out construction_profile.csv
+
+# Collects the construction timer records Pyomo logs at INFO level: component name -> seconds
+class ConstructionTimes(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.seconds = {}
+
+    def emit(self, record):
+        timer = record.msg
+        if hasattr(timer, "obj"):
+            self.seconds[timer.name] = self.seconds.get(timer.name, 0.0) + timer.timer
+
+def timed_build(data):
+    handler = ConstructionTimes()
+    logger = logging.getLogger("pyomo.common.timing.construction")
+    level = logger.level
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    try:
+        start = time.perf_counter()
+        instance = main.model.create_instance(data)
+        total = time.perf_counter() - start
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(level)
+    return instance, total, handler.seconds
+
+def profile(data):
+    instance, total, seconds = timed_build(data)
+    rows = []
+    for component in instance.component_objects((pyo.Set, pyo.Param, pyo.Var, pyo.Expression, pyo.Constraint, pyo.Objective), descend_into=False):
+        visited = len(component.index_set()) if component.is_indexed() else 1
+        created = len(component)
+        row = {
+            "component": component.name,
+            "type": component.ctype.__name__,
+            "seconds": seconds.get(component.name, 0.0),
+            "visited": visited,
+            "created": created,
+            "skipped": 1 - created / visited if visited else 0.0,
+            "nonzeros": None,
+        }
+        if component.ctype is pyo.Constraint:
+            row["nonzeros"] = sum(sum(1 for _ in identify_variables(c.body, include_fixed=False)) for c in component.values())
+        rows.append(row)
+    table = pd.DataFrame(rows).sort_values("seconds", ascending=False, ignore_index=True)
+    table["nonzeros"] = table["nonzeros"].astype("Int64")
+    table["share"] = table["seconds"] / total
+    return table, total
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rank model components by construction time")
+    parser.add_argument("--top", type=int, default=25, help="rows to print")
+    parser.add_argument("--out", default=None, help="also save the full table as CSV")
+    args = parser.parse_args()
+
+    data = main.load_data(main.read_all_sheets(main.INPUT_EXCEL))
+    table, total = profile(data)
+    print(f"create_instance took {total:.2f} s")
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(table.head(args.top).to_string(index=False, formatters={"seconds": "{:.4f}".format, "skipped": "{:.1%}".format, "share": "{:.1%}".format}))
+    if args.out:
+        table.to_csv(args.out, index=False)
+        print(f"Profile saved to {args.out}")
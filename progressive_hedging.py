@@ -0,0 +1,216 @@
+import argparse
+
+import pyomo.environ as pyo
+from pyomo.util.vars_from_expressions import get_vars_from_components
+
+import decomposition
+import main
+
+"""
+PROGRESSIVE HEDGING
+"""
+#One subproblem per leaf scenario: the root-to-leaf path of Parent_Node (see decomposition.split_data for
+#the probability weighting). Inside a path the market positions are shared through Compact_NA; across
+#scenarios the positions of shared nodes and the investments are only tied through the PH terms
+#w*x + rho*prox(x - xbar). binary_RT makes every subproblem a MIP, so the proximal term is linear by default:
+#  tangent   - rho/2*(x - xbar)^2 approximated from below by tangent cuts (default): a grid at deviations
+#              +-tol*2^j up to the first iteration's deviation, and one at every iterate's deviation
+#  linear    - rho*|x - xbar|
+#  quadratic - the exact rho/2*(x - xbar)^2, for solvers that handle MIQPs
+#Each scenario is built once in its pinned worker and re-solved with updated w and xbar, so any local
+#solver works (appsi_highs, cbc, ...).
+#The result is the cost of an implementable policy. Before exact consensus the average xbar may be infeasible
+#for a scenario (a reserve bid above what that scenario can deliver, say); the scenarios that share decisions
+#then take the cheapest of their own solutions that is feasible for all of them instead (xhat).
+#
+#   python progressive_hedging.py --rho 10 --tol 1e-4 --max-iter 50 --workers 4 --solver appsi_highs
+
+NONANTICIPATIVE = ("x_DA", "x_ID_Up", "x_ID_Dwn", "x_UP", "x_DWN", "v_new_tech", "v_new_bat")
+
+def _setup(instances, leaf, data, shared_nodes, proximal):
+    instance = main.model.create_instance(data)
+
+    # Decisions made before the leaf is revealed: market positions on the shared nodes and the
+    # investments. Variables with equal bounds, or that appear in no constraint, are not decisions.
+    used = {id(v) for v in get_vars_from_components(instance, pyo.Constraint, active = True)}
+    keys = []
+    for name in NONANTICIPATIVE:
+        var = getattr(instance, name)
+        positions = main.key_positions(getattr(main.model, name), main.model.Nodes)
+        for index in var:
+            key = index if isinstance(index, tuple) else (index,)
+            if all(key[k] in shared_nodes for k in positions) and id(var[index]) in used and (var[index].lb is None or var[index].lb != var[index].ub):
+                keys.append((name, index))
+    x = [getattr(instance, name)[index] for name, index in keys]
+
+    instance.PH_Index = pyo.Set(initialize = range(len(keys)))
+    instance.PH_W = pyo.Param(instance.PH_Index, mutable = True, initialize = 0.0)
+    instance.PH_Xbar = pyo.Param(instance.PH_Index, mutable = True, initialize = 0.0)
+    instance.PH_Rho = pyo.Param(mutable = True, initialize = 0.0)
+    if proximal == "linear":
+        instance.PH_Dev = pyo.Var(instance.PH_Index, domain = pyo.NonNegativeReals)
+        instance.PH_DevAbove = pyo.Constraint(instance.PH_Index, rule = lambda m, k: m.PH_Dev[k] >= x[k] - m.PH_Xbar[k])
+        instance.PH_DevBelow = pyo.Constraint(instance.PH_Index, rule = lambda m, k: m.PH_Dev[k] >= m.PH_Xbar[k] - x[k])
+        penalty = sum(instance.PH_Dev[k] for k in instance.PH_Index)
+    elif proximal == "tangent":
+        # (x - xbar)^2/2 from below by its tangents (PH_Prox >= 0 is the one at d = 0); _solve adds the rest
+        instance.PH_Prox = pyo.Var(instance.PH_Index, domain = pyo.NonNegativeReals)
+        instance.PH_Tangents = pyo.ConstraintList()
+        penalty = sum(instance.PH_Prox[k] for k in instance.PH_Index)
+    elif proximal == "quadratic":
+        penalty = 0.5 * sum((x[k] - instance.PH_Xbar[k])**2 for k in instance.PH_Index)
+    else:
+        raise ValueError(f"Unknown proximal term '{proximal}'")
+    instance.PH_Objective = pyo.Objective(expr = instance.Objective.expr
+                                          + sum(instance.PH_W[k] * x[k] for k in instance.PH_Index)
+                                          + instance.PH_Rho * penalty, sense = pyo.minimize)
+    instance.Objective.deactivate()
+    instances[leaf] = (instance, x)
+    return keys
+
+# Tangent of (x - xbar)^2/2 at deviation d
+def _tangent(instance, k, v, d):
+    instance.PH_Tangents.add(instance.PH_Prox[k] >= d * (v - instance.PH_Xbar[k]) - d**2 / 2)
+
+def _solve(instances, leaf, w, xbar, rho, tol, solver, options):
+    instance, x = instances[leaf]
+    if rho and hasattr(instance, "PH_Tangents"):
+        first = not len(instance.PH_Tangents)
+        for k, v in enumerate(x):
+            d = pyo.value(v) - xbar[k]
+            # The grid, so small deviations are penalised too (tangents at 0 and +-d leave |x - xbar| <= d/2 free)
+            if first:
+                step = tol
+                while step <= max(abs(d), tol):
+                    _tangent(instance, k, v, step)
+                    _tangent(instance, k, v, -step)
+                    step *= 2
+            if d:
+                _tangent(instance, k, v, d)
+    for k in instance.PH_Index:
+        instance.PH_W[k] = w[k]
+        instance.PH_Xbar[k] = xbar[k]
+    instance.PH_Rho = rho
+    decomposition.solve(instance, solver, options)
+    return pyo.value(instance.Objective), [pyo.value(v) for v in x]
+
+# Scenario cost with the shared decisions fixed at policy; None if that is infeasible for the scenario
+def _evaluate(instances, leaf, policy, solver, options):
+    instance, x = instances[leaf]
+    for k, v in enumerate(x):
+        value = policy[k] if v.lb is None else max(v.lb, policy[k])
+        v.fix(value if v.ub is None else min(v.ub, value))
+    instance.PH_Rho = 0.0
+    for k in instance.PH_Index:
+        instance.PH_W[k] = 0.0
+    try:
+        decomposition.solve(instance, solver, options)
+        return pyo.value(instance.Objective)
+    except RuntimeError:
+        return None
+    finally:
+        for v in x:
+            v.unfix()
+
+# Scenarios tied by shared decisions, directly or through others: each group needs one policy for all of them
+def _groups(keys):
+    groups = []
+    for s, leaf_keys in keys.items():
+        joined = [g for g in groups if g[1] & set(leaf_keys)]
+        groups = [g for g in groups if g not in joined]
+        groups.append(({s}.union(*(g[0] for g in joined)), set(leaf_keys).union(*(g[1] for g in joined))))
+    return [[s for s in keys if s in members] for members, _ in groups]
+
+def progressive_hedging(data, rho=10.0, tol=1e-4, max_iter=50, workers=None, solver="appsi_highs",
+                        solver_options=None, proximal="tangent", log=print):
+    decomposition.check_solver(solver)
+    paths = decomposition.scenario_paths(data)
+    leaves = list(paths)
+    _, children = decomposition.tree(data)
+    split = decomposition.split_data(data, [paths[s] for s in leaves])
+    probability = {s: weight for s, (weight, _) in zip(leaves, split)}
+
+    with decomposition.PinnedPool(leaves, workers) as pool:
+        setup = {}
+        for s, (_, part) in zip(leaves, split):
+            part[None]["Compact_NA"] = {None: True}
+            setup[s] = (part, {n for n in paths[s] if children[n]}, proximal)
+        keys = pool.map(_setup, setup)
+
+        w = {s: [0.0] * len(keys[s]) for s in leaves}
+        xbar = {}
+        current_rho = 0.0
+        for iteration in range(max_iter + 1):
+            results = pool.map(_solve, {s: (w[s], [xbar.get(key, 0.0) for key in keys[s]], current_rho, tol, solver, solver_options) for s in leaves})
+
+            # Probability-weighted average of every shared decision over the scenarios that hold it
+            total, mass = {}, {}
+            for s in leaves:
+                for key, value in zip(keys[s], results[s][1]):
+                    total[key] = total.get(key, 0.0) + probability[s] * value
+                    mass[key] = mass.get(key, 0.0) + probability[s]
+            xbar = {key: total[key] / mass[key] for key in total}
+
+            gap = sum(probability[s] * sum(abs(value - xbar[key]) for key, value in zip(keys[s], results[s][1])) for s in leaves)
+            objective = sum(probability[s] * results[s][0] for s in leaves)
+            if iteration == 0:
+                lower_bound = objective  # Wait-and-see value: no penalties yet
+            log(f"PH iteration {iteration}: expected cost {objective:.4f}, nonanticipativity gap {gap:.6g}")
+            if gap <= tol:
+                break
+
+            for s in leaves:
+                w[s] = [w_k + rho * (value - xbar[key]) for w_k, key, value in zip(w[s], keys[s], results[s][1])]
+            current_rho = rho
+
+        # xbar where it is feasible; elsewhere the cheapest of the group's own scenario solutions (completed
+        # with xbar) that is feasible for every scenario of the group
+        costs = pool.map(_evaluate, {s: ([xbar[key] for key in keys[s]], solver, solver_options) for s in leaves})
+        policy = dict(xbar)
+        for group in _groups(keys):
+            if all(costs[s] is not None for s in group):
+                continue
+            best = None
+            for candidate in group:
+                values = {**xbar, **dict(zip(keys[candidate], results[candidate][1]))}
+                group_costs = pool.map(_evaluate, {s: ([values[key] for key in keys[s]], solver, solver_options) for s in group})
+                if all(cost is not None for cost in group_costs.values()):
+                    cost = sum(probability[s] * group_costs[s] for s in group)
+                    if best is None or cost < best[0]:
+                        best = (cost, values, group_costs)
+            if best is None:
+                raise RuntimeError(f"No implementable policy for scenarios {group}: neither the average nor any of their own "
+                                   f"solutions is feasible for all of them (gap {gap:.6g}); run more iterations")
+            _, values, group_costs = best
+            costs.update(group_costs)
+            policy.update({key: values[key] for s in group for key in keys[s]})
+            log(f"Averaged decisions infeasible for scenarios {group}: using the best of their own solutions")
+
+    return {
+        "objective": sum(probability[s] * costs[s] for s in leaves),  # Cost of the implementable policy
+        "expected_cost": objective,
+        "lower_bound": lower_bound,
+        "iterations": iteration + 1,  # Completed iterations, the first (wait-and-see) solve included
+        "gap": gap,
+        "converged": gap <= tol,
+        "xbar": xbar,
+        "policy": policy,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve the scenario tree with Progressive Hedging")
+    parser.add_argument("--rho", type=float, default=10.0)
+    parser.add_argument("--tol", type=float, default=1e-4)
+    parser.add_argument("--max-iter", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--solver", default="appsi_highs")
+    parser.add_argument("--proximal", choices=("tangent", "linear", "quadratic"), default="tangent")
+    args = parser.parse_args()
+
+    data = main.load_data(main.read_all_sheets(main.INPUT_EXCEL))
+    result = progressive_hedging(data, rho=args.rho, tol=args.tol, max_iter=args.max_iter, workers=args.workers,
+                                 solver=args.solver, proximal=args.proximal)
+    print("-" * 70)
+    print(f"Converged: {result['converged']} after {result['iterations']} iterations (gap {result['gap']:.6g})")
+    print(f"Wait-and-see lower bound: {result['lower_bound']:.4f}")
+    print(f"Objective of the implementable policy: {result['objective']:.4f}")
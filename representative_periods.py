@@ -0,0 +1,145 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyomo.environ as pyo
+
+import decomposition
+import main
+import scenario_tree
+
+"""
+REPRESENTATIVE PERIODS
+"""
+#Aggregates the hours of model.Time into representative periods (days, weeks, ...) so the operational layer
+#no longer grows with the full horizon:
+#  1. the horizon is cut into periods of `period` hours, each described by all its hourly input (every
+#     parameter indexed by Time: Demand, Availability_Factor, prices, activation factors, ...)
+#  2. `count` representative periods are picked with the reductions of scenario_tree.py (k-medoids or fast
+#     forward selection); every other period is represented by its nearest one
+#  3. the input is restricted to the hours of the representative periods (keeping their hour labels) and
+#       Time_Weight   hours of the horizon each hour stands for (periods represented)
+#       Period_Start  first hours of the representative periods, each is operated as a horizon of its own
+#       TimeInMonth   each hour belongs to the months of the periods it represents, with Month_Weight the
+#                     hours of that month it stands for (the grid tariff on the monthly peak y_max)
+#     are set. Load-shifting windows are kept when they lie inside one representative period.
+#The solution is de-aggregated for reporting by giving every hour of the horizon the values of the hour
+#that represents it (disaggregate, save_results_to_parquet).
+#
+#   python representative_periods.py --period 24 --count 12 --method kmedoids
+
+WEIGHTS = ("Time_Weight", "Month_Weight")
+
+# Every Time-indexed parameter as one row per remaining key, over the hours, cut into periods:
+# features[period] holds all of that period's hourly input
+def period_features(data, period):
+    data = data[None]
+    times = data["Time"][None]
+    if not times or len(times) % period:
+        raise ValueError(f"{len(times)} hours cannot be cut into periods of {period} hours")
+    position = {t: k for k, t in enumerate(times)}
+    blocks = []
+    for name, values in data.items():
+        component = getattr(main.model, name, None)
+        if not isinstance(component, pyo.Param) or name in WEIGHTS or None in values:
+            continue
+        positions = main.key_positions(component, main.model.Time)
+        if not positions:
+            continue
+        k = positions[0]
+        rows = {}
+        default = component.default()
+        for key, value in values.items():
+            key = key if isinstance(key, tuple) else (key,)
+            rest = key[:k] + key[k + 1:]
+            if rest not in rows:
+                rows[rest] = np.full(len(times), 0.0 if default is pyo.Param.NoValue else default)
+            rows[rest][position[key[k]]] = value
+        if rows:
+            array = np.array(list(rows.values()), dtype=float).reshape(len(rows), -1, period)
+            blocks.append(array.transpose(1, 0, 2).reshape(array.shape[1], -1))
+    periods = [times[k:k + period] for k in range(0, len(times), period)]
+    return np.hstack(blocks) if blocks else np.zeros((len(periods), 1)), periods
+
+# Input on `count` representative periods of `period` hours, and the representative hour of every hour
+def aggregate(data, period=24, count=12, method="kmedoids", log=print):
+    features, periods = period_features(data, period)
+    # Input that is the same in every period does not tell them apart (scenario_tree.distances would also
+    # leave it out, but on a year of hours most columns are constant)
+    features = features[:, np.ptp(features, axis=0) > 0]
+    kept, _, assign, distance = scenario_tree.reduce(features, np.full(len(periods), 1.0 / len(periods)), count, method)
+    members = np.bincount(assign, minlength=len(kept))
+    order = np.argsort(kept)
+    representatives = [periods[kept[r]] for r in order]
+    hours = [t for rep in representatives for t in rep]
+    log(f"{len(periods)} periods of {period} hours -> {len(kept)} representative periods, reduction distance {distance:.4g}")
+
+    hour_map = {}
+    for q, r in enumerate(assign):
+        hour_map.update(zip(periods[q], periods[kept[r]]))
+
+    months_of = {}
+    for (m, t) in data[None]["TimeInMonth"][None]:
+        months_of.setdefault(t, []).append(m)
+    month_weight = {}
+    for t, rep in hour_map.items():
+        for m in months_of.get(t, []):
+            month_weight[m, rep] = month_weight.get((m, rep), 0.0) + 1.0
+
+    # Load-shifting windows that lie inside one representative period
+    period_of = {t: r for r, rep in enumerate(representatives) for t in rep}
+    windows = {}
+    for (i, t) in data[None]["TimeLoadShift"][None]:
+        windows.setdefault(i, []).append(t)
+    intervals = [i for i in data[None]["LoadShiftingIntervals"][None]
+                 if i in windows and len({period_of.get(t) for t in windows[i]}) == 1 and windows[i][0] in period_of]
+
+    aggregated = main.restrict_data(data, times=hours)
+    d = aggregated[None]
+    d["Period_Start"] = {None: [rep[0] for rep in representatives[1:]]}
+    d["Time_Weight"] = {t: float(members[r]) for r in order for t in periods[kept[r]]}
+    d["TimeInMonth"] = {None: [(m, t) for t in hours for m in data[None]["Month"][None] if (m, t) in month_weight]}
+    d["Month_Weight"] = month_weight
+    d["LoadShiftingIntervals"] = {None: intervals}
+    d["TimeLoadShift"] = {None: [(i, t) for i in intervals for t in windows[i]]}
+    return aggregated, hour_map
+
+# Result tables (main.results_to_tables) at full resolution: every hour gets the rows of its representative hour
+def disaggregate(tables, hour_map):
+    hours = pd.DataFrame({"Time": list(hour_map), "Representative": list(hour_map.values())})
+    full = {}
+    for name, table in tables.items():
+        if "Time" not in table.columns:
+            full[name] = table
+            continue
+        expanded = table.rename(columns={"Time": "Representative"}).merge(hours, on="Representative")
+        index = [c for c in table.columns if c != "value"]
+        full[name] = expanded[list(table.columns)].sort_values(index, kind="stable", ignore_index=True)
+    return full
+
+def save_results_to_parquet(model_instance, hour_map, folder="Variable_Results", drop_zeros=True):
+    os.makedirs(folder, exist_ok=True)
+    for name, table in disaggregate(main.results_to_tables(model_instance, drop_zeros), hour_map).items():
+        table.to_parquet(os.path.join(folder, f"{name}.parquet"), index=False)
+    print(f"Variable results (full resolution) saved to {folder}/")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve the model on representative periods")
+    parser.add_argument("--period", type=int, default=24, help="hours per period")
+    parser.add_argument("--count", type=int, default=12, help="representative periods")
+    parser.add_argument("--method", choices=sorted(scenario_tree.METHODS), default="kmedoids")
+    parser.add_argument("--solver", default="appsi_highs")
+    parser.add_argument("--out", default=None, help="save the full-resolution results to this folder")
+    args = parser.parse_args()
+
+    data = main.load_data(main.read_all_sheets(main.INPUT_EXCEL))
+    start = time.perf_counter()
+    aggregated, hour_map = aggregate(data, args.period, args.count, args.method)
+    print(f"Aggregated in {time.perf_counter() - start:.2f} s: {len(aggregated[None]['Time'][None])} of {len(hour_map)} hours kept")
+    instance = main.model.create_instance(aggregated)
+    decomposition.solve(instance, args.solver)
+    print(f"Objective: {pyo.value(instance.Objective):.4f}")
+    if args.out:
+        save_results_to_parquet(instance, hour_map, args.out)
@@ -0,0 +1,113 @@
+import argparse
+import time
+
+import pyomo.environ as pyo
+
+import decomposition
+import main
+
+"""
+ROLLING-HORIZON SOLVE
+"""
+#model.Time is cut into windows of `window` committed hours plus `lookahead` hours that are solved but
+#re-optimised in the next window. Window boundaries are moved forward so no load-shifting interval is cut.
+#Between windows the state at the last committed hour is carried into the next window's data:
+#  q_SoC        -> Initial_SoC_Level (with Carry_Initial_State), replacing the Initial_SOC start
+#  y_out        -> Initial_Output, for the ramping limit of the first hour
+#  grid import  -> Carried_Peak, the running monthly peak that y_max cannot fall below
+#Only the last window returns storage to Initial_SOC (Enforce_End_SoC). Every window is built, solved and
+#dropped before the next, so memory follows the window size and time grows linearly with the horizon.
+#The investments must be fixed; they are not decisions of a single window.
+#
+#   python rolling_horizon.py --window 24 --lookahead 12 --solver appsi_highs
+
+# Commit boundaries (positions in the hour list) moved past any load-shifting interval they would cut
+def _snap(position, times, intervals):
+    moved = True
+    while moved and position < len(times):
+        moved = False
+        for hours in intervals.values():
+            if hours[0] < position <= hours[-1]:
+                position, moved = hours[-1] + 1, True
+    return min(position, len(times))
+
+def windows(data, window, lookahead):
+    times = data[None]["Time"][None]
+    position = {t: k for k, t in enumerate(times)}
+    intervals = {}
+    for (i, t) in data[None]["TimeLoadShift"][None]:
+        intervals.setdefault(i, []).append(position[t])
+    intervals = {i: sorted(hours) for i, hours in intervals.items()}
+
+    start = 0
+    while start < len(times):
+        commit = _snap(start + window, times, intervals)
+        end = _snap(commit + lookahead, times, intervals)
+        yield times[start:commit], times[start:end]
+        start = commit
+
+def rolling_horizon(data, window=24, lookahead=12, solver="appsi_highs", solver_options=None, log=print):
+    decomposition.check_solver(solver)
+    if not decomposition.investments_fixed(data):
+        raise ValueError("The rolling horizon needs fixed investments (v_new_tech/v_new_bat)")
+    state = {"Carry_Initial_State": {None: False}}
+    peak, tariff_weight = {}, {}
+    values = {}
+    cost = investment = 0.0
+    last_hour = data[None]["Time"][None][-1]
+    for committed, hours in windows(data, window, lookahead):
+        start = time.perf_counter()
+        part = main.restrict_data(data, times=hours)
+        part[None].update(state)
+        part[None]["Carried_Peak"] = dict(peak)
+        part[None]["Enforce_End_SoC"] = {None: hours[-1] == last_hour}
+        instance = main.model.create_instance(part)
+        try:
+            decomposition.solve(instance, solver, solver_options)
+        except RuntimeError as error:
+            raise RuntimeError(f"Window {hours[0]}-{hours[-1]}: {error}; the state carried from the previous window "
+                               f"may leave no way back to the end-of-horizon storage level, try a longer lookahead") from error
+
+        # Committed hours are final; their grid tariff is settled at the end on the monthly peaks
+        investment = pyo.value(main.investment_cost(instance))
+        cost += pyo.value(main.operational_cost(instance, committed) - main.grid_tariff(instance, committed))
+        for coefficient, y_max in main._grid_tariff_terms(instance, committed):
+            tariff_weight[y_max.index()] = tariff_weight.get(y_max.index(), 0.0) + pyo.value(coefficient)
+        committed_set = set(committed)
+        for var in instance.component_objects(pyo.Var, active=True):
+            positions = main.key_positions(getattr(main.model, var.name), main.model.Time)
+            entries = values.setdefault(var.name, {})
+            for index, v in var.items():
+                if v.value is not None and (not positions or index[positions[0]] in committed_set):
+                    entries[index] = v.value
+
+        # State at the last committed hour for the next window
+        t = committed[-1]
+        state = {
+            "Carry_Initial_State": {None: True},
+            "Initial_SoC_Level": {(n, b): pyo.value(instance.q_SoC[n, t, b]) for n in instance.Nodes_Physical for b in instance.FlexibleLoad},
+            "Initial_Output": {(n,) + key: pyo.value(instance.y_out[(n, t) + key]) for n in instance.Nodes_Physical for key in instance.TechnologyToEnergyCarrier},
+        }
+        for n in instance.Nodes_Physical:
+            for (m, tt) in instance.TimeInMonth:
+                if tt in committed_set:
+                    imported = max(pyo.value(instance.y_out[(n, tt) + key]) for key in instance.GridImport) if len(instance.GridImport) else 0.0
+                    peak[n, m] = max(peak.get((n, m), 0.0), imported)
+        log(f"Hours {committed[0]}-{committed[-1]} committed (solved up to {hours[-1]}) in {time.perf_counter() - start:.2f} s")
+        del instance
+
+    # Same terms as main.grid_tariff (collected per window above), on the final monthly peaks
+    tariff = sum(weight * peak.get(key, 0.0) for key, weight in tariff_weight.items())
+    return investment + cost + tariff, values
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve the model over overlapping time windows")
+    parser.add_argument("--window", type=int, default=24, help="hours committed per window")
+    parser.add_argument("--lookahead", type=int, default=12, help="extra hours solved but not committed")
+    parser.add_argument("--solver", default="appsi_highs")
+    args = parser.parse_args()
+
+    data = main.load_data(main.read_all_sheets(main.INPUT_EXCEL))
+    objective, _ = rolling_horizon(data, window=args.window, lookahead=args.lookahead, solver=args.solver)
+    print("-" * 70)
+    print(f"Rolling-horizon objective: {objective:.4f}")
@@ -0,0 +1,261 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.spatial.distance import cdist
+
+import generate_instance
+import main
+
+"""
+SCENARIO TREE GENERATION AND REDUCTION
+"""
+#Builds the two-stage day-ahead -> real-time tree from many price/activation paths instead of the
+#hand-authored Set_parent_coupling, Par_NodesProbability, Subset_Plan_Nodes and Subset_RT_Nodes:
+#  1. the paths are reduced to `da` day-ahead nodes on the series known at the day-ahead stage (DAY_AHEAD)
+#  2. the paths of every day-ahead node are reduced to at most `rt` real-time children on all series
+#Both reductions pick representative paths by fast forward selection (Heitsch & Roemisch) or weighted
+#k-medoids, on Euclidean distances between the standardised paths, and move the probability of every
+#path that is dropped to its nearest representative. A node takes the series of its representative path;
+#real-time children keep their parent's day-ahead series. All other node-indexed data (Demand,
+#Cost_Energy, ...) is copied from the nodes of the template input at the same position in the tree.
+#The result is written as a complete set of .tab files (main.read_tab_files) and optionally a workbook.
+#
+#Paths are a long table with columns Path, Time, optionally Probability (per path, default equal) and one
+#column per series, named as the model parameters (Spot_Price, Activation_Factor_ID_Up, ...); series that
+#are left out keep the template values. The reduction works on an n x n distance matrix, so a few thousand
+#paths are fine.
+#
+#   python scenario_tree.py --paths price_paths.csv --da 4 --rt 4 --method forward --out-dir Tree
+#   python scenario_tree.py --sample 2000 --noise 0.2 --da 3 --rt 5 --method kmedoids --out-dir Tree --excel Tree.xlsx
+
+SERIES = ("Spot_Price", "Intraday_Price", "RK_Up_Price", "RK_Dwn_Price",
+          "aFRR_Up_Capacity_Price", "aFRR_Dwn_Capacity_Price", "aFRR_Up_Activation_Price", "aFRR_Dwn_Activation_Price",
+          "Activation_Factor_UP_Regulation", "Activation_Factor_DWN_Regulation", "Activation_Factor_ID_Up", "Activation_Factor_ID_Dwn")
+DAY_AHEAD = ("Spot_Price", "aFRR_Up_Capacity_Price", "aFRR_Dwn_Capacity_Price") # Known when the day-ahead node is reached
+ACTIVATION = ("Activation_Factor_UP_Regulation", "Activation_Factor_DWN_Regulation", "Activation_Factor_ID_Up", "Activation_Factor_ID_Dwn")
+STRUCTURE = ("Nodes", "Nodes_DA", "Nodes_RT", "Parent_Node", "Node_Probability")
+
+
+##############################################################
+############################ PATHS ###########################
+##############################################################
+#Paths are kept as (names, values, probability, times): values[path, series, hour] for the series in names
+
+def read_paths(table):
+    names = [name for name in SERIES if name in table.columns]
+    paths = list(dict.fromkeys(table["Path"]))
+    times = list(dict.fromkeys(table["Time"]))
+    table = table.set_index(["Path", "Time"])
+    if table.index.duplicated().any() or len(table) != len(paths) * len(times):
+        raise ValueError("Every path needs exactly one row per hour")
+    full = pd.MultiIndex.from_product([paths, times])
+    values = table.loc[full, names].to_numpy(dtype=float).reshape(len(paths), len(times), len(names)).transpose(0, 2, 1)
+    if "Probability" in table.columns:
+        probability = table["Probability"].groupby(level=0, sort=False).first().loc[paths].to_numpy(dtype=float)
+    else:
+        probability = np.ones(len(paths))
+    return names, values, probability / probability.sum(), times
+
+# The real-time nodes of an input (for instance the hand-authored tree) as paths
+def paths_from_data(data):
+    data = data[None]
+    nodes, times = data["Nodes_RT"][None], data["Time"][None]
+    names = list(SERIES)
+    values = np.array([[[data[name].get((n, t), getattr(main.model, name).default()) for t in times] for name in names] for n in nodes], dtype=float)
+    probability = np.array([data["Node_Probability"][n] for n in nodes], dtype=float)
+    return names, values, probability / probability.sum(), times
+
+# count paths drawn from those of an input, with multiplicative noise on every hour of the price series
+# (activation factors are drawn along with their path but not perturbed)
+def sample_paths(data, count, noise=0.1, seed=0):
+    names, values, probability, times = paths_from_data(data)
+    rng = np.random.default_rng(seed)
+    drawn = values[rng.choice(len(probability), size=count, p=probability)]
+    prices = np.array([name not in ACTIVATION for name in names])
+    drawn[:, prices, :] *= 1 + noise * rng.standard_normal(drawn[:, prices, :].shape)
+    return names, drawn, np.full(count, 1.0 / count), times
+
+
+##############################################################
+######################### REDUCTION ##########################
+##############################################################
+
+# Euclidean distances between paths (rows of features), every feature centred and scaled by its standard
+# deviation. A feature whose deviation is only round-off (below rtol times its magnitude) is constant and left
+# out, rather than blown up to ~1e16. Distances are taken from the differences (cdist), not from the
+# |x|^2 + |y|^2 - 2x.y expansion, which cancels catastrophically for large coordinates.
+def distances(features, rtol=1e-9):
+    features = np.asarray(features, dtype=float)
+    x = features - features.mean(axis=0)
+    scale = x.std(axis=0)
+    varying = scale > rtol * np.abs(features).max(axis=0, initial=0.0)
+    x = x[:, varying] / scale[varying]
+    return cdist(x, x)
+
+# Fast forward selection: repeatedly add the path that most reduces the probability-weighted distance of
+# all paths to their nearest selected one. Columns are scored in chunks to bound the temporary memory.
+def forward_selection(d, probability, k, chunk=1024):
+    n = len(probability)
+    nearest = np.full(n, np.inf)
+    selected = []
+    for _ in range(min(k, n)):
+        score = np.empty(n)
+        for s in range(0, n, chunk):
+            score[s:s + chunk] = probability @ np.minimum(nearest[:, None], d[:, s:s + chunk])
+        score[selected] = np.inf
+        u = int(np.argmin(score))
+        selected.append(u)
+        nearest = np.minimum(nearest, d[:, u])
+    return np.array(selected, dtype=int)
+
+# Weighted k-medoids (alternating assignment and medoid update), started from forward selection
+def k_medoids(d, probability, k, max_iter=100):
+    medoids = forward_selection(d, probability, k)
+    for _ in range(max_iter):
+        assign = np.argmin(d[:, medoids], axis=1)
+        new = medoids.copy()
+        for c in range(len(medoids)):
+            members = np.flatnonzero(assign == c)
+            if len(members):
+                new[c] = members[np.argmin(probability[members] @ d[np.ix_(members, members)])]
+        if np.array_equal(new, medoids):
+            break
+        medoids = new
+    return medoids
+
+METHODS = {"forward": forward_selection, "kmedoids": k_medoids}
+
+# Keep k representative paths; every path's probability goes to its nearest representative. Returns the
+# representatives, their probabilities, the representative (position) of every path and the reduction
+# distance (probability-weighted distance of all paths to their representative).
+def reduce(features, probability, k, method="forward"):
+    d = distances(features)
+    kept = METHODS[method](d, probability, k)
+    assign = np.argmin(d[:, kept], axis=1)
+    assign[kept] = np.arange(len(kept))
+    weights = np.bincount(assign, weights=probability, minlength=len(kept))
+    return kept, weights, assign, float(probability @ d[np.arange(len(probability)), kept[assign]])
+
+
+##############################################################
+######################### TREE BUILDING ######################
+##############################################################
+
+# Nodes as (node, parent, probability, path): day-ahead nodes 1..da, then the real-time children of each
+# day-ahead node in turn, as in the sample tree
+def build_tree(names, values, probability, da, rt, method="forward", log=print):
+    stage = [j for j, name in enumerate(names) if name in DAY_AHEAD]
+    features = values[:, stage, :].reshape(len(probability), -1) if stage else np.zeros((len(probability), 1))
+    kept, weights, assign, distance = reduce(features, probability, da, method)
+    log(f"Day-ahead stage: {len(probability)} paths -> {len(kept)} nodes, reduction distance {distance:.4g}")
+
+    tree = [(k + 1, None, weights[k], path) for k, path in enumerate(kept)]
+    children = []
+    for k in range(len(kept)):
+        members = np.flatnonzero(assign == k)
+        conditional = probability[members] / probability[members].sum()
+        child_kept, child_weights, _, child_distance = reduce(values[members].reshape(len(members), -1), conditional, rt, method)
+        log(f"  day-ahead node {k + 1}: {len(members)} paths -> {len(child_kept)} real-time nodes, reduction distance {child_distance:.4g}")
+        children += [(k + 1, weights[k] * w, members[j]) for j, w in zip(child_kept, child_weights)]
+    tree += [(len(kept) + 1 + m, parent, p, path) for m, (parent, p, path) in enumerate(children)]
+    return tree
+
+# Template node each new node copies its other data from: day-ahead nodes by position, real-time nodes by
+# position among the children of their parent's template node
+def _node_source(template, tree):
+    parent = {child: p for (child, p) in template["Parent_Node"][None]}
+    template_da = template["Nodes_DA"][None]
+    kids = {p: [c for c in template["Nodes_RT"][None] if parent.get(c) == p] for p in template_da}
+    source, seen = {}, {}
+    for node, p, _, _ in tree:
+        if p is None:
+            source[node] = template_da[(node - 1) % len(template_da)]
+        else:
+            siblings = kids[source[p]]
+            source[node] = siblings[seen.get(p, 0) % len(siblings)]
+            seen[p] = seen.get(p, 0) + 1
+    return source
+
+# Input data for the tree: structure from the tree, the series from the representative paths, all other
+# node-indexed entries copied from the template nodes
+def tree_data(template, tree, names, values, times):
+    template = template[None]
+    if list(times) != list(template["Time"][None]):
+        raise ValueError("The paths must cover exactly the hours of the template input")
+    source = _node_source(template, tree)
+    copies = {}
+    for node, s in source.items():
+        copies.setdefault(s, []).append(node)
+
+    data = {}
+    for name, entries in template.items():
+        if name in STRUCTURE:
+            continue
+        positions = main.key_positions(getattr(main.model, name), main.model.Nodes)
+        if not positions or (None in entries and not isinstance(entries[None], list)):
+            data[name] = entries
+            continue
+        k = positions[0]
+        data[name] = {}
+        for key, value in entries.items():
+            key = key if isinstance(key, tuple) else (key,)
+            for node in copies.get(key[k], []):
+                new = key[:k] + (node,) + key[k + 1:]
+                data[name][new if len(new) > 1 else new[0]] = value
+
+    nodes = [node for node, _, _, _ in tree]
+    data["Nodes"] = {None: nodes}
+    data["Nodes_DA"] = {None: [node for node, p, _, _ in tree if p is None]}
+    data["Nodes_RT"] = {None: [node for node, p, _, _ in tree if p is not None]}
+    data["Parent_Node"] = {None: [(node, p) for node, p, _, _ in tree if p is not None]}
+    data["Node_Probability"] = {node: float(w) for node, _, w, _ in tree}
+
+    path = {node: path for node, _, _, path in tree}
+    parent = {node: p for node, p, _, _ in tree}
+    for j, name in enumerate(names):
+        data[name] = {}
+        for node in nodes:
+            # Real-time nodes keep the day-ahead series of their parent
+            owner = parent[node] if parent[node] is not None and name in DAY_AHEAD else node
+            for t, value in zip(times, values[path[owner], j].tolist()):
+                data[name][node, t] = value
+    return {None: data}
+
+# Every sheet of the input as <sheet>.tab in directory, readable with main.read_tab_files
+def write_tab_files(tables, directory):
+    os.makedirs(directory, exist_ok=True)
+    for sheet, table in tables.items():
+        with open(os.path.join(directory, f"{sheet}.tab"), "w", newline="") as f:
+            f.write(main._tab_text(table))
+    print(f"{len(tables)} .tab files written to {directory}/")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a reduced day-ahead -> real-time scenario tree from price/activation paths")
+    parser.add_argument("--paths", default=None, help="CSV of paths (Path, Time, [Probability], series...)")
+    parser.add_argument("--sample", type=int, default=None, help="instead of --paths, draw this many paths around the template's real-time nodes")
+    parser.add_argument("--noise", type=float, default=0.1, help="relative noise on the sampled prices")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--da", type=int, default=4, help="day-ahead nodes")
+    parser.add_argument("--rt", type=int, default=4, help="real-time nodes per day-ahead node (at most)")
+    parser.add_argument("--method", choices=sorted(METHODS), default="forward")
+    parser.add_argument("--out-dir", default="Tree", help="folder of the .tab files")
+    parser.add_argument("--excel", default=None, help="also write the input as a workbook")
+    args = parser.parse_args()
+
+    template_tables = main.read_all_sheets(main.INPUT_EXCEL)
+    template = main.load_data(template_tables)
+    if args.paths:
+        names, values, probability, times = read_paths(pd.read_csv(args.paths))
+    else:
+        names, values, probability, times = sample_paths(template, args.sample or 1000, args.noise, args.seed)
+    start = time.perf_counter()
+    tree = build_tree(names, values, probability, args.da, args.rt, args.method)
+    print(f"Tree with {len(tree)} nodes built from {len(probability)} paths in {time.perf_counter() - start:.2f} s")
+    tables = generate_instance.to_tables(tree_data(template, tree, names, values, times), template_tables)
+    write_tab_files(tables, args.out_dir)
+    if args.excel:
+        generate_instance.write_workbook(tables, args.excel)
+        print(f"Input written to {args.excel}")
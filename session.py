@@ -0,0 +1,107 @@
+import argparse
+import time
+
+import pyomo.environ as pyo
+from pyomo.contrib import appsi
+
+import main
+
+"""
+PERSISTENT RE-SOLVE SESSION
+"""
+#Builds the instance once and keeps it loaded in an in-memory (appsi) solver. Prices, activation factors
+#and Demand are mutable Params, so a new price path only changes coefficients: the solver is told to
+#push the new Param values and nothing else, and starts from the previous solution.
+#
+#   s = Session(data, solver="highs")
+#   s.solve()
+#   s.solve(Spot_Price={(n, t): 50.0 for n in nodes for t in hours})
+#
+#   python session.py --runs 5 --scale 0.9 1.1
+
+PERSISTENT_SOLVERS = {
+    "gurobi": appsi.solvers.Gurobi,
+    "highs": appsi.solvers.Highs,
+    "appsi_highs": appsi.solvers.Highs,
+}
+
+MUTABLE = ("Spot_Price", "Intraday_Price", "aFRR_Up_Capacity_Price", "aFRR_Dwn_Capacity_Price",
+           "aFRR_Up_Activation_Price", "aFRR_Dwn_Activation_Price", "RK_Up_Price", "RK_Dwn_Price",
+           "Activation_Factor_UP_Regulation", "Activation_Factor_DWN_Regulation",
+           "Activation_Factor_ID_Up", "Activation_Factor_ID_Dwn", "Demand")
+
+class Session:
+    def __init__(self, data, solver="highs", options=None):
+        if solver not in PERSISTENT_SOLVERS:
+            raise ValueError(f"No persistent interface for '{solver}' (choose from {', '.join(PERSISTENT_SOLVERS)})")
+        self.solver = PERSISTENT_SOLVERS[solver]()
+        if not self.solver.available():
+            raise RuntimeError(f"Solver '{solver}' is not available")
+        if solver == "gurobi":
+            self.solver.gurobi_options.update(options or {})
+        else:
+            self.solver.highs_options.update(options or {})
+        self.solver.config.load_solution = False
+        self.solver.config.warmstart = True
+
+        self.instance = main.model.create_instance(data)
+        self.solver.set_instance(self.instance)
+        # The model structure never changes after the build, only Param values
+        config = self.solver.update_config
+        config.check_for_new_or_removed_constraints = False
+        config.check_for_new_or_removed_vars = False
+        config.check_for_new_or_removed_params = False
+        config.check_for_new_objective = False
+        config.update_constraints = False
+        config.update_vars = False
+        config.update_named_expressions = False
+        config.update_objective = False
+        config.update_params = True
+
+    # Set new values {index: value} for one of the MUTABLE Params
+    def update(self, name, values):
+        if name not in MUTABLE:
+            raise ValueError(f"'{name}' cannot be changed in a session (mutable: {', '.join(MUTABLE)})")
+        param = getattr(self.instance, name)
+        for index, value in values.items():
+            param[index] = value
+
+    # Apply any updates (name={index: value}) and re-solve; returns the objective value
+    def solve(self, **updates):
+        for name, values in updates.items():
+            self.update(name, values)
+        self.check_rt_prices({index for name in ("RK_Up_Price", "RK_Dwn_Price") for index in updates.get(name, {})})
+        results = self.solver.solve(self.instance)
+        if results.termination_condition != appsi.base.TerminationCondition.optimal:
+            raise RuntimeError(f"Session solve not optimal ({results.termination_condition})")
+        results.solution_loader.load_vars()
+        return results.best_feasible_objective
+
+    # RT_Formulation "lp" only built binary_RT on the Binary_RT_Pairs, where trading both ways could pay off at the
+    # prices of the build (main.rt_binary_needed); new RK prices must not make it pay off anywhere else
+    def check_rt_prices(self, indices):
+        instance = self.instance
+        if pyo.value(instance.RT_Formulation) != "lp":
+            return
+        for (n, t) in indices:
+            if (n, t) in instance.Real_Time_Pairs and (n, t) not in instance.Binary_RT_Pairs and main.rt_binary_needed(instance, n, t):
+                raise ValueError(f"RK prices at node {n}, hour {t} make trading both ways pay off; build the session with RT_Formulation 'binary'")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-solve the model for scaled spot prices without rebuilding it")
+    parser.add_argument("--solver", default="highs", choices=sorted(PERSISTENT_SOLVERS))
+    parser.add_argument("--runs", type=int, default=5, help="price paths between the two scale factors")
+    parser.add_argument("--scale", type=float, nargs=2, default=[0.9, 1.1], help="lowest and highest spot price factor")
+    args = parser.parse_args()
+
+    data = main.load_data(main.read_all_sheets(main.INPUT_EXCEL))
+    start = time.perf_counter()
+    session = Session(data, solver=args.solver)
+    print(f"Built and loaded the instance in {time.perf_counter() - start:.2f} s")
+
+    spot = {index: pyo.value(p) for index, p in session.instance.Spot_Price.items()}
+    for k in range(args.runs):
+        factor = args.scale[0] + (args.scale[1] - args.scale[0]) * k / max(1, args.runs - 1)
+        start = time.perf_counter()
+        objective = session.solve(Spot_Price={index: factor * value for index, value in spot.items()})
+        print(f"Spot price x{factor:.3f}: objective {objective:.4f} in {time.perf_counter() - start:.2f} s")
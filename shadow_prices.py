@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import pyomo.environ as pyo
+
+import decomposition
+import main
+
+"""
+SHADOW PRICES
+"""
+#Duals of selected constraint families as dense arrays over their index sets:
+#  energy_price   EnergyBalance        (node, time, carrier)  marginal energy price per carrier
+#  grid_tariff    PeakLoad             (node, time, carrier)  value of the peak rows, summed over the hour's month
+#                                      and the import technologies and modes (GridImport) of the carrier
+#  carbon_price   CarbonEmissionLimit  (node,)  implicit price of the emission cap
+#Duals are used as the solver returns them (change in objective per unit of the row's bound as Pyomo
+#stores it). These three are divided by Node_Probability * Operating_Weight, so they are undiscounted prices
+#in the node's own scenario, and energy_price also by Time_Weight (representative periods), so it is a price
+#per hour of the horizon. Entries whose weight is zero (e.g. a node with probability 0) are NaN.
+#The non-anticipativity rows keep their (expected) duals, by (child, time, ...): every child has one parent,
+#so the parent axis is dropped rather than stored as a mostly empty child x parent array.
+#value_of_information sums their absolute values per stage (depth of the child node in the tree).
+#For a MIP the duals come from the LP with every binary fixed at its solution value.
+#Each family is read in one pass over its constraint data and scattered into the array with numpy.
+#The result can be saved next to the run's other output and loaded without re-solving.
+#
+#   python shadow_prices.py --out Results/marginal_values.npz
+
+PRICES = {"energy_price": "EnergyBalance", "grid_tariff": "PeakLoad", "carbon_price": "CarbonEmissionLimit"}
+# PeakLoad is indexed (node, month, time, technology, carrier, mode); grid_tariff keeps these axes
+GRID_TARIFF_AXES = (0, 2, 4)
+NONANTICIPATIVITY = ("DayAheadToIntraday", "IntradayToRealTimeUp", "IntradayToRealTimeDown", "ReserveCapacityDwn", "DayAheadToIntradayUp")
+
+# Dense array of a constraint family: axes (index set names), labels (one array per axis) and values
+# (NaN where the row does not exist or has no dual)
+Marginal = namedtuple("Marginal", ["axes", "labels", "values"])
+
+# (an axis at position `drop` that is determined by the others is left out)
+def _tensor(component, dual, drop=None):
+    keys = [k if isinstance(k, tuple) else (k,) for k in component.keys()]
+    values = np.fromiter((dual.get(c, np.nan) for c in component.values()), dtype=float, count=len(keys))
+    axes = main._index_columns(component) if component.is_indexed() else []
+    if drop is not None:
+        keys = [k[:drop] + k[drop + 1:] for k in keys]
+        axes = axes[:drop] + axes[drop + 1:]
+    if not axes:
+        return Marginal(axes, [], values.reshape(()) if len(values) else np.array(np.nan))
+    if not keys:
+        return Marginal(axes, [np.array([]) for _ in axes], np.empty((0,) * len(axes)))
+    index = pd.MultiIndex.from_tuples(keys, names=axes)
+    labels = [level.to_numpy() for level in index.levels]
+    array = np.full([len(level) for level in labels], np.nan)
+    array[tuple(index.codes)] = values
+    return Marginal(axes, labels, array)
+
+# Sum over every axis but those at `keep`; NaN only where every entry summed is
+def _sum_over(m, keep):
+    summed = tuple(k for k in range(len(m.axes)) if k not in keep)
+    values = np.nansum(m.values, axis=summed)
+    values[np.isnan(m.values).all(axis=summed)] = np.nan
+    return Marginal([m.axes[k] for k in keep], [m.labels[k] for k in keep], values)
+
+# Solve the LP with the binaries fixed at their current (MIP) values and import its duals. The primal
+# values of the MIP solution are restored afterwards.
+def fixed_binary_duals(instance, solver=main.SOLVER, options=None):
+    binaries = [v for v in instance.component_data_objects(pyo.Var) if v.is_binary() and not v.fixed]
+    values = [(v, v.value) for v in instance.component_data_objects(pyo.Var)]
+    if getattr(instance, "dual", None) is None:
+        instance.dual = pyo.Suffix(direction = pyo.Suffix.IMPORT)
+    # Relaxed as well as fixed, otherwise some solvers still treat the problem as a MIP (no duals)
+    for v in binaries:
+        v.domain = pyo.UnitInterval
+        v.fix(round(v.value or 0))
+    try:
+        decomposition.solve(instance, solver, options)
+    finally:
+        for v in binaries:
+            v.unfix()
+            v.domain = pyo.Binary
+        for v, value in values:
+            v.set_value(value, skip_validation=True)
+    return instance.dual
+
+# values / weight along `axis`, NaN where the weight is zero
+def _per_unit(values, weight, axis):
+    weight = np.asarray(weight, dtype=float)
+    shape = [1] * values.ndim
+    shape[axis] = -1
+    return values / np.where(weight > 0, weight, np.nan).reshape(shape)
+
+def _stage(instance):
+    parent = {child: p for (child, p) in instance.Parent_Node}
+    depth = {}
+    for n in instance.Nodes:
+        k, m = 0, n
+        while m in parent:
+            k, m = k + 1, parent[m]
+        depth[n] = k
+    return depth
+
+def marginal_values(instance, solver=main.SOLVER, options=None):
+    dual = getattr(instance, "dual", None)
+    if dual is None or not len(dual):
+        dual = fixed_binary_duals(instance, solver, options)
+
+    marginals = {}
+    for name, component in PRICES.items():
+        m = _tensor(getattr(instance, component), dual)
+        if name == "grid_tariff" and m.axes:
+            m = _sum_over(m, GRID_TARIFF_AXES)
+        if m.axes and m.values.size:
+            weight = [pyo.value(instance.Node_Probability[n] * instance.Operating_Weight[n]) for n in m.labels[0]]
+            m = m._replace(values = _per_unit(m.values, weight, 0))
+        if name == "energy_price" and m.values.size:
+            m = m._replace(values = _per_unit(m.values, [pyo.value(instance.Time_Weight[t]) for t in m.labels[1]], 1))
+        marginals[name] = m
+    for component in NONANTICIPATIVITY:
+        marginals[component] = _tensor(getattr(instance, component), dual, drop=1)
+
+    # |dual| of every non-anticipativity row, summed per depth of its child node
+    depth = _stage(instance)
+    stages = sorted(set(depth.values()) - {0})
+    information = np.zeros(len(stages))
+    for component in NONANTICIPATIVITY:
+        m = marginals[component]
+        if m.values.size:
+            per_child = np.nansum(np.abs(m.values), axis=tuple(range(1, m.values.ndim)))
+            np.add.at(information, [stages.index(depth[n]) for n in m.labels[0]], per_child)
+    marginals["value_of_information"] = Marginal(["Stage"], [np.array(stages)], information)
+    return marginals
+
+# Save in one .npz (no pickling): numeric labels keep their dtype, others are stored as strings
+def save_marginal_values(marginals, filename="Results/marginal_values.npz"):
+    arrays = {"layout": np.array(json.dumps({name: m.axes for name, m in marginals.items()}))}
+    for k, (name, m) in enumerate(marginals.items()):
+        arrays[f"m{k}"] = m.values
+        for j, labels in enumerate(m.labels):
+            arrays[f"m{k}_l{j}"] = labels if np.issubdtype(labels.dtype, np.number) else labels.astype(str)
+    np.savez_compressed(filename, **arrays)
+
+def load_marginal_values(filename="Results/marginal_values.npz"):
+    with np.load(filename) as npz:
+        layout = json.loads(str(npz["layout"]))
+        return {
+            name: Marginal(axes, [npz[f"m{k}_l{j}"] for j in range(len(axes))], npz[f"m{k}"])
+            for k, (name, axes) in enumerate(layout.items())
+        }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve the model and save its shadow prices")
+    parser.add_argument("--solver", default="appsi_highs")
+    parser.add_argument("--out", default="Results/marginal_values.npz")
+    args = parser.parse_args()
+
+    data = main.load_data(main.read_all_sheets(main.INPUT_EXCEL))
+    instance = main.model.create_instance(data)
+    decomposition.solve(instance, args.solver)
+    marginals = marginal_values(instance, solver=args.solver)
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    save_marginal_values(marginals, args.out)
+    for name, m in marginals.items():
+        print(f"{name:>24}: axes {m.axes}, shape {m.values.shape}")
+    print(f"Marginal values saved to {args.out}")
@@ -0,0 +1,138 @@
+import argparse
+import math
+import os
+import time
+
+import pyomo.environ as pyo
+
+import benders
+import decomposition
+import main
+
+"""
+MULTI-PERIOD STRATEGIC INVESTMENT
+"""
+#Stacks the input of several strategic periods (e.g. one workbook per year) into one model: the scenario tree of
+#every period is kept under its own day-ahead roots, with its nodes relabelled and tagged with Node_Period, while
+#v_new_tech/v_new_bat get one entry per period and stay installed in the later periods (new_technology and
+#new_storage in main.py). The costs of a period are discounted to its first year (Discount_Factor) and its
+#operation counted for the years it stands for (Period_Years). Everything not indexed by node (hours, technologies,
+#costs, ...) is shared by the periods and has to be the same in all of them.
+#The periods' day-ahead subtrees only share the investments, so the model is solved as
+#  extensive  - one instance of the whole tree (its subtrees in parallel when the investments are fixed)
+#  benders    - benders.py: a master over the investments of all periods, and one subproblem per day-ahead
+#               subtree, each built in its own worker from its part of the data and solved in parallel
+#
+#   python strategic.py --periods 2025=Ny_2025.xlsx 2030=Ny_2030.xlsx --discount-rate 0.05 --method benders
+
+METHODS = ("extensive", "benders")
+
+# Label of node n of the k-th period: integer nodes are shifted by k times a power of ten above the largest node
+# (period 0 keeps its labels), any other label becomes "period_node"
+def _node_labels(periods):
+    nodes = [n for data in periods.values() for n in data[None]["Nodes"][None]]
+    if all(isinstance(n, int) and n >= 0 for n in nodes):
+        shift = 10 ** len(str(max(nodes, default=0)))
+        return lambda k, p, n: n + k * shift
+    return lambda k, p, n: f"{p}_{n}"
+
+# Years each period stands for: the gap to the next period when the periods are years, otherwise one
+def period_years(labels):
+    if len(labels) > 1 and all(isinstance(p, int) for p in labels):
+        gaps = [b - a for a, b in zip(labels, labels[1:])]
+        return dict(zip(labels, gaps + gaps[-1:]))
+    return {p: 1.0 for p in labels}
+
+# Equality of shared input across periods; NaN (an empty cell) equals NaN, unlike with ==
+def _same(a, b):
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_same(a[key], b[key]) for key in a)
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return a == b
+
+# One data dictionary over all periods from {period: data} (in period order)
+def combine(periods, discount_rate=0.0, years=None):
+    labels = list(periods)
+    years = years or period_years(labels)
+    label = _node_labels(periods)
+    combined, node_period = {}, {}
+    for k, (p, data) in enumerate(periods.items()):
+        for name, values in data[None].items():
+            component = getattr(main.model, name)
+            positions = main.key_positions(component, main.model.Nodes)
+            if not positions:
+                if name not in combined:
+                    combined[name] = values
+                elif not _same(values, combined[name]):
+                    raise ValueError(f"{name} differs between strategic periods {labels[0]} and {p}; only node-indexed input may change")
+                continue
+            relabel = lambda key: label(k, p, key) if not isinstance(key, tuple) else tuple(label(k, p, x) if j in positions else x for j, x in enumerate(key))
+            if isinstance(component, pyo.Set):
+                combined.setdefault(name, {None: []})[None].extend(relabel(key) for key in values[None])
+            else:
+                combined.setdefault(name, {}).update((relabel(key), value) for key, value in values.items())
+        node_period.update((label(k, p, n), p) for n in data[None]["Nodes"][None])
+
+    combined["Strategic_Periods"] = {None: labels}
+    combined["Node_Period"] = node_period
+    combined["Period_Years"] = {p: float(years[p]) for p in labels}
+    elapsed, discount = 0.0, {}
+    for p in labels:
+        discount[p] = (1 + discount_rate) ** -elapsed
+        elapsed += years[p]
+    combined["Discount_Factor"] = discount
+    return {None: combined}
+
+# Workbooks other than main.INPUT_EXCEL get a sheet cache of their own
+def read_workbook(excel):
+    if excel == main.INPUT_EXCEL:
+        return main.load_data(main.read_all_sheets(excel))
+    stem = os.path.splitext(os.path.basename(excel))[0]
+    return main.load_data(main.read_all_sheets(excel, manifest_file=f".{stem}_manifest.json", cache_file=f"{stem}_tables.npz"))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plan investments over several strategic periods")
+    parser.add_argument("--periods", nargs="+", default=None, metavar="PERIOD[=WORKBOOK]",
+                        help="periods in order, each with its workbook (default: the Set_Strategic_Periods of the input workbook, all on its data)")
+    parser.add_argument("--discount-rate", type=float, default=0.0, help="yearly discount rate")
+    parser.add_argument("--method", choices=METHODS, default="extensive")
+    parser.add_argument("--solver", default="appsi_highs")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--lift-bounds", action="store_true", help="drop the (0, 0) bounds on v_new_tech/v_new_bat (benders only; the CAPEX limits still apply)")
+    parser.add_argument("--out", default=None, help="save the results to this folder (extensive only)")
+    args = parser.parse_args()
+
+    if args.periods:
+        sources = [entry.split("=", 1) if "=" in entry else (entry, main.INPUT_EXCEL) for entry in args.periods]
+    else:
+        base = main.load_data(main.read_all_sheets(main.INPUT_EXCEL))
+        sources = [(p, main.INPUT_EXCEL) for p in base[None]["Strategic_Periods"][None]]
+    workbooks = {excel: None for _, excel in sources}
+    for excel in workbooks:
+        workbooks[excel] = read_workbook(excel)
+    periods = {main._native_value(str(p)): workbooks[excel] for p, excel in sources}
+
+    start = time.perf_counter()
+    data = combine(periods, args.discount_rate)
+    print(f"{len(periods)} strategic periods, {len(data[None]['Nodes'][None])} nodes, combined in {time.perf_counter() - start:.2f} s")
+
+    if args.method == "benders":
+        result = benders.benders(data, workers=args.workers, solver=args.solver, lift_bounds=args.lift_bounds)
+        print(f"Converged: {result['converged']} after {result['iterations']} iterations")
+        print(f"Objective: {result['objective']:.4f} (lower bound {result['lower_bound']:.4f})")
+        for (name, index), value in result["investment"].items():
+            if value:
+                print(f"{name}[{index}] = {value:.4f}")
+    else:
+        instance = main.model.create_instance(data)
+        if decomposition.investments_fixed(data):
+            objective, _ = decomposition.solve_subtrees(data, instance, workers=args.workers, solver=args.solver)
+        else:
+            decomposition.solve(instance, args.solver)
+            objective = pyo.value(instance.Objective)
+        print(f"Objective: {objective:.4f}")
+        if args.out:
+            main.save_results_to_parquet(instance, folder=args.out)
@@ -0,0 +1,117 @@
+import argparse
+import copy
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pyomo.environ as pyo
+
+import decomposition
+import main
+
+"""
+PARAMETER SWEEP
+"""
+#Runs the model for a list of cases, each a dict of overrides on the base data:
+#  {"Cost_Imbal": 50}              - set a scalar Param
+#  {"Spot_Price": 1.1, ...}        - for an indexed Param the number scales every entry
+#Params may be named by their model name or by their sheet (Par_SpotPrice). The workbook is read once and
+#sent once to each worker of a process pool, which builds and solves the cases; one row per case is
+#returned. Each solve gets `threads` solver threads and at most cores // threads cases run at once, so
+#the cores stay busy without oversubscribing them.
+#
+#   python sweep.py --param Cost_Imbal=20,50 --param Par_SpotPrice=0.9,1,1.1 --threads 2 --out sweep.csv
+
+SHEET_TO_PARAM = {sheet: name for name, sheet in main.PARAM_SOURCES.items()}
+THREAD_OPTION = {"gurobi": "Threads", "appsi_gurobi": "Threads", "appsi_highs": "threads", "highs": "threads", "cbc": "threads", "cplex": "threads"}
+
+def apply_overrides(data, case):
+    data = copy.deepcopy(data)
+    for name, value in case.items():
+        name = SHEET_TO_PARAM.get(name, name)
+        if not isinstance(getattr(main.model, name, None), pyo.Param):
+            raise ValueError(f"Unknown parameter '{name}'")
+        values = data[None].get(name, {})
+        if not getattr(main.model, name).is_indexed():
+            data[None][name] = {None: value}
+        else:
+            data[None][name] = {index: v * value for index, v in values.items()}
+    return data
+
+# Probability-weighted totals that are cheap to compare across cases (hours weighted by Time_Weight)
+def aggregates(instance):
+    rt = [(n, instance.Node_Probability[n]) for n in instance.Nodes_RT]
+    return {
+        "investment_cost": pyo.value(main.investment_cost(instance)),
+        "operational_cost": pyo.value(main.operational_cost(instance)),
+        "grid_import": sum(p * sum(instance.Time_Weight[t] * pyo.value(instance.y_out[(n, t) + key]) for t in instance.Time for key in instance.GridImport) for n, p in rt),
+        "grid_peak": sum(p * sum(pyo.value(instance.y_max[n, m]) for m in instance.Month) for n, p in rt),
+        "day_ahead_volume": sum(instance.Node_Probability[n] * sum(instance.Time_Weight[t] * pyo.value(instance.x_DA[instance.Market_Node[n], t]) for t in instance.Time) for n in instance.Nodes_DA),
+    }
+
+def run_case(data, case, solver, options):
+    row = dict(case)
+    start = time.perf_counter()
+    instance = main.model.create_instance(apply_overrides(data, case))
+    row["build_time"] = time.perf_counter() - start
+    start = time.perf_counter()
+    try:
+        decomposition.solve(instance, solver, options)
+    except RuntimeError as error:
+        row.update(status=str(error), solve_time=time.perf_counter() - start)
+        return row
+    row.update(status="optimal", solve_time=time.perf_counter() - start, objective=pyo.value(instance.Objective))
+    row.update(aggregates(instance))
+    return row
+
+# The base data is sent once per worker process (pool initializer) instead of once per case
+_DATA = None
+
+def _init_worker(data):
+    global _DATA
+    _DATA = data
+
+def _run_case(case, solver, options):
+    return run_case(_DATA, case, solver, options)
+
+# Cartesian product of {name: [values]} as a list of cases
+def grid(values):
+    names = list(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*(values[name] for name in names))]
+
+def sweep(data, cases, solver="appsi_highs", threads=1, workers=None, options=None):
+    decomposition.check_solver(solver)
+    options = dict(options or {})
+    if solver in THREAD_OPTION:
+        options[THREAD_OPTION[solver]] = threads
+    if not cases:
+        return pd.DataFrame()
+    workers = min(len(cases), workers or max(1, (os.cpu_count() or 1) // threads))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(data,)) as pool:
+        rows = list(pool.map(_run_case, cases, itertools.repeat(solver), itertools.repeat(options)))
+    return pd.DataFrame(rows)
+
+def _values(arguments):
+    values = {}
+    for argument in arguments or []:
+        name, _, numbers = argument.partition("=")
+        values[name] = [float(v) for v in numbers.split(",")]
+    return values
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve the model for a grid of parameter overrides")
+    parser.add_argument("--param", action="append", metavar="NAME=V1,V2", help="values of a scalar parameter or factors for an indexed one")
+    parser.add_argument("--solver", default="appsi_highs")
+    parser.add_argument("--threads", type=int, default=1, help="solver threads per case")
+    parser.add_argument("--workers", type=int, default=None, help="cases solved at once (default cores // threads)")
+    parser.add_argument("--out", default="sweep.csv")
+    args = parser.parse_args()
+
+    values = _values(args.param)
+    data = main.load_data(main.read_all_sheets(main.INPUT_EXCEL))
+    table = sweep(data, grid(values), solver=args.solver, threads=args.threads, workers=args.workers)
+    table.to_csv(args.out, index=False)
+    print(table.to_string(index=False))
+    print(f"Results saved to {args.out}")
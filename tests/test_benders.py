@@ -0,0 +1,36 @@
+import os
+import sys
+
+import numpy as np
+import pyomo.environ as pyo
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import benders
+import decomposition
+import main
+
+OPTIONS = {"mip_rel_gap": 0}
+
+# Benders on the sample tree against the extensive form, with the sample's investment bounds and lifted
+@pytest.fixture(scope="module")
+def data(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("cache")
+    tables = main.read_all_sheets(os.path.join(ROOT, main.INPUT_EXCEL), manifest_file=str(folder / "manifest.json"), cache_file=str(folder / "cache.npz"))
+    return main.load_data(tables)
+
+def extensive_form(data, lift_bounds):
+    instance = main.model.create_instance(data)
+    if lift_bounds:
+        benders._lift_bounds(instance)
+    decomposition.solve(instance, "appsi_highs", OPTIONS)
+    return pyo.value(instance.Objective)
+
+@pytest.mark.parametrize("lift_bounds", [False, True])
+def test_same_objective(data, lift_bounds):
+    result = benders.benders(data, solver_options=OPTIONS, lift_bounds=lift_bounds, log=lambda *args: None)
+    assert result["converged"]
+    assert result["lower_bound"] <= result["objective"] + 1e-6
+    assert np.isclose(result["objective"], extensive_form(data, lift_bounds), rtol=1e-4, atol=0)
@@ -0,0 +1,39 @@
+import os
+import sys
+
+import numpy as np
+import pyomo.environ as pyo
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import decomposition
+import main
+import matrix_backend
+
+# Both backends on the sample workbook: same rows, columns and optimum
+@pytest.fixture(scope="module")
+def data(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("cache")
+    tables = main.read_all_sheets(os.path.join(ROOT, main.INPUT_EXCEL), manifest_file=str(folder / "manifest.json"), cache_file=str(folder / "cache.npz"))
+    return main.load_data(tables)
+
+@pytest.fixture(scope="module")
+def instance(data):
+    return main.model.create_instance(data)
+
+@pytest.fixture(scope="module")
+def mm(data):
+    return matrix_backend.build(data)
+
+def test_same_size(instance, mm):
+    rows = sum(1 for _ in instance.component_data_objects(pyo.Constraint, active=True))
+    columns = sum(1 for _ in instance.component_data_objects(pyo.Var))
+    assert mm.A.shape == (rows, columns)
+
+def test_same_objective(instance, mm):
+    # Both to a zero MIP gap: within the default gap the two optima need not agree to rtol
+    decomposition.solve(instance, "appsi_highs", {"mip_rel_gap": 0})
+    objective, _ = matrix_backend.solve(mm, {"mip_rel_gap": 0})
+    assert np.isclose(objective, pyo.value(instance.Objective), rtol=1e-6, atol=0)
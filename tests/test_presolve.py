@@ -0,0 +1,61 @@
+import os
+import sys
+
+import numpy as np
+import pyomo.environ as pyo
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import main
+import presolve
+import shadow_prices
+
+OPTIONS = {"mip_rel_gap": 0}
+
+# The sample solved as main.py does it, with and without presolve
+@pytest.fixture(scope="module")
+def data(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("cache")
+    tables = main.read_all_sheets(os.path.join(ROOT, main.INPUT_EXCEL), manifest_file=str(folder / "manifest.json"), cache_file=str(folder / "cache.npz"))
+    return main.load_data(tables)
+
+# With RT_Formulation "lp" the sample has no binary rows, so the solver returns duals, imported as in main.py
+def solve(data, use_presolve):
+    data = {None: dict(data[None], RT_Formulation={None: "lp"})}
+    instance = main.model.create_instance(data)
+    instance.dual = pyo.Suffix(direction=pyo.Suffix.IMPORT)
+    instance.rc = pyo.Suffix(direction=pyo.Suffix.IMPORT)
+    presolved = presolve.presolve(instance, log=None) if use_presolve else None
+    result = pyo.SolverFactory("appsi_highs").solve(instance, options=OPTIONS)
+    assert result.solver.termination_condition == pyo.TerminationCondition.optimal
+    objective = pyo.value(instance.Objective)
+    if presolved is not None:
+        presolved.undo()
+    return instance, objective
+
+@pytest.fixture(scope="module")
+def plain(data):
+    return solve(data, False)
+
+@pytest.fixture(scope="module")
+def reduced(data):
+    return solve(data, True)
+
+def test_objective(plain, reduced):
+    assert np.isclose(reduced[1], plain[1], rtol=1e-9, atol=0)
+    assert np.isclose(pyo.value(reduced[0].Objective), plain[1], rtol=1e-9, atol=0)
+
+def test_undo(reduced):
+    instance, _ = reduced
+    assert not len(instance.dual) and not len(instance.rc)
+    assert all(c.active for c in instance.component_data_objects(pyo.Constraint))
+
+def test_marginal_values(plain, reduced):
+    expected = shadow_prices.marginal_values(plain[0], solver="appsi_highs", options=OPTIONS)
+    actual = shadow_prices.marginal_values(reduced[0], solver="appsi_highs", options=OPTIONS)
+    assert expected.keys() == actual.keys()
+    for name, m in expected.items():
+        assert actual[name].axes == m.axes, name
+        assert np.allclose(actual[name].values, m.values, rtol=1e-6, atol=1e-6, equal_nan=True), name
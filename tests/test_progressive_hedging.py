@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pyomo.environ as pyo
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import decomposition
+import main
+import progressive_hedging
+
+# PH on the sample tree against the extensive form
+@pytest.fixture(scope="module")
+def data(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("cache")
+    tables = main.read_all_sheets(os.path.join(ROOT, main.INPUT_EXCEL), manifest_file=str(folder / "manifest.json"), cache_file=str(folder / "cache.npz"))
+    return main.load_data(tables)
+
+@pytest.fixture(scope="module")
+def extensive_form(data):
+    instance = main.model.create_instance(data)
+    decomposition.solve(instance, "appsi_highs", {"mip_rel_gap": 0})
+    return pyo.value(instance.Objective)
+
+def test_reaches_extensive_form(data, extensive_form):
+    result = progressive_hedging.progressive_hedging(data, rho=10.0, max_iter=30, solver_options={"mip_rel_gap": 0}, log=lambda *args: None)
+    # The policy is implementable, so it costs at least the optimum; 30 iterations bring it within 0.5 %
+    assert result["lower_bound"] <= extensive_form + 1e-6
+    assert extensive_form - 1e-6 <= result["objective"] <= extensive_form * 1.005
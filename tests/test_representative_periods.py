@@ -0,0 +1,47 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import generate_instance
+import main
+import representative_periods
+
+PERIOD = 6
+
+# Two days of noisy hours grown from the sample, aggregated to representative periods of six hours
+@pytest.fixture(scope="module")
+def data(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("cache")
+    tables = main.read_all_sheets(os.path.join(ROOT, main.INPUT_EXCEL), manifest_file=str(folder / "manifest.json"), cache_file=str(folder / "cache.npz"))
+    return generate_instance.generate(main.load_data(tables), da=2, rt=2, hours=48, months=2, noise=0.2)
+
+@pytest.mark.parametrize("method", ["kmedoids", "forward"])
+def test_nearest_representative(data, method):
+    aggregated, hour_map = representative_periods.aggregate(data, PERIOD, 3, method, log=lambda *args: None)
+    features, periods = representative_periods.period_features(data, PERIOD)
+    first = {rep[0]: q for q, rep in enumerate(periods)}
+    representatives = sorted({first[hour_map[rep[0]]] for rep in periods})
+    assert len(representatives) == 3
+    assert all(hour_map[periods[r][0]] == periods[r][0] for r in representatives)
+
+    # Standardised distances, constant columns left out, computed pair by pair
+    x = features[:, np.ptp(features, axis=0) > 0]
+    x = (x - x.mean(axis=0)) / x.std(axis=0)
+    for q, rep in enumerate(periods):
+        chosen = first[hour_map[rep[0]]]
+        assert [hour_map[t] for t in rep] == periods[chosen]
+        distance = {r: np.linalg.norm(x[q] - x[r]) for r in representatives}
+        assert distance[chosen] <= min(distance.values()) + 1e-9
+
+def test_weights(data):
+    aggregated, hour_map = representative_periods.aggregate(data, PERIOD, 3, log=lambda *args: None)
+    hours = len(data[None]["Time"][None])
+    assert len(hour_map) == hours
+    assert np.isclose(sum(aggregated[None]["Time_Weight"].values()), hours)
+    assert np.isclose(sum(aggregated[None]["Month_Weight"].values()), len(data[None]["TimeInMonth"][None]))
+    assert len(aggregated[None]["Time"][None]) == 3 * PERIOD
@@ -0,0 +1,45 @@
+import os
+import sys
+
+import numpy as np
+import pyomo.environ as pyo
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import decomposition
+import main
+import rolling_horizon
+
+OPTIONS = {"mip_rel_gap": 0}
+
+# The rolling horizon on the sample hours: one window is the full model, shorter ones stitch to a feasible plan
+@pytest.fixture(scope="module")
+def data(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("cache")
+    tables = main.read_all_sheets(os.path.join(ROOT, main.INPUT_EXCEL), manifest_file=str(folder / "manifest.json"), cache_file=str(folder / "cache.npz"))
+    return main.load_data(tables)
+
+def test_single_window(data):
+    instance = main.model.create_instance(data)
+    decomposition.solve(instance, "appsi_highs", OPTIONS)
+    hours = len(data[None]["Time"][None])
+    objective, _ = rolling_horizon.rolling_horizon(data, window=hours, lookahead=0, solver_options=OPTIONS, log=lambda *args: None)
+    assert np.isclose(objective, pyo.value(instance.Objective), rtol=1e-6, atol=0)
+
+# The committed hours of all windows, put into the full model, satisfy every row (so the storage level, output
+# and peak carried across the boundaries connect) and cost what the rolling horizon reports
+def test_carried_state(data):
+    assert len(list(rolling_horizon.windows(data, 1, 1))) > 1
+    objective, values = rolling_horizon.rolling_horizon(data, window=1, lookahead=1, solver_options=OPTIONS, log=lambda *args: None)
+    instance = main.model.create_instance(data)
+    for name, entries in values.items():
+        var = getattr(instance, name)
+        for index, value in entries.items():
+            var[index].set_value(value, skip_validation=True)
+    for constraint in instance.component_data_objects(pyo.Constraint, active=True):
+        body = pyo.value(constraint.body)
+        assert constraint.lower is None or body >= pyo.value(constraint.lower) - 1e-6, constraint.name
+        assert constraint.upper is None or body <= pyo.value(constraint.upper) + 1e-6, constraint.name
+    assert np.isclose(objective, pyo.value(instance.Objective), rtol=1e-6, atol=0)
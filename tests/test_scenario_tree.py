@@ -0,0 +1,47 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import main
+import scenario_tree
+
+# Reduction of paths drawn around the sample tree
+@pytest.fixture(scope="module")
+def paths(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("cache")
+    tables = main.read_all_sheets(os.path.join(ROOT, main.INPUT_EXCEL), manifest_file=str(folder / "manifest.json"), cache_file=str(folder / "cache.npz"))
+    return scenario_tree.sample_paths(main.load_data(tables), 200, noise=0.2)
+
+# Pairwise norms of the standardised differences, with the constant features left out
+def direct_distances(features):
+    varying = np.ptp(features, axis=0) > 0
+    x = features[:, varying]
+    x = (x - x.mean(axis=0)) / x.std(axis=0)
+    return np.array([[np.linalg.norm(a - b) for b in x] for a in x])
+
+def test_distances(paths):
+    names, values, probability, _ = paths
+    features = values.reshape(len(probability), -1)
+    assert np.allclose(scenario_tree.distances(features), direct_distances(features), rtol=1e-9, atol=1e-9)
+
+def test_distances_large_offset():
+    rng = np.random.default_rng(0)
+    features = 1e8 + rng.standard_normal((30, 4))
+    features[:, 2] = 1e8 / 3  # constant, and its mean/std only round-off
+    assert np.allclose(scenario_tree.distances(features), direct_distances(features), rtol=1e-9, atol=1e-9)
+
+def test_tree_probabilities(paths):
+    names, values, probability, _ = paths
+    tree = scenario_tree.build_tree(names, values, probability, 3, 4, log=lambda *args: None)
+    day_ahead = {node: p for node, parent, p, _ in tree if parent is None}
+    real_time = [(parent, p) for _, parent, p, _ in tree if parent is not None]
+    assert len(day_ahead) == 3 and len(real_time) == 12
+    assert np.isclose(sum(day_ahead.values()), 1.0)
+    assert np.isclose(sum(p for _, p in real_time), 1.0)
+    for node, p in day_ahead.items():
+        assert np.isclose(sum(q for parent, q in real_time if parent == node), p)
@@ -0,0 +1,50 @@
+import copy
+import os
+import sys
+
+import numpy as np
+import pyomo.environ as pyo
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import decomposition
+import main
+import strategic
+
+# Strategic periods stacked from copies of the sample against the sample itself
+@pytest.fixture(scope="module")
+def data(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("cache")
+    tables = main.read_all_sheets(os.path.join(ROOT, main.INPUT_EXCEL), manifest_file=str(folder / "manifest.json"), cache_file=str(folder / "cache.npz"))
+    return main.load_data(tables)
+
+def objective(data):
+    instance = main.model.create_instance(data)
+    decomposition.solve(instance, "appsi_highs", {"mip_rel_gap": 0})
+    return pyo.value(instance.Objective)
+
+@pytest.fixture(scope="module")
+def base(data):
+    return objective(data)
+
+def test_single_period(data, base):
+    combined = strategic.combine({2025: data})
+    assert combined[None]["Nodes"] == {None: data[None]["Nodes"][None]}
+    assert np.isclose(objective(combined), base, rtol=1e-6, atol=0)
+
+# With the sample's investments fixed the periods do not interact: each costs the base for the years it stands
+# for, discounted to the first year
+@pytest.mark.parametrize("rate", [0.0, 0.05])
+def test_identical_periods(data, base, rate):
+    assert decomposition.investments_fixed(data)
+    combined = strategic.combine({2025: data, 2030: data}, discount_rate=rate)
+    assert np.isclose(objective(combined), base * 5 * (1 + (1 + rate) ** -5), rtol=1e-6, atol=0)
+
+def test_shared_input(data):
+    changed = copy.deepcopy(data)
+    changed[None]["Cost_Imbal"] = {None: 2 * data[None]["Cost_Imbal"][None] + 1}
+    with pytest.raises(ValueError, match="Cost_Imbal"):
+        strategic.combine({2025: data, 2030: changed})
+    assert strategic._same({1: float("nan"), 2: [1.0]}, {1: float("nan"), 2: [1.0]})
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import numpy as np
+import pyomo.environ as pyo
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import decomposition
+import main
+import sweep
+
+OPTIONS = {"mip_rel_gap": 0}
+
+# Sweep rows on the sample against a solve of each case in this process
+@pytest.fixture(scope="module")
+def data(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("cache")
+    tables = main.read_all_sheets(os.path.join(ROOT, main.INPUT_EXCEL), manifest_file=str(folder / "manifest.json"), cache_file=str(folder / "cache.npz"))
+    return main.load_data(tables)
+
+def test_overrides(data):
+    case = sweep.apply_overrides(data, {"Cost_Imbal": 50, "Par_SpotPrice": 1.1})
+    assert case[None]["Cost_Imbal"] == {None: 50}
+    assert case[None]["Spot_Price"] == {index: 1.1 * value for index, value in data[None]["Spot_Price"].items()}
+    assert data[None]["Spot_Price"] != case[None]["Spot_Price"]  # the base data is left as it was
+
+def test_aggregates(data):
+    cases = sweep.grid({"Cost_Imbal": [20, 50], "Par_SpotPrice": [1.0, 1.1]})
+    table = sweep.sweep(data, cases, workers=2, options=OPTIONS)
+    assert len(table) == 4 and (table["status"] == "optimal").all()
+    for case, row in zip(cases, table.to_dict("records")):
+        instance = main.model.create_instance(sweep.apply_overrides(data, case))
+        decomposition.solve(instance, "appsi_highs", OPTIONS)
+        p, w = instance.Node_Probability, instance.Time_Weight
+        grid_import = sum(p[n] * w[t] * instance.y_out[(n, t) + key].value for n in instance.Nodes_RT for t in instance.Time for key in instance.GridImport)
+        grid_peak = sum(p[n] * instance.y_max[n, m].value for n in instance.Nodes_RT for m in instance.Month)
+        day_ahead = sum(p[n] * w[t] * instance.x_DA[instance.Market_Node[n], t].value for n in instance.Nodes_DA for t in instance.Time)
+        assert np.isclose(row["objective"], pyo.value(instance.Objective), rtol=1e-6, atol=0)
+        assert np.isclose(row["investment_cost"] + row["operational_cost"], row["objective"], rtol=1e-6, atol=0)
+        assert np.isclose(row["grid_import"], grid_import, rtol=1e-6, atol=1e-6)
+        assert np.isclose(row["grid_peak"], grid_peak, rtol=1e-6, atol=1e-6)
+        assert np.isclose(row["day_ahead_volume"], day_ahead, rtol=1e-6, atol=1e-6)
+
+def test_empty(data):
+    assert sweep.sweep(data, []).empty